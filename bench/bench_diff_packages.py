@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Diff two synthetic 50k-entry packages with DiffPackageFiles(), and
+report the time, and the peak memory tracemalloc saw (measured in a
+second run, since tracing slows everything down).
+"""
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import benchlib
+import freenasOS.PackageFile as PackageFile
+
+
+def usage():
+    print("Usage: %s [-n entries] [-c percent-changed]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def MakePackages(work, nentries, changed):
+    # The new version changes changed percent of the files, and
+    # removes and adds 1% each.
+    old_files = benchlib.PackageFiles("bench", nentries, size=64)
+    new_files = {}
+    for (i, path) in enumerate(sorted(old_files)):
+        if i % 100 == 0:
+            continue
+        if i % 100 <= changed:
+            new_files[path] = benchlib.FileData(path, 64, "2")
+        else:
+            new_files[path] = old_files[path]
+    for i in range(nentries // 100):
+        path = "/usr/local/bench/new/f%06d" % i
+        new_files[path] = benchlib.FileData(path, 64, "2")
+    pkg1 = os.path.join(work, "bench-1.tgz")
+    pkg2 = os.path.join(work, "bench-2.tgz")
+    benchlib.MakePackage(pkg1, "bench", "1", old_files)
+    benchlib.MakePackage(pkg2, "bench", "2", new_files)
+    return (pkg1, pkg2)
+
+
+if __name__ == "__main__":
+    nentries = 50000
+    changed = 5
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:c:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            nentries = int(a)
+        elif o == "-c":
+            changed = int(a)
+        else:
+            usage()
+
+    work = tempfile.mkdtemp(prefix="bench-diff-")
+    try:
+        (pkg1, pkg2) = MakePackages(work, nentries, changed)
+        delta = os.path.join(work, "bench-1-2.tgz")
+        with benchlib.Timer() as t:
+            PackageFile.DiffPackageFiles(pkg1, pkg2, delta)
+        os.unlink(delta)
+        tracemalloc.start()
+        PackageFile.DiffPackageFiles(pkg1, pkg2, delta)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("Diffing two %d-entry packages, %d%% of the files changed" % (nentries, changed))
+        benchlib.Report([("%.2f" % t.elapsed, "%.1f" % (peak / 1048576.0),
+                          os.path.getsize(delta))],
+                        header=("seconds", "peak MB", "delta bytes"))
+    finally:
+        shutil.rmtree(work)
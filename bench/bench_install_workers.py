@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Install a synthetic 10-package manifest with Installer.InstallPackages(),
+once for each number of workers (freenas-install -j), and report the
+wall time.  With more than one worker, the following packages are
+decompressed in the background while each package is installed.
+"""
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+
+import benchlib
+import freenasOS.Configuration as Configuration
+import freenasOS.Installer as Installer
+import freenasOS.Manifest as Manifest
+import freenasOS.Package as Package
+
+
+def usage():
+    print("Usage: %s [-n packages] [-f files] [-s size] [-j workers[,workers...]]" % sys.argv[0],
+          file=sys.stderr)
+    sys.exit(1)
+
+
+def MakePackages(pkg_dir, npackages, nfiles, size):
+    packages = []
+    for i in range(npackages):
+        name = "bench%02d" % i
+        checksum = benchlib.MakePackage(os.path.join(pkg_dir, "%s-1.tgz" % name), name, "1",
+                                        benchlib.PackageFiles(name, nfiles, size=size))
+        packages.append(Package.Package(name, "1", checksum))
+    return packages
+
+
+def Install(work, pkg_dir, packages, workers):
+    root = os.path.join(work, "root")
+    conf = Configuration.Configuration(root=root, file=os.path.join(work, "update.conf"))
+    conf.SetPackageDir(pkg_dir)
+    manifest = Manifest.Manifest(conf, require_signature=False)
+    manifest.SetPackages(packages)
+    installer = Installer.Installer(config=conf, manifest=manifest, root=root)
+    installer.trampoline = False
+    installer.workers = workers
+    installer.GetPackages()
+    try:
+        with benchlib.Timer() as t:
+            if installer.InstallPackages() is not True:
+                raise Exception("Could not install packages")
+    finally:
+        for pkg in installer.Packages():
+            for pkgfile in pkg.values():
+                pkgfile.close()
+        shutil.rmtree(root)
+    return t.elapsed
+
+
+if __name__ == "__main__":
+    npackages = 10
+    nfiles = 1000
+    size = 64 * 1024
+    worker_counts = [1, 2, 4]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:f:s:j:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            npackages = int(a)
+        elif o == "-f":
+            nfiles = int(a)
+        elif o == "-s":
+            size = int(a)
+        elif o == "-j":
+            worker_counts = [int(w) for w in a.split(",")]
+        else:
+            usage()
+
+    work = tempfile.mkdtemp(prefix="bench-install-")
+    try:
+        pkg_dir = os.path.join(work, "Packages")
+        os.makedirs(pkg_dir)
+        packages = MakePackages(pkg_dir, npackages, nfiles, size)
+        results = []
+        for workers in worker_counts:
+            results.append((workers, "%.2f" % Install(work, pkg_dir, packages, workers)))
+        print("Installing %d packages of %d %d-byte files" % (npackages, nfiles, size))
+        benchlib.Report(results, header=("workers", "seconds"))
+    finally:
+        shutil.rmtree(work)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Load every manifest in a large synthetic archive, keeping the
+Package objects (as the release tools' Check, Rebuild, and Dump do),
+and measure the memory used with tracemalloc.  For comparison, the
+same manifests are loaded keeping only their package dictionaries,
+so the difference is the cost of the Package objects themselves.
+"""
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import benchlib
+import freenasOS.Manifest as Manifest
+import freenasOS.Package as Package
+
+TRAIN = "FreeNAS-Bench"
+
+
+def usage():
+    print("Usage: %s [-m manifests] [-p packages] [-u updates]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def MakeArchive(archive, nmanifests, npackages, nupdates):
+    # Each sequence has a new version of every package, with delta
+    # packages from the previous nupdates versions.
+    paths = []
+    train_dir = os.path.join(archive, TRAIN)
+    os.makedirs(train_dir)
+    for seq in range(nmanifests):
+        mani = Manifest.Manifest(require_signature=False)
+        mani.SetTrain(TRAIN)
+        mani.SetSequence("%s-%06d" % (TRAIN, seq))
+        packages = []
+        for p in range(npackages):
+            pkg = Package.Package("bench-pkg%03d" % p, str(seq), "%064x" % (seq * npackages + p))
+            pkg.SetSize(1024 * (p + 1))
+            for old in range(max(seq - nupdates, 0), seq):
+                pkg.AddUpdate(str(old), "%064x" % old, size=512)
+            packages.append(pkg)
+        mani.SetPackages(packages)
+        path = os.path.join(train_dir, mani.Sequence())
+        mani.StorePath(path)
+        paths.append(path)
+    return paths
+
+
+def Load(paths, objects):
+    # Returns (current, peak) bytes allocated while loading, and how
+    # many packages were kept.
+    kept = []
+    tracemalloc.start()
+    for path in paths:
+        mani = Manifest.Manifest(require_signature=False)
+        mani.LoadPath(path)
+        if objects:
+            kept.extend(mani.Packages())
+        else:
+            kept.extend(mani.dict()[Manifest.PACKAGES_KEY])
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (current, peak, len(kept))
+
+
+if __name__ == "__main__":
+    nmanifests = 500
+    npackages = 50
+    nupdates = 3
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "m:p:u:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-m":
+            nmanifests = int(a)
+        elif o == "-p":
+            npackages = int(a)
+        elif o == "-u":
+            nupdates = int(a)
+        else:
+            usage()
+
+    archive = tempfile.mkdtemp(prefix="bench-archive-")
+    try:
+        paths = MakeArchive(archive, nmanifests, npackages, nupdates)
+        results = []
+        for (label, objects) in (("dicts", False), ("Package", True)):
+            (current, peak, count) = Load(paths, objects)
+            results.append((label, count, "%.1f" % (current / 1048576.0),
+                            "%.1f" % (peak / 1048576.0), current // count))
+        print("Loading %d manifests of %d packages" % (nmanifests, npackages))
+        benchlib.Report(results, header=("kept", "packages", "MB", "peak MB", "bytes/package"))
+    finally:
+        shutil.rmtree(archive)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Time the Manifest package accessors on a ~300-package manifest:
+Packages() (copies of the cached Package objects) against building
+every Package from the manifest dictionary, as it used to; finding
+each package with Package(name) against scanning Packages(); and
+DiffManifests() against a newer manifest.
+"""
+import copy
+import getopt
+import sys
+import timeit
+
+import benchlib
+import freenasOS.Manifest as Manifest
+import freenasOS.Package as Package
+
+
+def usage():
+    print("Usage: %s [-p packages] [-u updates] [-r repeat]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def MakeManifest(sequence, npackages, nupdates):
+    mani = Manifest.Manifest(require_signature=False)
+    mani.SetTrain("FreeNAS-Bench")
+    mani.SetSequence(str(sequence))
+    packages = []
+    for p in range(npackages):
+        # Every third package changes in the next sequence.
+        version = "%d" % (sequence if p % 3 == 0 else 1)
+        pkg = Package.Package("bench-pkg%03d" % p, version, "%064x" % p)
+        for old in range(nupdates):
+            pkg.AddUpdate("0.%d" % old, "%064x" % old, size=512)
+        packages.append(pkg)
+    mani.SetPackages(packages)
+    return mani
+
+
+def Time(func, repeat):
+    # Milliseconds per call, best of 3.
+    return "%.3f" % (min(timeit.repeat(func, number=repeat, repeat=3)) * 1000.0 / repeat)
+
+
+if __name__ == "__main__":
+    npackages = 300
+    nupdates = 3
+    repeat = 100
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "p:u:r:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-p":
+            npackages = int(a)
+        elif o == "-u":
+            nupdates = int(a)
+        elif o == "-r":
+            repeat = int(a)
+        else:
+            usage()
+
+    old = MakeManifest(1, npackages, nupdates)
+    new = MakeManifest(2, npackages, nupdates)
+    raw = copy.deepcopy(old.dict()[Manifest.PACKAGES_KEY])
+    names = [p[Package.NAME_KEY] for p in raw]
+
+    def Scan():
+        for name in names:
+            for pkg in old.Packages():
+                if pkg.Name() == name:
+                    break
+
+    def Lookup():
+        for name in names:
+            old.Package(name)
+
+    results = [
+        ("Packages(), rebuilt", Time(lambda: [Package.Package(p) for p in raw], repeat)),
+        ("Packages(), cached", Time(old.Packages, repeat)),
+        ("find each package, scan", Time(Scan, max(repeat // 100, 1))),
+        ("find each package, Package(name)", Time(Lookup, repeat)),
+        ("DiffManifests()", Time(lambda: Manifest.DiffManifests(old, new), repeat)),
+    ]
+    print("Manifest of %d packages, %d updates each" % (npackages, nupdates))
+    benchlib.Report(results, header=("operation", "ms/call"))
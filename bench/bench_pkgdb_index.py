@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Time per-package lookups (FindFilesForPackage and
+FindScriptForPackage) in a package database with a large files
+table, with the schema's indexes, and again after dropping them
+(which is what a database from before the schema upgrades had).
+"""
+import getopt
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import benchlib
+import freenasOS.Configuration as Configuration
+
+
+def usage():
+    print("Usage: %s [-n rows] [-p packages]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def FillDatabase(pkgdb, nrows, npackages):
+    rows = []
+    for i in range(nrows):
+        pkg = "pkg%04d" % (i % npackages)
+        rows.append((pkg, "/usr/local/%s/f%07d" % (pkg, i), "file", "-", 0, 0, 0, 0o644))
+    pkgdb.AddFilesBulk(rows)
+    for p in range(npackages):
+        pkgdb.AddPackage("pkg%04d" % p, "1", {"post-install": "true"})
+
+
+def LookupAll(pkgdb, npackages):
+    with benchlib.Timer() as t:
+        for p in range(npackages):
+            pkgdb.FindFilesForPackage("pkg%04d" % p)
+            pkgdb.FindScriptForPackage("pkg%04d" % p, "post-install")
+    return t.elapsed
+
+
+if __name__ == "__main__":
+    nrows = 100000
+    npackages = 200
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:p:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            nrows = int(a)
+        elif o == "-p":
+            npackages = int(a)
+        else:
+            usage()
+
+    root = tempfile.mkdtemp(prefix="bench-pkgdb-")
+    try:
+        pkgdb = Configuration.PackageDB(root)
+        FillDatabase(pkgdb, nrows, npackages)
+        results = []
+        indexed = LookupAll(pkgdb, npackages)
+        results.append(("yes", "%.2f" % (indexed * 1000.0 / npackages)))
+
+        conn = sqlite3.connect(os.path.join(root, Configuration.PackageDB.DB_NAME))
+        for (name, ) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+            conn.execute("DROP INDEX %s" % name)
+        conn.commit()
+        conn.close()
+        unindexed = LookupAll(pkgdb, npackages)
+        results.append(("no", "%.2f" % (unindexed * 1000.0 / npackages)))
+
+        print("Per-package lookups, %d rows in the files table, %d packages" % (nrows, npackages))
+        benchlib.Report(results, header=("indexes", "ms/package"))
+    finally:
+        shutil.rmtree(root)
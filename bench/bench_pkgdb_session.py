@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Time PackageDB changes with and without a session:  installing a
+synthetic package, upgrading it with a delta package that removes
+most of its files, and removing those files' entries one at a time
+with RemoveFileEntry().  Without a session, every database call opens,
+commits, and closes the database file; install_file() now does the
+whole install in one session (and one transaction).
+"""
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+
+import benchlib
+import freenasOS.Configuration as Configuration
+import freenasOS.Installer as Installer
+import freenasOS.PackageFile as PackageFile
+
+
+def usage():
+    print("Usage: %s [-n files] [-r runs]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def Install(pkg_path, root, session):
+    with open(pkg_path, "rb") as pkgfile:
+        if session:
+            rv = Installer.install_file(pkgfile, root)
+        else:
+            rv = Installer._install_file(pkgfile, root, Configuration.PackageDB(root))
+    if rv is not True:
+        raise Exception("Could not install %s" % pkg_path)
+
+
+def RemoveEntries(root, paths, session):
+    pkgdb = Configuration.PackageDB(root)
+    if pkgdb.FindFile(paths[0]) is None:
+        raise Exception("%s is not in the pkgdb" % paths[0])
+    if session:
+        pkgdb.StartSession()
+    for path in paths:
+        pkgdb.RemoveFileEntry(path)
+    if session:
+        pkgdb.EndSession()
+
+
+def MakePackages(work, nfiles):
+    # Version 2 keeps 1% of the files, so the delta package from
+    # version 1 removes the other 99%.
+    old_files = benchlib.PackageFiles("bench", nfiles, size=64)
+    new_files = dict((path, data) for (i, (path, data)) in enumerate(sorted(old_files.items()))
+                     if i % 100 == 0)
+    pkg1 = os.path.join(work, "bench-1.tgz")
+    pkg2 = os.path.join(work, "bench-2.tgz")
+    delta = os.path.join(work, "bench-1-2.tgz")
+    benchlib.MakePackage(pkg1, "bench", "1", old_files, prefix="/")
+    benchlib.MakePackage(pkg2, "bench", "2", new_files, prefix="/")
+    PackageFile.DiffPackageFiles(pkg1, pkg2, delta)
+    removed = [path for path in old_files if path not in new_files]
+    return (pkg1, delta, removed)
+
+
+def Best(work, runs, prepare, func):
+    # The best time for func(root), over runs fresh roots.
+    best = None
+    for run in range(runs):
+        root = os.path.join(work, "root")
+        prepare(root)
+        with benchlib.Timer() as t:
+            func(root)
+        shutil.rmtree(root)
+        best = t.elapsed if best is None else min(best, t.elapsed)
+    return "%.2f" % best
+
+
+if __name__ == "__main__":
+    nfiles = 20000
+    runs = 3
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:r:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            nfiles = int(a)
+        elif o == "-r":
+            runs = int(a)
+        else:
+            usage()
+
+    work = tempfile.mkdtemp(prefix="bench-pkgdb-")
+    try:
+        (pkg1, delta, removed) = MakePackages(work, nfiles)
+        results = []
+        for session in (False, True):
+            results.append(("yes" if session else "no",
+                            Best(work, runs, lambda root: None,
+                                 lambda root: Install(pkg1, root, session)),
+                            Best(work, runs, lambda root: Install(pkg1, root, True),
+                                 lambda root: Install(delta, root, session)),
+                            Best(work, runs, lambda root: Install(pkg1, root, True),
+                                 lambda root: RemoveEntries(root, removed, session))))
+        print("A %d-file package, and a delta package removing %d of its files; best of %d runs"
+              % (nfiles, len(removed), runs))
+        benchlib.Report(results, header=("session", "install", "delta", "RemoveFileEntry"))
+    finally:
+        shutil.rmtree(work)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Verify the signatures of a number of manifests, with the process-wide
+SignatureVerifier (which keeps the root CA, CRL, and certificates),
+and with a new one for each manifest (which is what every call used
+to do).  Reports the time, and how many times each manifest needed
+Crypto.verify(), a certificate was parsed, and the CRL was fetched.
+The root CA, CRL, and signing certificate are generated, using the
+cryptography package (which pyOpenSSL is built on).  Like Manifest,
+this needs a pyOpenSSL that still has crypto.sign() and crypto.verify().
+"""
+import datetime
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+
+import benchlib
+import freenasOS
+import freenasOS.Manifest as Manifest
+import OpenSSL.crypto as Crypto
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+TRAIN = "FreeNAS-Bench"
+
+counts = {}
+
+
+def usage():
+    print("Usage: %s [-n manifests]" % sys.argv[0], file=sys.stderr)
+    sys.exit(1)
+
+
+def Counted(name, func):
+    def wrapper(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class BenchConfiguration(object):
+    # VerifySignature only needs the configuration to fetch the CRL.
+    def __init__(self, crl_path):
+        self._crl_path = crl_path
+
+    def TryGetNetworkFile(self, url=None, pathname=None, reason=None, cached=False):
+        counts["crl fetch"] = counts.get("crl fetch", 0) + 1
+        shutil.copyfile(self._crl_path, pathname)
+        return True
+
+
+def MakeCertificate(subject, key, issuer, issuer_key, ca=False):
+    now = datetime.datetime.utcnow()
+    builder = x509.CertificateBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)])
+    ).issuer_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)])
+    ).public_key(key.public_key()).serial_number(
+        x509.random_serial_number()
+    ).not_valid_before(now).not_valid_after(
+        now + datetime.timedelta(days=1)
+    ).add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def MakeCertificates(cert_dir):
+    # Writes the root CA, the CRL, and the train's certificate file;
+    # returns the signing key, in PEM format.
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ca_cert = MakeCertificate("Bench CA", ca_key, "Bench CA", ca_key, ca=True)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    cert = MakeCertificate("Bench Update", key, "Bench CA", ca_key)
+    now = datetime.datetime.utcnow()
+    crl = x509.CertificateRevocationListBuilder().issuer_name(
+        ca_cert.subject
+    ).last_update(now).next_update(now + datetime.timedelta(days=1)).sign(ca_key, hashes.SHA256())
+
+    with open(os.path.join(cert_dir, "iX-CA.pem"), "wb") as f:
+        f.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+    with open(os.path.join(cert_dir, "ix_crl.pem"), "wb") as f:
+        f.write(crl.public_bytes(serialization.Encoding.PEM))
+    with open(os.path.join(cert_dir, TRAIN + ".pem"), "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key.private_bytes(serialization.Encoding.PEM,
+                             serialization.PrivateFormat.TraditionalOpenSSL,
+                             serialization.NoEncryption())
+
+
+def MakeManifests(conf, key_pem, count):
+    manifests = []
+    for seq in range(count):
+        mani = Manifest.Manifest(configuration=conf, require_signature=False)
+        mani.SetTrain(TRAIN)
+        mani.SetSequence("Bench-%d" % seq)
+        mani.SignWithKey(key_pem)
+        manifests.append(mani)
+    return manifests
+
+
+def VerifyAll(manifests, shared):
+    counts.clear()
+    Manifest._verifier = Manifest.SignatureVerifier()
+    with benchlib.Timer() as t:
+        for mani in manifests:
+            if not shared:
+                Manifest._verifier = Manifest.SignatureVerifier()
+            if mani.VerifySignature() is not True:
+                raise Exception("Could not verify manifest %s" % mani.Sequence())
+    n = float(len(manifests))
+    return ("yes" if shared else "no",
+            "%.2f" % (t.elapsed * 1000.0 / n),
+            "%.2f" % (counts.get("verify", 0) / n),
+            "%.2f" % (counts.get("load certificate", 0) / n),
+            counts.get("crl fetch", 0))
+
+
+if __name__ == "__main__":
+    count = 100
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            count = int(a)
+        else:
+            usage()
+
+    cert_dir = tempfile.mkdtemp(prefix="bench-certs-")
+    try:
+        key_pem = MakeCertificates(cert_dir)
+        freenasOS.IX_ROOT_CA_FILE = os.path.join(cert_dir, "iX-CA.pem")
+        freenasOS.UPDATE_CERT_DIR = cert_dir
+        conf = BenchConfiguration(os.path.join(cert_dir, "ix_crl.pem"))
+        manifests = MakeManifests(conf, key_pem, count)
+
+        Crypto.verify = Counted("verify", Crypto.verify)
+        Crypto.load_certificate = Counted("load certificate", Crypto.load_certificate)
+        results = [VerifyAll(manifests, False), VerifyAll(manifests, True)]
+        print("Verifying %d manifest signatures" % count)
+        benchlib.Report(results, header=("cached", "ms/manifest", "verify/manifest",
+                                         "cert loads/manifest", "CRL fetches"))
+    finally:
+        shutil.rmtree(cert_dir)
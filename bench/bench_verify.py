@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Run do_verify() (freenas-verify) over a generated 50k-file tree,
+once with --full for each number of workers (freenas-verify -j),
+and once more using the verify cache.
+do_verify() always uses the pkgdb of the running system, so for
+the benchmark, PackageDB and VerifyCache are pointed at the tree.
+"""
+import getopt
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import benchlib
+import freenasOS.Configuration as Configuration
+
+
+def usage():
+    print("Usage: %s [-n files] [-s size] [-j workers[,workers...]]" % sys.argv[0],
+          file=sys.stderr)
+    sys.exit(1)
+
+
+def MakeTree(root, nfiles, size):
+    # Writes the files, and adds them to the pkgdb in root.  The
+    # paths in the pkgdb are absolute, so they point into root.
+    rows = []
+    for (path, data) in benchlib.PackageFiles("bench", nfiles, size=size).items():
+        full_path = root + path
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, "wb") as f:
+            f.write(data)
+        os.chmod(full_path, 0o644)
+        rows.append(("bench", full_path, "file", hashlib.sha256(data).hexdigest(),
+                     os.getuid(), os.getgid(), 0, 0o644))
+    Configuration.PackageDB(root).AddFilesBulk(rows)
+
+
+def UseRoot(root):
+    BasePackageDB = Configuration.PackageDB
+    BaseVerifyCache = Configuration.VerifyCache
+
+    class PackageDB(BasePackageDB):
+        def __init__(self, root_ignored="", **kwargs):
+            BasePackageDB.__init__(self, root, **kwargs)
+
+    class VerifyCache(BaseVerifyCache):
+        def __init__(self, root_ignored=""):
+            BaseVerifyCache.__init__(self, root)
+
+    Configuration.PackageDB = PackageDB
+    Configuration.VerifyCache = VerifyCache
+
+
+def Verify(full, workers):
+    stats = {}
+    with benchlib.Timer() as t:
+        (error_flag, errors, warn_flag, warnings) = Configuration.do_verify(
+            full=full, stats=stats, workers=workers)
+    if error_flag or warn_flag:
+        raise Exception("Verification found problems")
+    return (workers, "yes" if full else "no", stats["hashed"], stats["skipped"],
+            "%.2f" % t.elapsed)
+
+
+if __name__ == "__main__":
+    nfiles = 50000
+    size = 4096
+    worker_counts = [1, 2, 4, 8]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:s:j:")
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+    for (o, a) in opts:
+        if o == "-n":
+            nfiles = int(a)
+        elif o == "-s":
+            size = int(a)
+        elif o == "-j":
+            worker_counts = [int(w) for w in a.split(",")]
+        else:
+            usage()
+
+    root = tempfile.mkdtemp(prefix="bench-verify-")
+    try:
+        MakeTree(root, nfiles, size)
+        UseRoot(root)
+        results = []
+        for workers in worker_counts:
+            results.append(Verify(True, workers))
+        results.append(Verify(False, worker_counts[0]))
+        print("Verifying %d %d-byte files" % (nfiles, size))
+        benchlib.Report(results, header=("workers", "full", "hashed", "skipped", "seconds"))
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,55 @@
+"""
+Support for the benchmarks in this directory.  They are run from
+the source tree (e.g., "python3 bench/bench_pkgdb_session.py"), so
+the library in lib/ is registered as the freenasOS package, and
+synthetic packages are generated rather than needing real ones.
+"""
+import hashlib
+import os
+import sys
+import time
+
+# The helpers shared with the tests, in tests/testlib.py; importing
+# it registers lib/ as the freenasOS package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from testlib import MakePackage
+
+
+def FileData(path, size, version="1"):
+    # Deterministic, somewhat compressible contents for a file.
+    seed = hashlib.sha256(("%s:%s" % (path, version)).encode("utf8")).hexdigest().encode("ascii")
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+def PackageFiles(name, count, size=256, per_dir=100, version="1"):
+    """
+    Returns a dictionary of path -> contents for a synthetic package,
+    with count files spread over directories of per_dir files each.
+    """
+    files = {}
+    for i in range(count):
+        path = "/usr/local/%s/d%04d/f%06d" % (name, i // per_dir, i)
+        files[path] = FileData(path, size, version)
+    return files
+
+
+class Timer(object):
+    # with Timer() as t: ...; then t.elapsed is the wall time, in seconds.
+    elapsed = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self._start
+
+
+def Report(rows, header=None):
+    # Print a table of results, one row per line.
+    if header:
+        rows = [header] + list(rows)
+    rows = [[str(c) for c in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(c.rjust(w) for (c, w) in zip(row, widths)))
@@ -112,10 +112,11 @@ if __name__ == "__main__":
         if os.path.exists(P):
             # Let's get the manifest from it
             pkgfile = open(P, "rb")
-            pkg_json = PF.GetManifest(file=pkgfile)
+            hash = Configuration.ChecksumFile(pkgfile)
+            # This uses the package's index, if it has one
+            pkg_json = PF.GetManifest(path=P, checksum=hash)
             name = pkg_json[PF.kPkgNameKey]
             version = pkg_json[PF.kPkgVersionKey]
-            hash = Configuration.ChecksumFile(pkgfile)
             size = os.lstat(P).st_size
             try:
                 services = pkg_json[PF.kPkgServicesKey]
@@ -16,15 +16,17 @@ def install_handler(index, name, packages):
     print("Installing {0} ({1} of {2})".format(name, index, len(packages)))
     
 def usage():
-    print("Usage: %s -M manifest [-P package_dir] root" % sys.argv[0], file=sys.stderr)
+    print("Usage: %s -M manifest [-P package_dir] [-j workers] root" % sys.argv[0], file=sys.stderr)
     print("\tNote:  package dir is parent of Packages directory", file=sys.stderr)
+    print("\t-j workers decompresses upcoming packages in the background", file=sys.stderr)
     sys.exit(1)
 
 if __name__ == "__main__":
     mani_file = None
     package_dir = None
+    workers = 1
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "M:P:")
+        opts, args = getopt.getopt(sys.argv[1:], "M:P:j:")
     except getopt.GetoptError as err:
         print(str(err), file=sys.stderr)
         usage()
@@ -34,6 +36,11 @@ if __name__ == "__main__":
             mani_file = a
         elif o == "-P":
             package_dir = a
+        elif o == "-j":
+            try:
+                workers = int(a)
+            except ValueError:
+                usage()
         else:
             usage()
 
@@ -63,6 +70,7 @@ if __name__ == "__main__":
     with Installer.ProgressHandler() as pf:
         # For installation, we assume that we're running the same kernel as the new system.
         installer.trampoline = False
+        installer.workers = workers
         installer.InstallPackages(progressFunc=pf.update, handler=install_handler)
 
     manifest.Save(root)
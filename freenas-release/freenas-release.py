@@ -1563,7 +1563,7 @@ def AddPackage(pkg, db = None,
             else:
                 raise Exception("We should not be here")
             # Should also get the list of services from the package file.
-            package_services = PackageFile.GetPackageServices(path = pkgfile)
+            package_services = PackageFile.GetPackageServices(path = pkgfile, checksum = retval.Checksum())
 
             if package_services:
                 if "Restart" in package_services:
@@ -1670,8 +1670,17 @@ def AddPackage(pkg, db = None,
                 else:
                     previous_versions = None
 
+                # Write the index, so delta packages to this version can be
+                # created without reading it again.  The new package is only
+                # decompressed once:  if delta packages are going to be created
+                # from it, the DeltaEngine (below) writes the index from the
+                # copy it decompresses.
+                if not previous_versions or \
+                   not os.path.exists(os.path.join(archive, "Packages", previous_versions[0].FileName())):
+                    PackageFile.WritePackageIndex(pkg_dest_file, checksum = pkg.Checksum())
+
                 # Find out if there are any services listed for this package.
-                package_services = PackageFile.GetPackageServices(path = pkg_file)
+                package_services = PackageFile.GetPackageServices(path = pkg_dest_file, checksum = pkg.Checksum())
                 print("\t**** package_services = %s" % package_services, file=sys.stderr)
                 
                 pkg_svc_list = None
@@ -1737,117 +1746,83 @@ def AddPackage(pkg, db = None,
                     # don't have to look for a delta package file.
                     previous_pkgfile = os.path.join(archive, "Packages", most_recent_pkg.FileName())
                     if os.path.exists(previous_pkgfile):
-                        delta_pkgfile = os.path.join(archive, "Packages", pkg.FileName(most_recent_pkg.Version()))
-                        print("Attempting to create delta package %s version %s -> %s" % (pkg.Name(), most_recent_pkg.Version(), pkg.Version()), file=sys.stderr)
-                        diffs = PackageFile.DiffPackageFiles(previous_pkgfile, pkg_dest_file, delta_pkgfile, scripts = scripts)
-                        if diffs is None:
-                            print("No differences between new package %s-%s and %s-%s" % (pkg.Name(), pkg.Version(), most_recent_pkg.Name(), most_recent_pkg.Version()), file=sys.stderr)
-                            print("Downgrading to previous package version", file=sys.stderr)
-                            # Need to downgrade, and also find updates.
-                            os.remove(pkg_dest_file)
-                            pkg = PackageFromDB(most_recent_pkg)
-                            # The package is (obviously) already in the database
-                            add_pkg_to_db = False
-                        else:
-                            # Add the update to the pkg
-                            delta_checksum = ChecksumFile(delta_pkgfile)
-                            # If there is a delta script, then we set rr to false
-                            # We also don't need to reboot if a restart service
-                            # is specified.
-                            # Specifically for that:  if the package has any
-                            # services to restart, even after modification by
-                            # the options for this particular update, then we
-                            # don't reboot.
-                            # Note that pkg_restart_list is kept pristine, because
-                            # it's the default set of restarts for the packge, which
-                            # we need if there is no entry for the package.
-                            print("########### pkg_restart_list = %s, restart_services = %s" % (pkg_restart_list, restart_services), file=sys.stderr)
-                                
-                            rr = None
-                            if scripts:
-                                if "reboot" in scripts:
-                                    rr = True
-                                else:
-                                    rr = False
-                            # When we look at the service restart list,
-                            # a reboot is not required if ... what?
-                            if restart_services and "reboot" in restart_services:
-                                if restart_services["reboot"]:
-                                    rr = True
-                                else:
-                                    rr = False
-                                
-                            upd = pkg.AddUpdate(most_recent_pkg.Version(),
-                                                delta_checksum,
-                                                size = os.lstat(delta_pkgfile).st_size,
-                                                RequiresReboot = rr)
-                            
-                            print("\t*** restart_services = %s" % restart_services, file=sys.stderr)
-                            print("\t\tpkg_restart_list = %s" % pkg_restart_list, file=sys.stderr)
-                            upd.SetRestartServices(restart_services)
-                            # Need to repeat for all the previous versions.
-                            # But first we start with this, the most recent version
-                            if restart_services:
-                                tmp_restart_list = db.ServicesForPackageUpdate(most_recent_pkg)
-                                restart_services = MergeServiceList(restart_services, tmp_restart_list)
-                            if restart_services == pkg_restart_list:
-                                restart_services = None
-                            # Except that if diffs is none in those cases, we still
-                            # need to create a delta package, even if it's empty.
-                            if scripts:
-                                delta_scripts = scripts.copy()
-                            else:
-                                delta_scripts = {}
-                            # Now we need to get any update scripts for this, the most recent version
-                            update_scripts = UpgradeScriptsForPackage(archive, db, most_recent_pkg)
-                            print("*** update_scripts = %s" % update_scripts, file=sys.stderr)
-                            if update_scripts is None:
-                                if not restart_services:
-                                    delta_scripts["reboot"] = "reboot"
+                        # The new package is decompressed once, and its index and the
+                        # delta packages are all created from that, concurrently.
+                        with PackageFile.DeltaEngine(pkg_dest_file,
+                                                     jobs = len(previous_versions),
+                                                     write_index = True,
+                                                     checksum = pkg.Checksum()) as delta_engine:
+                            delta_pkgfile = os.path.join(archive, "Packages", pkg.FileName(most_recent_pkg.Version()))
+                            print("Attempting to create delta package %s version %s -> %s" % (pkg.Name(), most_recent_pkg.Version(), pkg.Version()), file=sys.stderr)
+                            # This one decides whether we downgrade, so wait for it.
+                            (diffs, delta_checksum, delta_size) = delta_engine.Submit(previous_pkgfile,
+                                                                                      delta_pkgfile,
+                                                                                      scripts = scripts,
+                                                                                      use_index = True,
+                                                                                      pkg1_checksum = most_recent_pkg.Checksum()).result()
+                            if diffs is None:
+                                print("No differences between new package %s-%s and %s-%s" % (pkg.Name(), pkg.Version(), most_recent_pkg.Name(), most_recent_pkg.Version()), file=sys.stderr)
+                                print("Downgrading to previous package version", file=sys.stderr)
+                                # Need to downgrade, and also find updates.
+                                os.remove(pkg_dest_file)
+                                os.remove(PackageFile.PackageIndexFile(pkg_dest_file))
+                                pkg = PackageFromDB(most_recent_pkg)
+                                # The package is (obviously) already in the database
+                                add_pkg_to_db = False
                             else:
-                                for script in update_scripts:
-                                    if script in delta_scripts:
-                                        if script.startswith("pre-"):
-                                            delta_scripts[script] = update_scripts[script] + delta_scripts[script]
-                                        else:
-                                            delta_scripts[script] += update_scripts[script]
+                                # Add the update to the pkg
+                                # If there is a delta script, then we set rr to false
+                                # We also don't need to reboot if a restart service
+                                # is specified.
+                                # Specifically for that:  if the package has any
+                                # services to restart, even after modification by
+                                # the options for this particular update, then we
+                                # don't reboot.
+                                # Note that pkg_restart_list is kept pristine, because
+                                # it's the default set of restarts for the packge, which
+                                # we need if there is no entry for the package.
+                                print("########### pkg_restart_list = %s, restart_services = %s" % (pkg_restart_list, restart_services), file=sys.stderr)
+                                
+                                rr = None
+                                if scripts:
+                                    if "reboot" in scripts:
+                                        rr = True
                                     else:
-                                        delta_scripts[script] = update_scripts[script]
+                                        rr = False
+                                # When we look at the service restart list,
+                                # a reboot is not required if ... what?
+                                if restart_services and "reboot" in restart_services:
+                                    if restart_services["reboot"]:
+                                        rr = True
+                                    else:
+                                        rr = False
+                                
+                                upd = pkg.AddUpdate(most_recent_pkg.Version(),
+                                                    delta_checksum,
+                                                    size = delta_size,
+                                                    RequiresReboot = rr)
                             
-                            # Note that we go through this most-recent to oldest
-                            # This is important for the delta script creation
-                            for older_pkg in previous_versions[1:]:
-                                # Need to get the service restart list for this update,
-                                # then merge it into a list to be used when updating from
-                                # this version to the current version.
-                                # If there were no specified service restarts for this
-                                # version, then we use the default for the package.  And
-                                # remember:  restart always trumps not restarting.
-                                # If the package requires a reboot, and any intervening
-                                # version requires a reboot (no delta script, and no
-                                # service restart list for that version), then the update
-                                # requires a reboot.
-                                print("\tOlder version %s, restart_servces = %s" % (older_pkg.Version(), restart_services), file=sys.stderr)
+                                print("\t*** restart_services = %s" % restart_services, file=sys.stderr)
+                                print("\t\tpkg_restart_list = %s" % pkg_restart_list, file=sys.stderr)
+                                upd.SetRestartServices(restart_services)
+                                # Need to repeat for all the previous versions.
+                                # But first we start with this, the most recent version
                                 if restart_services:
-                                    tmp_restart_list = db.ServicesForPackageUpdate(older_pkg)
-                                else:
-                                    tmp_restart_list = {}
-                                print("\tRestart list for pkg %s-%s = %s, pkg_restart_list = %s" % (older_pkg.Name(), older_pkg.Version(), tmp_restart_list, pkg_restart_list), file=sys.stderr)
-                                if tmp_restart_list:
+                                    tmp_restart_list = db.ServicesForPackageUpdate(most_recent_pkg)
                                     restart_services = MergeServiceList(restart_services, tmp_restart_list)
-                                else:
-                                    restart_services = None
-
-                                update_scripts = UpgradeScriptsForPackage(archive, db, older_pkg)
-                                # If the update's service restart list is the same as the package default,
-                                # then don't include it at all.
                                 if restart_services == pkg_restart_list:
                                     restart_services = None
-                                print("\tUpdate scripts for pkg %s-%s = %s" % (older_pkg.Name(), older_pkg.Version(), update_scripts), file=sys.stderr)
+                                # Except that if diffs is none in those cases, we still
+                                # need to create a delta package, even if it's empty.
+                                if scripts:
+                                    delta_scripts = scripts.copy()
+                                else:
+                                    delta_scripts = {}
+                                # Now we need to get any update scripts for this, the most recent version
+                                update_scripts = UpgradeScriptsForPackage(archive, db, most_recent_pkg)
+                                print("*** update_scripts = %s" % update_scripts, file=sys.stderr)
                                 if update_scripts is None:
-                                    # That means a reboot is required
-                                    # If the package default is to reboot, we have to reboot.
-                                    if not restart_services and pkg.RequiresReboot():
+                                    if not restart_services:
                                         delta_scripts["reboot"] = "reboot"
                                 else:
                                     for script in update_scripts:
@@ -1858,45 +1833,97 @@ def AddPackage(pkg, db = None,
                                                 delta_scripts[script] += update_scripts[script]
                                         else:
                                             delta_scripts[script] = update_scripts[script]
-                                if "reboot" in delta_scripts:
-                                    delta_scripts = { "reboot" : "reboot" }
-                                print("\tdelta_scripts = %s" % delta_scripts, file=sys.stderr)
-                                # Now we've got the update scripts from older_pkg to the current version.
-                                # So let's create a delta package file
-                                previous_pkgfile = os.path.join(archive, "Packages", older_pkg.FileName())
-                                if os.path.exists(previous_pkgfile):
-                                    delta_pkgfile = os.path.join(archive, "Packages", pkg.FileName(older_pkg.Version()))
-                                    print("Creating (forced) delta package file version %s -> %s" % (older_pkg.Version(), pkg.Version()), file=sys.stderr)
-                                    PackageFile.DiffPackageFiles(previous_pkgfile,
-                                                                 pkg_dest_file,
-                                                                 delta_pkgfile,
-                                                                 scripts = None if "reboot" in delta_scripts else delta_scripts,
-                                                                 force_output = True)
-                                    if (not delta_scripts) and (not restart_services):
-                                        # Use the package default
-                                        rr = None
-                                    elif (delta_scripts and "reboot" in delta_scripts):
-                                        rr = True
-                                    elif (restart_services and "reboot" in restart_services):
-                                        rr = restart_services["reboot"]
-                                    elif delta_scripts or restart_services:
-                                        rr = False
+                            
+                                # Note that we go through this most-recent to oldest
+                                # This is important for the delta script creation
+                                # The delta packages are created in the background; the
+                                # updates are added, in this order, once they're done.
+                                pending_updates = []
+                                for older_pkg in previous_versions[1:]:
+                                    # Need to get the service restart list for this update,
+                                    # then merge it into a list to be used when updating from
+                                    # this version to the current version.
+                                    # If there were no specified service restarts for this
+                                    # version, then we use the default for the package.  And
+                                    # remember:  restart always trumps not restarting.
+                                    # If the package requires a reboot, and any intervening
+                                    # version requires a reboot (no delta script, and no
+                                    # service restart list for that version), then the update
+                                    # requires a reboot.
+                                    print("\tOlder version %s, restart_servces = %s" % (older_pkg.Version(), restart_services), file=sys.stderr)
+                                    if restart_services:
+                                        tmp_restart_list = db.ServicesForPackageUpdate(older_pkg)
                                     else:
-                                        raise Exception("I do not understand boolean logic")
-                                        rr = False
-                                    # If the package requires a reboot, and there is no
-                                    # service restart list for this update, then we have
-                                    # to reboot.
-                                    print("Package %s, second update:  RequiresReboot = %s, rr = %s, tmp_restart_list = %s" % (pkg.Name(), older_pkg.RequiresReboot(), rr, tmp_restart_list), file=sys.stderr)
+                                        tmp_restart_list = {}
+                                    print("\tRestart list for pkg %s-%s = %s, pkg_restart_list = %s" % (older_pkg.Name(), older_pkg.Version(), tmp_restart_list, pkg_restart_list), file=sys.stderr)
+                                    if tmp_restart_list:
+                                        restart_services = MergeServiceList(restart_services, tmp_restart_list)
+                                    else:
+                                        restart_services = None
+
+                                    update_scripts = UpgradeScriptsForPackage(archive, db, older_pkg)
+                                    # If the update's service restart list is the same as the package default,
+                                    # then don't include it at all.
+                                    if restart_services == pkg_restart_list:
+                                        restart_services = None
+                                    print("\tUpdate scripts for pkg %s-%s = %s" % (older_pkg.Name(), older_pkg.Version(), update_scripts), file=sys.stderr)
+                                    if update_scripts is None:
+                                        # That means a reboot is required
+                                        # If the package default is to reboot, we have to reboot.
+                                        if not restart_services and pkg.RequiresReboot():
+                                            delta_scripts["reboot"] = "reboot"
+                                    else:
+                                        for script in update_scripts:
+                                            if script in delta_scripts:
+                                                if script.startswith("pre-"):
+                                                    delta_scripts[script] = update_scripts[script] + delta_scripts[script]
+                                                else:
+                                                    delta_scripts[script] += update_scripts[script]
+                                            else:
+                                                delta_scripts[script] = update_scripts[script]
+                                    if "reboot" in delta_scripts:
+                                        delta_scripts = { "reboot" : "reboot" }
+                                    print("\tdelta_scripts = %s" % delta_scripts, file=sys.stderr)
+                                    # Now we've got the update scripts from older_pkg to the current version.
+                                    # So let's create a delta package file
+                                    previous_pkgfile = os.path.join(archive, "Packages", older_pkg.FileName())
+                                    if os.path.exists(previous_pkgfile):
+                                        delta_pkgfile = os.path.join(archive, "Packages", pkg.FileName(older_pkg.Version()))
+                                        print("Creating (forced) delta package file version %s -> %s" % (older_pkg.Version(), pkg.Version()), file=sys.stderr)
+                                        future = delta_engine.Submit(previous_pkgfile,
+                                                                     delta_pkgfile,
+                                                                     scripts = None if "reboot" in delta_scripts else delta_scripts,
+                                                                     force_output = True,
+                                                                     use_index = True,
+                                                                     pkg1_checksum = older_pkg.Checksum())
+                                        if (not delta_scripts) and (not restart_services):
+                                            # Use the package default
+                                            rr = None
+                                        elif (delta_scripts and "reboot" in delta_scripts):
+                                            rr = True
+                                        elif (restart_services and "reboot" in restart_services):
+                                            rr = restart_services["reboot"]
+                                        elif delta_scripts or restart_services:
+                                            rr = False
+                                        else:
+                                            raise Exception("I do not understand boolean logic")
+                                            rr = False
+                                        # If the package requires a reboot, and there is no
+                                        # service restart list for this update, then we have
+                                        # to reboot.
+                                        print("Package %s, second update:  RequiresReboot = %s, rr = %s, tmp_restart_list = %s" % (pkg.Name(), older_pkg.RequiresReboot(), rr, tmp_restart_list), file=sys.stderr)
+                                        pending_updates.append((older_pkg, future, rr, restart_services))
+                                    else:
+                                        print("Secondary Previous package file %s doesn't exist" % previous_pkgfile, file=sys.stderr)
+                                for (older_pkg, future, rr, update_services) in pending_updates:
+                                    (_, delta_checksum, delta_size) = future.result()
                                     upd = pkg.AddUpdate(older_pkg.Version(),
-                                                        ChecksumFile(delta_pkgfile),
-                                                        size = os.lstat(delta_pkgfile).st_size,
+                                                        delta_checksum,
+                                                        size = delta_size,
                                                         RequiresReboot = rr)
-                                    if restart_services:
-                                        upd.SetRestartServices(restart_services)
-                                    print("\t#### second one:  restart_services = %s" % restart_services, file=sys.stderr)
-                                else:
-                                    print("Secondary Previous package file %s doesn't exist" % previous_pkgfile, file=sys.stderr)
+                                    if update_services:
+                                        upd.SetRestartServices(update_services)
+                                    print("\t#### second one:  restart_services = %s" % update_services, file=sys.stderr)
                     else:
                         print("Initial previous package file %s doesn't exist" % previous_pkgfile, file=sys.stderr)
                 else:
@@ -2465,16 +2492,23 @@ def Check(archive, db, project = "FreeNAS", args = []):
     # the actual packages directory
     p_dir = "%s/Packages" % archive
     found_packages = {}
+    found_indices = []
     for pkgEntry in os.listdir(p_dir):
         full_path = os.path.join(p_dir, pkgEntry)
         if not os.path.isfile(full_path):
             print("Entry in Packages directory, %s, is not a file" % pkgEntry, file=sys.stderr)
             continue
+        if pkgEntry.endswith(PackageFile.kPkgIndexSuffix):
+            # Package indices are checked against their packages below
+            found_indices.append(pkgEntry)
+            continue
         if quick:
             cksum = "-"
         else:
             cksum = ChecksumFile(full_path)
         found_packages[pkgEntry] = cksum
+    # found_packages is emptied out below, but the indices need the checksums
+    package_checksums = dict(found_packages)
 
     if (quick and list(expected_packages.keys()) != list(found_packages.keys())) or \
        (quick is False and expected_packages != found_packages):
@@ -2493,6 +2527,15 @@ def Check(archive, db, project = "FreeNAS", args = []):
         for found in list(found_packages.keys()):
             print("Unexpected package file %s" % found, file=sys.stderr)
 
+    # Each package index has to go with a package file, and match it
+    for index_entry in found_indices:
+        pkgEntry = index_entry[:-len(PackageFile.kPkgIndexSuffix)]
+        if not os.path.isfile(os.path.join(p_dir, pkgEntry)):
+            print("Package index %s has no package file" % index_entry, file=sys.stderr)
+        elif quick is False and \
+             PackageFile.ReadPackageIndex(os.path.join(p_dir, pkgEntry), checksum = package_checksums[pkgEntry]) is None:
+            print("Package index %s does not match its package file" % index_entry, file=sys.stderr)
+
     # Now let's check the notes
     if found_notes != expected_notes:
         print("Notes inconsistency", file=sys.stderr)
@@ -2847,6 +2890,15 @@ def RemovePackage(archive, db, pkg, dbonly = False, shlist = None):
                 os.unlink(pkg_filename)
         except:
             pass
+        # And its metadata index, if it has one
+        index_filename = PackageFile.PackageIndexFile(pkg_filename)
+        if shlist:
+            shlist.append("rm -f %s" % index_filename)
+        try:
+            if not dbonly:
+                os.unlink(index_filename)
+        except:
+            pass
 
 #
 # Need to figure out where to do this:
@@ -2959,7 +3011,7 @@ def RemoveRelease(archive, db, project, sequence, dbonly = False, shlist = None)
         # (We can't remove the db entry for the package if there are
         # any updates that reference it, because we want it to show up
         # for delta package creation.)
-	packages_dir = os.path.join(archive, "Packages")
+        packages_dir = os.path.join(archive, "Packages")
         updates = db.UpdatesForPackage(pkg, count = 0)
         if updates:
             # We're going to delete the delta package files
@@ -3027,6 +3079,15 @@ def RemoveRelease(archive, db, project, sequence, dbonly = False, shlist = None)
                 os.unlink(pkg_filename)
         except:
             pass
+        # And its metadata index, if it has one
+        index_filename = PackageFile.PackageIndexFile(pkg_filename)
+        try:
+            if shlist is not None:
+                shlist.append("rm -f %s" % index_filename)
+            if not dbonly:
+                os.unlink(index_filename)
+        except:
+            pass
     # And that ends the pkg loop
     # So now we delete the manifest file
     manifest_file = os.path.join(archive, train, "%s-%s" % (project, sequence))
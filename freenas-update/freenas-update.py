@@ -75,30 +75,33 @@ class UpdateHandler(object):
         self.filesize = 0
         self.numfilestotal = 0
         self.numfilesdone = 0
-        self._baseprogress = 0
         self.master_progress = 0
         # Below is the function handle passed to this by the caller so that
         # its status and progress can be updated accordingly
         self.update_progress = update_progress
 
     def check_handler(self, index, pkg, pkgList):
+        # Called as each package download starts.  Several packages
+        # are downloaded at once, so this doesn't change the progress;
+        # get_handler() is given the progress of all of them.
         self.pkgname = pkg.Name()
         self.pkgversion = pkg.Version()
         self.operation = 'Downloading'
-        self.details = 'Downloading {0}'.format(self.pkgname)
-        stepprogress = int((1.0 / float(len(pkgList))) * 100)
-        self._baseprogress = index * stepprogress
-        self.progress = (index - 1) * stepprogress
+        self.numfilestotal = len(pkgList)
+        self.numfilesdone = index
+        self.details = 'Downloading {0} ({1} of {2})'.format(self.pkgname, index, len(pkgList))
 
     def get_handler(self, method, filename, size=None, progress=None, download_rate=None):
+        # progress, size and download_rate are for the whole set of
+        # downloads (see Update.DownloadPackages()).
         if progress is not None:
-            self.progress = (progress * self._baseprogress) / 100
+            self.progress = progress
             if self.progress == 0:
                 self.progress = 1
             display_size = ' Size: {0}'.format(size) if size else ''
             display_rate = ' Rate: {0} B/s'.format(download_rate) if download_rate else ''
-            self.details = 'Downloading: {0} Progress:{1}{2}{3}'.format(
-                self.pkgname, progress, display_size, display_rate
+            self.details = 'Downloading: {0} of {1} packages started Progress:{2}{3}{4}'.format(
+                self.numfilesdone, self.numfilestotal, progress, display_size, display_rate
             )
         self.increment_progress()
 
@@ -139,6 +142,9 @@ def ExtractFrozenUpdate(tarball, dest_dir, verbose=False):
                 if verbose:
                     print("Illegal member name {0} has too many path components".format(f.name), file=sys.stderr)
                 continue
+            if f.name == "./" + Configuration.ChecksumCache.CACHE_NAME:
+                # The checksums have to be computed here, not trusted.
+                continue
             if verbose:
                 print("Extracting {0}".format(f.name), file=sys.stderr)
             tf.extract(f.name, path=dest_dir)
@@ -178,7 +184,7 @@ def PrintDifferences(diffs):
             print("*** Unknown key {0} (value {1})".format(type, str(diffs[type])), file=sys.stderrr)
 
 
-def DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=False):
+def DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=False, paranoid=False):
 
     try:
         if not verbose:
@@ -190,11 +196,13 @@ def DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=False):
                     get_handler=handler.get_handler,
                     check_handler=handler.check_handler,
                     pkg_type=pkg_type,
+                    paranoid=paranoid,
                 )
                 if rv is False:
                     progress_bar.update(message="No updates available")
         else:
-            rv = Update.DownloadUpdate(train, cache_dir, pkg_type=pkg_type, ignore_space=ignore_space)
+            rv = Update.DownloadUpdate(train, cache_dir, pkg_type=pkg_type, ignore_space=ignore_space,
+                                       paranoid=paranoid)
     except Exceptions.ManifestInvalidSignature:
         log.error("Manifest has invalid signature")
         print("Manifest has invalid signature", file=sys.stderr)
@@ -227,7 +235,7 @@ def DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=False):
     return rv
 
 
-def DoUpdate(cache_dir, verbose, ignore_space=False, force_trampoline=None):
+def DoUpdate(cache_dir, verbose, ignore_space=False, force_trampoline=None, paranoid=False):
     """
     Common code to apply an update once it's been downloaded.
     This will handle all of the exceptions in a common fashion.
@@ -236,7 +244,7 @@ def DoUpdate(cache_dir, verbose, ignore_space=False, force_trampoline=None):
     global log
 
     try:
-        diffs = Update.PendingUpdatesChanges(cache_dir)
+        diffs = Update.PendingUpdatesChanges(cache_dir, paranoid=paranoid)
     except Exceptions.UpdateBusyCacheException:
         log.error("Cache directory busy, cannot update")
         raise
@@ -262,6 +270,7 @@ def DoUpdate(cache_dir, verbose, ignore_space=False, force_trampoline=None):
                     install_handler=handler.install_handler,
                     ignore_space=ignore_space,
                     force_trampoline=force_trampoline,
+                    paranoid=paranoid,
                 )
                 if rv is False:
                     progress_bar.update(message="Updates were not applied")
@@ -271,6 +280,7 @@ def DoUpdate(cache_dir, verbose, ignore_space=False, force_trampoline=None):
                                           progressFunc=pf.update,
                                           ignore_space=ignore_space,
                                           force_trampoline=force_trampoline,
+                                          paranoid=paranoid,
                                           )
                   
     except Exceptions.UpdateInsufficientSpace as e:
@@ -289,7 +299,7 @@ def main():
     global log
 
     def usage():
-        print("""Usage: {0} [-C cache_dir] [-d] [-T train] [--no-delta] [--reboot|-R] [--server|-S server][-B|--trampline yes|no] [--force|-F] [-v] <cmd>
+        print("""Usage: {0} [-C cache_dir] [-d] [-T train] [--no-delta] [--reboot|-R] [--server|-S server][-B|--trampline yes|no] [--force|-F] [--paranoid] [-v] <cmd>
 or	{0} <update_tar_file>
 where cmd is one of:
         check\tCheck for updates
@@ -308,7 +318,8 @@ where cmd is one of:
             "force",
             "server=",
             "trampoline=",
-            "snl"
+            "snl",
+            "paranoid",
         ]
         opts, args = getopt.getopt(sys.argv[1:], short_opts, long_opts)
     except getopt.GetoptError as err:
@@ -327,6 +338,7 @@ where cmd is one of:
     force = False
     server = None
     force_trampoline = None
+    paranoid = False
     
     for o, a in opts:
         if o in ("-v", "--verbose"):
@@ -355,6 +367,9 @@ where cmd is one of:
             snl = True
         elif o in ("-F", "--force"):
             force = True
+        elif o in ("--paranoid"):
+            # Hash every package file, even if it was verified before
+            paranoid = True
         else:
             assert False, "unhandled option {0}".format(o)
 
@@ -380,14 +395,14 @@ where cmd is one of:
         # we make a temporary directory and use that.  We
         # have to clean up afterwards in that case.
 
-        rv = DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=force)
+        rv = DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=force, paranoid=paranoid)
         if rv is False:
             if verbose:
                 print("No updates available")
             Update.RemoveUpdate(cache_dir)
             sys.exit(1)
         else:
-            diffs = Update.PendingUpdatesChanges(cache_dir)
+            diffs = Update.PendingUpdatesChanges(cache_dir, paranoid=paranoid)
             if diffs is None or len(diffs) == 0:
                 print("Strangely, DownloadUpdate says there updates, but PendingUpdates says otherwise", file=sys.stderr)
                 sys.exit(1)
@@ -408,7 +423,7 @@ where cmd is one of:
         # See if the cache directory has an update downloaded already
         do_download = True
         try:
-            f = Update.VerifyUpdate(cache_dir)
+            f = Update.VerifyUpdate(cache_dir, paranoid=paranoid)
             if f:
                 f.close()
                 do_download = False
@@ -421,7 +436,7 @@ where cmd is one of:
             raise
 
         if do_download:
-            rv = DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=force)
+            rv = DoDownload(train, cache_dir, pkg_type, verbose, ignore_space=force, paranoid=paranoid)
             if rv is False:
                 if verbose:
                     print("No updates available")
@@ -429,7 +444,8 @@ where cmd is one of:
                 sys.exit(1)
 
         try:
-            rv = DoUpdate(cache_dir, verbose, ignore_space=force, force_trampoline=force_trampoline)
+            rv = DoUpdate(cache_dir, verbose, ignore_space=force, force_trampoline=force_trampoline,
+                          paranoid=paranoid)
         except:
             sys.exit(1)
         else:
@@ -475,7 +491,8 @@ where cmd is one of:
             s.write(config.UpdateServerName())
 
         try:
-            rv = DoUpdate(cache_dir, verbose, ignore_space=force, force_trampoline=force_trampoline)
+            rv = DoUpdate(cache_dir, verbose, ignore_space=force, force_trampoline=force_trampoline,
+                          paranoid=paranoid)
         except:
             sys.exit(1)
         else:
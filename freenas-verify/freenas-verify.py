@@ -1,18 +1,49 @@
 #!/usr/bin/env /usr/local/bin/python
 from __future__ import print_function
+import getopt
 import sys
 import traceback
 
 sys.path.append("/usr/local/lib")
 from freenasOS import Configuration
 
+
+def usage():
+    print("Usage: %s [--full] [-j workers]" % sys.argv[0], file=sys.stderr)
+    print("\t--full hashes every file, even if it has not changed since it was last verified", file=sys.stderr)
+    print("\t-j workers verifies that many files at once", file=sys.stderr)
+    sys.exit(1)
+
 if __name__ == '__main__':
+    full = False
+    workers = 1
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "j:", ["full"])
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        usage()
+
+    for (o, a) in opts:
+        if o == "--full":
+            full = True
+        elif o == "-j":
+            try:
+                workers = int(a)
+            except ValueError:
+                usage()
+        else:
+            usage()
+
+    stats = {}
     try:
-        error_flag, ed, warn_flag, wl = Configuration.do_verify()
+        error_flag, ed, warn_flag, wl = Configuration.do_verify(full=full, stats=stats, workers=workers)
     except IOError as e:
         traceback.print_exc()
         sys.exit(74)
 
+    print("{0} files hashed, {1} files skipped (unchanged since last verified), peak RSS {2} KB".format(
+        stats["hashed"], stats["skipped"], stats["peak_rss"]))
+
     if error_flag or warn_flag:
         print("The following inconsistencies were found in your current install:")
 
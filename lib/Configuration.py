@@ -8,14 +8,17 @@ import tempfile
 import time
 import socket
 import ssl
+import threading
 import six
 
 import six.moves.configparser as configparser
 from six.moves.urllib.request import Request
 from six.moves.urllib.error import HTTPError, URLError
 from six.moves.urllib.request import Request, urlopen, HTTPSHandler
-from six.moves.urllib.request import build_opener
+from six.moves.urllib.request import build_opener, getproxies, proxy_bypass
+from six.moves.urllib.parse import urlparse, urljoin
 from six.moves.http_client import REQUESTED_RANGE_NOT_SATISFIABLE as HTTP_RANGE
+from six.moves.http_client import NOT_MODIFIED as HTTP_NOT_MODIFIED
 from six.moves.http_client import HTTPException, HTTPConnection, HTTPS_PORT
 if six.PY2:
     from urllib2 import AbstractHTTPHandler
@@ -47,6 +50,11 @@ VERIFY_SKIP_PATHS = [
 CONFIG_DEFAULT = "Defaults"
 CONFIG_SEARCH = "Search"
 CONFIG_SERVER = "update_server"
+CONFIG_CACHE_AGE = "cache_max_age"
+
+# How long, in seconds, a cached trains list, LATEST manifest, or CRL
+# is used without asking the server whether it has changed.
+HTTP_CACHE_MAX_AGE = 60
 
 UPDATE_SERVER_NAME_KEY = "name"
 UPDATE_SERVER_MASTER_KEY = "master"
@@ -62,6 +70,25 @@ log = logging.getLogger('freenasOS.Configuration')
 # List of trains
 TRAIN_FILE = "trains.txt"
 
+# Number of unused pages in the package database before
+# PackageDB.Vacuum() will bother compacting it.
+PKGDB_VACUUM_THRESHOLD = 256
+
+# Schema upgrades for the package database.  Entry N upgrades
+# the database from schema version N to N+1; the version is kept
+# in the database itself (PRAGMA user_version), so older databases
+# are upgraded in place when they are opened.  Only add to the end.
+PKGDB_SCHEMA_UPGRADES = [
+    # Version 1:  indexes for the per-package lookups.  The files
+    # index includes the path, so the removal queries don't need
+    # to look at the table at all.
+    [
+        "CREATE INDEX IF NOT EXISTS files_package_kind ON files(package, kind, path)",
+        "CREATE INDEX IF NOT EXISTS scripts_package_type ON scripts(package, type)",
+    ],
+]
+PKGDB_SCHEMA_VERSION = len(PKGDB_SCHEMA_UPGRADES)
+
 def CheckFreeSpace(path=None, pool=None, required=0):
     """
     Check for enough free space on the path/pool.
@@ -125,6 +152,155 @@ def ChecksumFile(fobj):
     return hash.hexdigest()
 
 
+def _StatTimeNS(st, name):
+    # The st_*time_ns fields only exist on Python 3; on Python 2,
+    # derive them from the float times.
+    rv = getattr(st, name + "_ns", None)
+    if rv is None:
+        rv = int(getattr(st, name) * 1e9)
+    return rv
+
+
+class ChecksumCache(object):
+    """
+    A sidecar file in a package directory (such as an update cache
+    directory), recording the checksum of each package file along
+    with its (st_size, st_mtime_ns, st_ino).  If none of those have
+    changed, the file doesn't need to be hashed again.  With paranoid
+    set, files are always hashed (and the cache is refreshed).
+    """
+    CACHE_NAME = ".checksums"
+    _lock = threading.Lock()
+
+    def __init__(self, directory, paranoid=False):
+        self._path = os.path.join(directory, ChecksumCache.CACHE_NAME)
+        self._directory = directory
+        self._paranoid = paranoid
+
+    def _load(self):
+        import json
+        try:
+            with open(self._path, "r") as f:
+                return json.load(f)
+        except:
+            # Missing or bad, it doesn't matter which.
+            return {}
+
+    def _save(self, entries):
+        import json
+        temp_path = self._path + ".new"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(entries, f)
+            os.rename(temp_path, self._path)
+        except (IOError, OSError) as e:
+            log.debug("Could not save checksum cache %s: %s", self._path, str(e))
+
+    def _stat(self, filename):
+        st = os.stat(os.path.join(self._directory, filename))
+        return [st.st_size, _StatTimeNS(st, "st_mtime"), st.st_ino]
+
+    def Add(self, filename, checksum):
+        # Record the checksum of filename, which the caller has just computed.
+        try:
+            key = self._stat(filename) + [checksum]
+        except OSError as e:
+            log.debug("Could not stat %s: %s", filename, str(e))
+            return
+        with ChecksumCache._lock:
+            entries = self._load()
+            entries[filename] = key
+            self._save(entries)
+
+    def Checksum(self, filename, fobj=None):
+        # Return the checksum of filename, only hashing it (using
+        # fobj, if given) if it has changed since it was last hashed.
+        # Raises an exception if the file can't be read.
+        key = self._stat(filename)
+        if not self._paranoid:
+            with ChecksumCache._lock:
+                entry = self._load().get(filename)
+            if entry and entry[:-1] == key:
+                return entry[-1]
+        if fobj is None:
+            with open(os.path.join(self._directory, filename), "rb") as f:
+                checksum = ChecksumFile(f)
+        else:
+            checksum = ChecksumFile(fobj)
+        self.Add(filename, checksum)
+        return checksum
+
+
+class ResponseCache(object):
+    """
+    An on-disk cache of small files fetched from the update server
+    (the trains list, LATEST manifests, the CRL), with the ETag and
+    Last-Modified headers they were sent with, so they can be
+    requested again conditionally.  An entry younger than max_age is
+    used without asking the server at all, and any entry is used if
+    the server can't be reached.  Each entry is a single file, a line
+    of JSON followed by the body, so it's replaced atomically.
+    """
+    CACHE_DIR = "update-http-cache"
+
+    def __init__(self, directory, max_age=HTTP_CACHE_MAX_AGE):
+        self._directory = os.path.join(directory, ResponseCache.CACHE_DIR)
+        self._max_age = max_age
+
+    def _path(self, url):
+        return os.path.join(self._directory, hashlib.sha256(url.encode('utf8')).hexdigest())
+
+    def Lookup(self, url):
+        # Returns (headers, body) for url, or None
+        import json
+        try:
+            with open(self._path(url), "rb") as f:
+                header = json.loads(f.readline().decode('utf8'))
+                body = f.read()
+        except:
+            return None
+        if header.get("url") != url or header.get("length") != len(body):
+            return None
+        return (header, body)
+
+    def Fresh(self, header):
+        return 0 <= time.time() - header.get("fetched", 0) < self._max_age
+
+    def ConditionalHeaders(self, header):
+        rv = {}
+        if header.get("ETag"):
+            rv["If-None-Match"] = header["ETag"]
+        if header.get("Last-Modified"):
+            rv["If-Modified-Since"] = header["Last-Modified"]
+        return rv
+
+    def Store(self, url, info, body):
+        # Save body for url; info is the response's headers.
+        import json
+        header = {
+            "url": url,
+            "fetched": time.time(),
+            "length": len(body),
+        }
+        for key in ("ETag", "Last-Modified"):
+            if info and info.get(key):
+                header[key] = info.get(key)
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            (fd, temp_path) = tempfile.mkstemp(dir=self._directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(header).encode('utf8') + b"\n")
+                f.write(body)
+            os.rename(temp_path, self._path(url))
+        except (IOError, OSError) as e:
+            log.debug("Could not cache %s: %s", url, str(e))
+
+    def Refresh(self, url, header, body):
+        # The server says the cached copy is still current.
+        self.Store(url, header, body)
+
+
 def TryOpenFile(path):
     try:
         f = open(path, "r")
@@ -219,12 +395,153 @@ class VerifiedHTTPSHandler(HTTPSHandler):
     https_request = HTTPSHandler.do_request_
 
 
+class HTTPTransport(object):
+    """
+    Keeps persistent (keep-alive) connections to each server, so
+    fetching several files from the update server doesn't need a
+    new TCP (and TLS) handshake for each one.  open() takes a
+    Request, and returns a file-like response, or raises HTTPError,
+    like an opener does.  The response must be closed, so that its
+    connection can be reused.  This is safe to use from several threads.
+    connects and requests count the connections made, and the requests sent.
+    """
+    MAX_REDIRECTS = 5
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+    class Response(object):
+        def __init__(self, transport, key, conn, response):
+            self._transport = transport
+            self._key = key
+            self._conn = conn
+            self._response = response
+            self.code = response.status
+            self.reason = response.reason
+
+        def info(self):
+            return self._response.msg
+
+        def getcode(self):
+            return self.code
+
+        def read(self, amt=None):
+            return self._response.read(amt)
+
+        def close(self):
+            if self._conn is not None:
+                # The connection can only be reused if the whole
+                # response was read.
+                reusable = self._response.isclosed() and not self._response.will_close
+                self._response.close()
+                self._transport._release(self._key, self._conn, reusable)
+                self._conn = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, type, value, traceback):
+            self.close()
+
+    def __init__(self, ca_certs=DEFAULT_CA_FILE, timeout=30):
+        self._ca_certs = ca_certs
+        self._timeout = timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.requests = 0
+
+    def _acquire(self, key):
+        # Returns (connection, reused)
+        with self._lock:
+            idle = self._connections.get(key)
+            if idle:
+                return (idle.pop(), True)
+        return (self._connect(key), False)
+
+    def _connect(self, key):
+        (scheme, host) = key
+        if scheme == "https":
+            conn = CertValidatingHTTPSConnection(host, ca_certs=self._ca_certs, timeout=self._timeout)
+        else:
+            conn = HTTPConnection(host, timeout=self._timeout)
+        return conn
+
+    def _release(self, key, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._connections.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            for conns in self._connections.values():
+                for conn in conns:
+                    conn.close()
+            self._connections = {}
+
+    def _request(self, url, headers):
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        (conn, reused) = self._acquire(key)
+        while True:
+            try:
+                if conn.sock is None:
+                    with self._lock:
+                        self.connects += 1
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except (HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                # The server may have closed an idle connection;
+                # try again, with a new one.
+                (conn, reused) = (self._connect(key), False)
+                continue
+            with self._lock:
+                self.requests += 1
+            return HTTPTransport.Response(self, key, conn, response)
+
+    def _proxied(self, url):
+        parsed = urlparse(url)
+        return parsed.scheme in getproxies() and not proxy_bypass(parsed.hostname)
+
+    def open(self, req):
+        url = req.get_full_url()
+        headers = dict(req.header_items())
+        if self._proxied(url):
+            # Proxies are left to urllib, without keep-alive.
+            opener = build_opener(VerifiedHTTPSHandler(ca_certs=self._ca_certs))
+            return opener.open(req, timeout=self._timeout)
+
+        for redirects in range(HTTPTransport.MAX_REDIRECTS + 1):
+            response = self._request(url, headers)
+            if response.code < 300:
+                return response
+            # Drain the body, so the connection can be reused
+            body = response.read()
+            response.close()
+            location = response.info().get("Location")
+            if response.code in HTTPTransport.REDIRECT_CODES and location:
+                url = urljoin(url, location)
+                continue
+            raise HTTPError(url, response.code, response.reason, response.info(), six.BytesIO(body))
+        raise HTTPError(url, response.code, "Too many redirects", response.info(), None)
+
+
 class PackageDB:
     DB_NAME = "data/pkgdb/freenas-db"
     __db_path = None
     __db_root = ""
     __conn = None
     __close = True
+    __session = 0
+    __rollback = False
+    __vacuum_runs = 0
+    __pages_reclaimed = 0
 
     def __init__(self, root="", create=True):
         if root is None:
@@ -255,8 +572,37 @@ class PackageDB:
             flags integer,
             mode integer)""")
         self._closedb()
+        self._upgradeschema()
         return
 
+    def _upgradeschema(self):
+        import sqlite3
+        cur = self._connectdb(cursor=True)
+        try:
+            cur.execute("PRAGMA user_version")
+            version = cur.fetchone()[0]
+            if version >= PKGDB_SCHEMA_VERSION:
+                return
+            log.debug("Upgrading %s from schema version %d to %d",
+                      self.__db_path, version, PKGDB_SCHEMA_VERSION)
+            cur.execute("BEGIN")
+            try:
+                for stmts in PKGDB_SCHEMA_UPGRADES[version:]:
+                    for stmt in stmts:
+                        cur.execute(stmt)
+                # PRAGMA doesn't allow parameters
+                cur.execute("PRAGMA user_version = %d" % PKGDB_SCHEMA_VERSION)
+                cur.execute("COMMIT")
+            except:
+                cur.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as err:
+            # An older schema still works, just more slowly
+            # (e.g., a read-only database).
+            log.error("Could not upgrade schema for %s: %s", self.__db_path, str(err))
+        finally:
+            self._closedb()
+
     def _connectdb(self, returniferror=False, cursor=False, isolation_level=None):
         import sqlite3
         if self.__conn is not None:
@@ -284,12 +630,108 @@ class PackageDB:
         return True
 
     def _closedb(self):
+        if self.__session > 0:
+            # The connection (and the transaction) stay open until
+            # the session is ended.
+            return
         if self.__conn is not None:
             self.__conn.commit()
             self.__conn.close()
             self.__conn = None
         return
 
+    def StartSession(self):
+        """
+        Start a session:  until EndSession() is called, every method
+        uses the same database connection, and all changes are made
+        in a single transaction.  Sessions can be nested; only the
+        outermost EndSession() commits or rolls back.
+        """
+        if self.__session == 0:
+            self._connectdb()
+            self.__conn.execute("BEGIN")
+            self.__rollback = False
+        self.__session += 1
+        return self
+
+    def EndSession(self, commit=True):
+        """
+        End a session started by StartSession().  If commit is False
+        (for this or any nested session), all of the changes made
+        during the session are discarded.
+        """
+        if self.__session == 0:
+            raise Exception("No session for database file {0}".format(self.__db_path))
+        if not commit:
+            self.__rollback = True
+        self.__session -= 1
+        if self.__session > 0:
+            return
+        try:
+            if self.__rollback:
+                self.__conn.execute("ROLLBACK")
+            else:
+                self.__conn.execute("COMMIT")
+        finally:
+            self.__conn.close()
+            self.__conn = None
+        return
+
+    def __enter__(self):
+        return self.StartSession()
+
+    def __exit__(self, type, value, traceback):
+        self.EndSession(commit=type is None)
+
+    def FreePages(self):
+        # Returns the number of unused pages in the database file.
+        cur = self._connectdb(cursor=True)
+        cur.execute("PRAGMA freelist_count")
+        rv = cur.fetchone()[0]
+        self._closedb()
+        return rv
+
+    def Vacuum(self, threshold=PKGDB_VACUUM_THRESHOLD):
+        """
+        Compact the database file, but only if at least threshold pages
+        are unused.  Removing packages no longer does this, so callers
+        should do it once they are done making changes (Installer.InstallPackages()
+        does it once per run).  VACUUM can't be run inside a transaction,
+        so this may not be called during a session.
+        Returns the number of pages reclaimed.
+        """
+        if self.__session > 0:
+            raise Exception("Cannot vacuum database file {0} during a session".format(self.__db_path))
+        cur = self._connectdb(cursor=True)
+        try:
+            cur.execute("PRAGMA freelist_count")
+            free_pages = cur.fetchone()[0]
+            if free_pages < threshold:
+                log.debug("Not vacuuming %s, %d free pages", self.__db_path, free_pages)
+                return 0
+            cur.execute("PRAGMA page_count")
+            before = cur.fetchone()[0]
+            cur.execute("VACUUM")
+            cur.execute("PRAGMA page_count")
+            after = cur.fetchone()[0]
+        finally:
+            self._closedb()
+        reclaimed = max(before - after, 0)
+        self.__vacuum_runs += 1
+        self.__pages_reclaimed += reclaimed
+        log.debug("Vacuumed %s, reclaimed %d pages", self.__db_path, reclaimed)
+        return reclaimed
+
+    def VacuumStats(self):
+        """
+        Returns a dictionary with the number of times Vacuum() actually
+        compacted the database, and the total number of pages reclaimed.
+        """
+        return {
+            "runs": self.__vacuum_runs,
+            "pages_reclaimed": self.__pages_reclaimed,
+        }
+
     def FindPackage(self, pkgName):
         self._connectdb()
         cur = self.__conn.cursor()
@@ -419,6 +861,14 @@ class PackageDB:
             self._closedb()
         return
 
+    def RemoveFileEntriesBulk(self, paths):
+        # Remove the database entries for a list of paths, in one transaction.
+        # This only affects the database.
+        self._connectdb(isolation_level="DEFERRED")
+        cur = self.__conn.cursor()
+        cur.executemany("DELETE FROM files WHERE path = ?", [(path, ) for path in paths])
+        self._closedb()
+
     def RemovePackageFiles(self, pkgName):
         # Remove the files in a package.  This removes them from
         # both the filesystem and database.
@@ -439,7 +889,6 @@ class PackageDB:
                 raise Exception("Cannot remove file %s" % path)
             file_list.append((path, ))
         cur.executemany("DELETE FROM files WHERE path = ?", file_list)
-        cur.execute("VACUUM")
         self._closedb()
         return True
 
@@ -466,7 +915,6 @@ class PackageDB:
                 raise Exception("Cannot remove directory %s" % path)
             dir_list.append((path, ))
         cur.executemany("DELETE FROM files WHERE path = ?", dir_list)
-        cur.execute("VACUUM")
         self._closedb()
         return True
 
@@ -604,6 +1052,9 @@ class Configuration(object):
     _package_dir = None
 
     _manifest = None
+    _transport = None
+    _transport_lock = threading.Lock()
+    _cache_max_age = HTTP_CACHE_MAX_AGE
 
     def __init__(self, root=None, file=None):
         if root is not None:
@@ -667,9 +1118,32 @@ class Configuration(object):
         if save:
             self.StoreUpdateConfigurationFile(self._config_path)
         
+    def CacheMaxAge(self):
+        return self._cache_max_age
+
+    def SetCacheMaxAge(self, age):
+        # How long (in seconds) cached trains lists, manifests, and
+        # CRLs are used without checking with the server.  0 means
+        # always check.
+        self._cache_max_age = int(age)
+
+    def Transport(self):
+        # The HTTPTransport used for all of our network requests.
+        # Packages may be downloaded from several threads at once.
+        with self._transport_lock:
+            if self._transport is None:
+                self._transport = HTTPTransport(ca_certs=DEFAULT_CA_FILE)
+        return self._transport
+
     def TryGetNetworkFile(self, file=None, url=None, handler=None,
                           pathname=None, reason=None, intr_ok=False,
-                          ignore_space=False):
+                          ignore_space=False, digest=False, cached=False):
+        # If digest is True, this returns (file, sha256 hexdigest), with
+        # the checksum computed as the file is downloaded, instead of
+        # just the file.
+        # If cached is True, the file is kept in a ResponseCache, and
+        # requested conditionally; this is meant for small files that
+        # are fetched often, and can't be used with intr_ok.
         AVATAR_VERSION = "X-%s-Manifest-Version" % Avatar()
         current_sequence = "unknown"
         current_train = None
@@ -732,13 +1206,50 @@ class Configuration(object):
             if read > 0:
                 log.debug("File already exists, using a starting size of %d" % read)
 
+            hash = hashlib.sha256() if digest else None
+            if hash and read > 0:
+                # Resuming an interrupted download, so the part we
+                # already have has to be hashed first.
+                retval.seek(0)
+                remaining = read
+                while remaining > 0:
+                    data = retval.read(min(remaining, 1024 * 1024))
+                    if not data:
+                        break
+                    hash.update(data)
+                    remaining -= len(data)
+                retval.seek(read)
+
+            def result():
+                retval.seek(0)
+                if hash:
+                    return (retval, hash.hexdigest())
+                return retval
+
+            cache = None
+            if cached and not intr_ok:
+                cache = ResponseCache(self._temp, max_age=self._cache_max_age)
+
+            def cached_result(body):
+                retval.seek(0)
+                retval.truncate()
+                retval.write(body)
+                if hash:
+                    hash.update(body)
+                return result()
+
             furl = None
             for url in file_url:
                 url_exc = None
+                entry = cache.Lookup(url) if cache else None
+                if entry and cache.Fresh(entry[0]):
+                    log.debug("TryGetNetworkFile(%s):  Using cached copy" % url)
+                    return cached_result(entry[1])
                 try:
-                    https_handler = VerifiedHTTPSHandler(ca_certs=DEFAULT_CA_FILE)
-                    opener = build_opener(https_handler)
                     req = Request(url)
+                    if entry:
+                        for k, v in cache.ConditionalHeaders(entry[0]).items():
+                            req.add_header(k, v)
                     req.add_header("X-iXSystems-Project", Avatar())
                     req.add_header("X-iXSystems-Version", current_sequence)
                     if current_version:
@@ -758,14 +1269,17 @@ class Configuration(object):
                     if intr_ok:
                         req.add_header("Range", "bytes=%d-" % read)
 
-                    furl = opener.open(req, timeout=30)
+                    furl = self.Transport().open(req)
                 except HTTPError as error:
                     if error.code == HTTP_RANGE:
                         # We've reached the end of the file already
                         # Can I get this incorrectly from any other server?
                         # Do I need to do something different for the progress handler?
-                        retval.seek(0)
-                        return retval
+                        return result()
+                    if error.code == HTTP_NOT_MODIFIED and entry:
+                        log.debug("TryGetNetworkFile(%s):  Not modified, using cached copy" % url)
+                        cache.Refresh(url, entry[0], entry[1])
+                        return cached_result(entry[1])
                     log.error("Got http error %s" % str(error))
                     url_exc = error
                 except BaseException as e:
@@ -781,6 +1295,13 @@ class Configuration(object):
                 if furl:
                     furl.close()
                     furl = None
+                if cache and not (isinstance(url_exc, HTTPError) and url_exc.code < 500):
+                    # Can't reach the server, so a stale copy is better than nothing.
+                    for url in file_url:
+                        entry = cache.Lookup(url)
+                        if entry:
+                            log.debug("TryGetNetworkFile(%s):  Using stale cached copy" % url)
+                            return cached_result(entry[1])
                 if retval:
                     retval.close()
                 log.error("Unable to load %s: %s", file_url, str(url_exc))
@@ -837,17 +1358,23 @@ class Configuration(object):
                             )
                         lastpercent = percent
                     retval.write(data)
+                    if hash:
+                        hash.update(data)
             except Exception as e:
                 log.debug("Got exception %s" % str(e), exc_info=True)
                 if intr_ok is False and pathname:
                     os.unlink(pathname)
                 raise e
-            retval.seek(0)
+            finally:
+                furl.close()
+            if cache:
+                retval.seek(0)
+                cache.Store(url, furl.info(), retval.read())
+            return result()
         except:
             if retval:
                 retval.close()
             raise
-        return retval
 
     # Load the list of currently-watched trains.
     # The file is a JSON file.
@@ -944,6 +1471,10 @@ class Configuration(object):
             # We are using a different one
             cfp.add_section(CONFIG_DEFAULT)
             cfp.set(CONFIG_DEFAULT, CONFIG_SERVER, self._update_server_name)
+        if self._cache_max_age != HTTP_CACHE_MAX_AGE:
+            if not cfp.has_section(CONFIG_DEFAULT):
+                cfp.add_section(CONFIG_DEFAULT)
+            cfp.set(CONFIG_DEFAULT, CONFIG_CACHE_AGE, str(self._cache_max_age))
         for name, server in self._update_servers.items():
             if name == default_update_server.name:
                 # We don't write this one out
@@ -993,6 +1524,11 @@ class Configuration(object):
             if section == CONFIG_DEFAULT:
                 if cfp.has_option(CONFIG_DEFAULT, CONFIG_SERVER):
                     self._update_server_name = cfp.get(CONFIG_DEFAULT, CONFIG_SERVER)
+                if cfp.has_option(CONFIG_DEFAULT, CONFIG_CACHE_AGE):
+                    try:
+                        self._cache_max_age = cfp.getint(CONFIG_DEFAULT, CONFIG_CACHE_AGE)
+                    except ValueError:
+                        log.error("Invalid %s value, using default", CONFIG_CACHE_AGE)
             else:
                 if cfp.has_option(section, UPDATE_SERVER_NAME_KEY) and \
                    cfp.has_option(section, UPDATE_SERVER_URL_KEY):
@@ -1061,7 +1597,7 @@ class Configuration(object):
         I decide it should be called.
         """
         rv = {}
-        fileref = self.TryGetNetworkFile(file=TRAIN_FILE, reason="FetchTrains")
+        fileref = self.TryGetNetworkFile(file=TRAIN_FILE, reason="FetchTrains", cached=True)
 
         if fileref is None:
             return None
@@ -1179,6 +1715,7 @@ class Configuration(object):
 
         mani_file = self.TryGetNetworkFile(url="%s/%s/LATEST" % (self.UpdateServerMaster(), train),
                                       reason="GetLatestManifest",
+                                      cached=True,
                                       )
         if mani_file is None:
             log.debug("Could not get latest manifest file for train %s" % train)
@@ -1221,7 +1758,8 @@ class Configuration(object):
             return None
 
     def FindPackageFile(self, package, upgrade_from=None, handler=None,
-                        save_dir=None, pkg_type=None, ignore_space=False):
+                        save_dir=None, pkg_type=None, ignore_space=False,
+                        checksum_cache=False, paranoid=False):
         # Given a package, and optionally a version to upgrade from, find
         # the package file for it.  Returns a file-like
         # object for the package file.
@@ -1235,6 +1773,11 @@ class Configuration(object):
         # the manifest file, so we won't do the checksum verification --
         # we'll only go by name.
         # If it can't find one, it returns None
+        # checksum_cache should only be set when the package directory
+        # is an update cache directory; the checksums of the local files
+        # are then remembered in a ChecksumCache there (and rehashed
+        # anyway if paranoid is set).  Otherwise, such as for install
+        # media, local files are always hashed, and nothing is written.
 
         # We have at least one, and at most two, files
         # to look for.
@@ -1296,7 +1839,11 @@ class Configuration(object):
                         file = open(p, 'rb')
                         log.debug("Found package file %s" % p)
                         if search_attempt["Checksum"]:
-                            h = ChecksumFile(file)
+                            if checksum_cache:
+                                cache = ChecksumCache(self._package_dir, paranoid=paranoid)
+                                h = cache.Checksum(search_attempt["Filename"], file)
+                            else:
+                                h = ChecksumFile(file)
                             if h == search_attempt["Checksum"]:
                                 return file
                             else:
@@ -1316,21 +1863,28 @@ class Configuration(object):
 
             try:
                 file = None
-                file = self.TryGetNetworkFile(
+                # The checksum is computed while the file is downloaded,
+                # so it doesn't need to be read again.
+                rv = self.TryGetNetworkFile(
                     file=pFile,
                     handler=handler,
                     pathname=save_name,
                     reason="DownloadPackageFile",
                     intr_ok=True,
-                    ignore_space=ignore_space
+                    ignore_space=ignore_space,
+                    digest=True,
                 )
+                if rv:
+                    (file, h) = rv
+                    if save_dir:
+                        # Save VerifyUpdate from hashing it again.
+                        ChecksumCache(save_dir).Add(search_attempt["Filename"], h)
             except BaseException as e:
                 log.debug("Trying to get %s, got exception %s, continuing" % (pFile, str(e)))
                 continue
 
             if file:
                 if search_attempt["Checksum"]:
-                    h = ChecksumFile(file)
                     if h == search_attempt["Checksum"]:
                         return file
                     else:
@@ -1365,6 +1919,61 @@ def is_ignore_path(path):
     return False
 
 
+class VerifyCache(object):
+    """
+    A record of the files do_verify() found to have the right checksum,
+    keyed by path, with the file's (st_dev, st_ino, st_size, st_mtime_ns,
+    st_ctime_ns) and checksum.  If none of those have changed, the file
+    doesn't need to be hashed again.  It is kept next to the pkgdb.
+    """
+    CACHE_NAME = "data/pkgdb/verify-cache"
+
+    def __init__(self, root=""):
+        if root is None:
+            root = ""
+        self._path = root + "/" + VerifyCache.CACHE_NAME
+        self._entries = {}
+        self._new_entries = {}
+
+    @staticmethod
+    def _key(st, checksum):
+        return [st.st_dev, st.st_ino, st.st_size,
+                _StatTimeNS(st, "st_mtime"), _StatTimeNS(st, "st_ctime"), checksum]
+
+    def Load(self):
+        import json
+        try:
+            with open(self._path, "r") as f:
+                self._entries = json.load(f)
+        except:
+            # Missing or bad, it doesn't matter which.
+            self._entries = {}
+        return
+
+    def Save(self):
+        # Only the files seen since Load() are written out, so
+        # files that have gone away are dropped.
+        import json
+        temp_path = self._path + ".new"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self._new_entries, f)
+            os.rename(temp_path, self._path)
+        except (IOError, OSError) as e:
+            log.debug("Could not save verify cache %s: %s", self._path, str(e))
+        return
+
+    def Verified(self, path, st, checksum):
+        # Returns True if path was verified with the same checksum, and
+        # hasn't changed since.  This doesn't change the cache, so it
+        # is safe to call from several threads.
+        return self._entries.get(path) == VerifyCache._key(st, checksum)
+
+    def Add(self, path, st, checksum):
+        # Record that path was verified (or is still verified), for the next Save().
+        self._new_entries[path] = VerifyCache._key(st, checksum)
+
+
 def get_ftype_and_perm(mode):
     """
     Returns a tuple of whether the file is: file(regular file)/dir/slink
@@ -1389,18 +1998,21 @@ def get_ftype_and_perm(mode):
     return "unknown", "unknown"
 
 
-def check_ftype(objs):
+def check_ftype(objs, lst_var=None):
     """
     Checks the filetype, permissions and uid,gid of the
     pkgdg object(objs) sent to it. Returns two dicts: ed and pd
     (the error_dict with a descriptive explanantion of the problem
     if present, none otherwise, the perm_dict with a description of
     the incoorect perms if present, none otherwise
+    lst_var is the result of os.lstat() on the path, if the caller
+    already has it.
     """
 
     ed = None
     pd = None
-    lst_var = os.lstat(objs["path"])
+    if lst_var is None:
+        lst_var = os.lstat(objs["path"])
     ftype, perm = get_ftype_and_perm(lst_var.st_mode)
     if ftype != objs["kind"]:
         ed = dict([
@@ -1424,10 +2036,120 @@ def check_ftype(objs):
     return ed, pd
 
 
-def do_verify(verify_handler=None):
+# Results of verify_entry() for files, besides any problems found.
+VERIFY_HASHED = "hashed"
+VERIFY_SKIPPED = "skipped"
+
+# How many files, per worker, do_verify() queues up at once.
+VERIFY_QUEUE_DEPTH = 4
+
+
+def verify_entry(objs, cache=None):
+    """
+    Verifies a single pkgdb entry against the root filesystem.  This is
+    what do_verify() runs, possibly on several threads at once, so it
+    doesn't change anything.
+    File contents are hashed in chunks (see ChecksumFile()), so memory
+    use does not depend on the size of the file.
+    Returns None if the path is ignored, or a tuple of (errors, pd, status,
+    lst_var):  errors is a list of (error_list key, error dict), pd is a
+    permission problem dict (or None), status is VERIFY_HASHED or
+    VERIFY_SKIPPED if the file contents were checked (or skipped, because
+    cache says it's unchanged), and lst_var is the result of os.lstat().
+    """
+    tmp = b''  # Just a temp. variable to store the text to be hashed
+    hash = None
+    errors = []
+    status = None
+    if is_ignore_path(objs["path"]):
+        return None
+    if not os.path.lexists(objs["path"]):
+        # This basically just checks if the file/slink/dir exists or not.
+        # Note: not using os.path.exists(path) here as that returns false
+        # even if its a broken symlink and that is a differret problem
+        # and will be caught in one of the if conds below.
+        # For more information: https://docs.python.org/2/library/os.path.html
+        errors.append(('notfound', dict([
+            ('path', objs["path"]),
+            ('problem', 'path does not exsist'),
+            ('pkgdb_entry', objs)
+        ])))
+        return errors, None, None, None
+
+    lst_var = os.lstat(objs["path"])
+    ed, pd = check_ftype(objs, lst_var)
+    if ed:
+        errors.append(('wrongtype', ed))
+
+    if objs["kind"] == "slink":
+        tmp = os.readlink(objs["path"]).encode('utf8')
+        if tmp.startswith(b'/'):
+            tmp = tmp[1:]
+
+    if objs["kind"] == "file":
+        if objs["path"].endswith(".pyc"):
+            return errors, pd, None, lst_var
+        if not objs["checksum"] or objs["checksum"] == "-":
+            # Nothing to compare the contents to
+            return errors, pd, None, lst_var
+        if not ed and cache and cache.Verified(objs["path"], lst_var, objs["checksum"]):
+            return errors, pd, VERIFY_SKIPPED, lst_var
+        with open(objs["path"], 'rb') as f:
+            hash = ChecksumFile(f)
+        status = VERIFY_HASHED
+
+    # Do this last (as it needs to be done for all, but dirs, as dirs have no checksum d'oh!)
+    if hash is None:
+        hash = hashlib.sha256(tmp).hexdigest()
+    if (
+        objs["kind"] != 'dir' and
+        objs["checksum"] and
+        objs["checksum"] != "-" and
+        hash != objs["checksum"]
+       ):
+        errors.append(('checksum', dict([
+            ('path', objs["path"]),
+            ('problem', 'checksum does not match'),
+            ('pkgdb_entry', objs)
+        ])))
+    return errors, pd, status, lst_var
+
+
+def _VerifyInParallel(filelist, cache, workers):
+    # Yields verify_entry() for each entry of filelist, in order,
+    # verifying them with workers threads.  Only VERIFY_QUEUE_DEPTH
+    # entries per worker are submitted at a time.  If the generator
+    # is closed early (or verify_entry() raises), the queued entries
+    # are cancelled, and the ones being verified are waited for.
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for objs in filelist:
+            if len(pending) >= workers * VERIFY_QUEUE_DEPTH:
+                yield pending.popleft().result()
+            pending.append(executor.submit(verify_entry, objs, cache))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def do_verify(verify_handler=None, full=False, stats=None, workers=1):
     """
     A function that goes through the provided pkgdb filelist and verifies it with
     the current root filesystem.
+    Files that were verified by an earlier run, and have not changed since
+    (see VerifyCache), are not hashed again, unless full is True.
+    If stats is a dictionary, the number of files that were hashed and
+    skipped are put into it (keys "hashed" and "skipped"), along with the
+    peak resident set size of the process, in kilobytes ("peak_rss").
+    If workers is more than 1, that many files are verified at once;
+    the results, and the calls to verify_handler, are still in pkgdb order.
     """
 
     error_flag = False
@@ -1445,58 +2167,45 @@ def do_verify(verify_handler=None):
         raise IOError("Cannot get pkgdb connection")
     filelist = pkgdb.FindFilesForPackage()
     total_files = len(filelist)
+    cache = VerifyCache()
+    if not full:
+        cache.Load()
+    hashed = skipped = 0
 
-    for objs in filelist:
-        i = i+1
-        if verify_handler is not None:
-            verify_handler(i, total_files, objs["path"])
-        tmp = b''  # Just a temp. variable to store the text to be hashed
-        if is_ignore_path(objs["path"]):
-            continue
-        if not os.path.lexists(objs["path"]):
-            # This basically just checks if the file/slink/dir exists or not.
-            # Note: not using os.path.exists(path) here as that returns false
-            # even if its a broken symlink and that is a differret problem
-            # and will be caught in one of the if conds below.
-            # For more information: https://docs.python.org/2/library/os.path.html
-            error_flag = True
-            error_list['notfound'].append(dict([
-                ('path', objs["path"]),
-                ('problem', 'path does not exsist'),
-                ('pkgdb_entry', objs)
-            ]))
-            continue
-
-        ed, pd = check_ftype(objs)
-        if ed:
-            error_flag = True
-            error_list['wrongtype'].append(ed)
-        if pd:
-            warn_flag = True
-            warn_list.append(pd)
-
-        if objs["kind"] == "slink":
-            tmp = os.readlink(objs["path"]).encode('utf8')
-            if tmp.startswith(b'/'):
-                tmp = tmp[1:]
-
-        if objs["kind"] == "file":
-            if objs["path"].endswith(".pyc"):
+    if workers > 1:
+        results = _VerifyInParallel(filelist, cache, workers)
+    else:
+        results = (verify_entry(objs, cache) for objs in filelist)
+
+    try:
+        for objs, result in zip(filelist, results):
+            i = i+1
+            if verify_handler is not None:
+                verify_handler(i, total_files, objs["path"])
+            if result is None:
                 continue
-            with open(objs["path"], 'rb') as f:
-                tmp = f.read()
-
-        # Do this last (as it needs to be done for all, but dirs, as dirs have no checksum d'oh!)
-        if (
-            objs["kind"] != 'dir' and
-            objs["checksum"] and
-            objs["checksum"] != "-" and
-            hashlib.sha256(tmp).hexdigest() != objs["checksum"]
-           ):
-            error_flag = True
-            error_list['checksum'].append(dict([
-                ('path', objs["path"]),
-                ('problem', 'checksum does not match'),
-                ('pkgdb_entry', objs)
-            ]))
+            (errors, pd, status, lst_var) = result
+            for (key, ed) in errors:
+                error_flag = True
+                error_list[key].append(ed)
+            if pd:
+                warn_flag = True
+                warn_list.append(pd)
+            if status is not None:
+                if status == VERIFY_HASHED:
+                    hashed += 1
+                else:
+                    skipped += 1
+                if not errors:
+                    cache.Add(objs["path"], lst_var, objs["checksum"])
+    finally:
+        # Stops any verification still queued, if there was an error.
+        results.close()
+
+    cache.Save()
+    if stats is not None:
+        import resource
+        stats["hashed"] = hashed
+        stats["skipped"] = skipped
+        stats["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     return error_flag, error_list, warn_flag, warn_list
@@ -7,6 +7,7 @@ import json
 import tarfile
 import hashlib
 import logging
+import shutil
 import tempfile
 import subprocess
 from . import modified_call
@@ -177,6 +178,22 @@ def RemoveFile(path):
     return True
 
 
+# Remove a list of files, using a small thread pool,
+# since this is mostly waiting on the filesystem.
+# Returns the list of files that could not be removed.
+REMOVE_FILES_WORKERS = 4
+
+
+def RemoveFiles(paths):
+    from concurrent.futures import ThreadPoolExecutor
+    if len(paths) < 2:
+        results = [RemoveFile(path) for path in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=REMOVE_FILES_WORKERS) as executor:
+            results = list(executor.map(RemoveFile, paths))
+    return [path for (path, removed) in zip(paths, results) if removed is False]
+
+
 # Like the above, but for a directory.
 def RemoveDirectory(path):
     st = None
@@ -226,6 +243,38 @@ def SetPosix(path, meta):
                 raise e
 
 
+def CanonicalPath(name, prefix=None):
+    # Turn a tar member (or manifest) name into the path that goes
+    # into the database:  a leading "./" is removed, and relative
+    # names are put under prefix, if there is one.
+    if name.startswith("./"):
+        name = name[2:]
+    if name.startswith("/") or prefix is None:
+        return name
+    return "%s%s%s" % (prefix, "" if prefix.endswith("/") else "/", name)
+
+
+def PathIndexKey(name, prefix=None):
+    # The key used by ManifestPathIndex():  the canonical path,
+    # always with a leading "/".  (The manifest may have relative
+    # or absolute paths, and tar may remove a leading slash to
+    # make us secure.)
+    path = CanonicalPath(name, prefix)
+    return path if path.startswith("/") else "/" + path
+
+
+def ManifestPathIndex(mfiles, mdirs, prefix=None):
+    # Build a single index of the files and directories in a package
+    # manifest, keyed by PathIndexKey().  Files map to their hash;
+    # directories map to "-", since they don't have one.
+    index = {}
+    for name in mdirs:
+        index[PathIndexKey(name, prefix)] = "-"
+    for name, hash in mfiles.items():
+        index[PathIndexKey(name, prefix)] = hash
+    return index
+
+
 def EntryInDictionary(name, mDict, prefix):
     if (name in mDict):
         return True
@@ -373,13 +422,7 @@ def ExtractEntry(tf, entry, root, prefix=None, mFileHash=None):
     orig_type = None
     new_type = None
 
-    fileName = entry.name
-    if fileName.startswith("./"):
-        fileName = fileName[2:]
-    if fileName.startswith("/") or prefix is None:
-        pass
-    else:
-        fileName = "%s%s%s" % (prefix, "" if prefix.endswith("/") or entry.name.startswith("/") else "/", fileName)
+    fileName = CanonicalPath(entry.name, prefix)
     if root:
         full_path = "%s%s%s" % (root, "" if root.endswith("/") or fileName.startswith("/") else "/", fileName)
     else:
@@ -452,61 +495,54 @@ def ExtractEntry(tf, entry, root, prefix=None, mFileHash=None):
     # symlink, or hard link.
     if entry.isfile():
         fileData = tf.extractfile(entry)
-        # Is this a problem?  Keeping the file in memory?
-        # Note that we write the file out later, so this allows
-        # us to not worry about the buffer.
+        # The data is hashed as it is written to a temporary file
+        # in the destination directory, which is then renamed into
+        # place.  So it is only written once, and the old file is
+        # never seen half-written.
         try:
-            temp_entry = tempfile.TemporaryFile(dir=os.path.dirname(full_path))
+            (fd, temp_path) = tempfile.mkstemp(dir=dirname, prefix=".pkgtmp.")
         except:
-            s = "Cannot create temporary file in %s" % os.path.dirname(full_path)
+            s = "Cannot create temporary file in %s" % dirname
             log.error(s)
             raise
         hash = hashlib.sha256()
-        while True:
-            d = fileData.read(1024 * 1024)
-            if d:
-                hash.update(d)
-                temp_entry.write(d)
-            else:
-                break
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    d = fileData.read(1024 * 1024)
+                    if d:
+                        hash.update(d)
+                        f.write(d)
+                    else:
+                        break
+        except:
+            RemoveFile(temp_path)
+            raise
         hash = hash.hexdigest()
-        temp_entry.seek(0)
         # PKGNG sets hash to "-" if it's not computed.
         if mFileHash != "-":
             if hash != mFileHash:
                 log.error("%s hash does not match manifest" % entry.name)
         type = "file"
-        # First we try to create the file.
-        # If that doesn't work, we try to create a
-        # new file (how would this get cleaned up?),
-        # and then rename it in place.
-        # We remove any flags on it -- if there are
-        # supposed to be any, SetPosix() will get them.
-        # (We hope.)
+        # We remove any flags on the old file, so it can be
+        # replaced -- if there are supposed to be any,
+        # SetPosix() will get them.  (We hope.)
+        # If the rename doesn't work, we try moving the old
+        # file out of the way first.
         try:
             os.lchflags(full_path, 0)
         except:
             pass
-        newfile = None
         try:
-            f = open(full_path, "wb")
+            os.rename(temp_path, full_path)
         except:
-            newfile = full_path + ".new"
-            f = open(newfile, "wb")
-        while True:
-            d = temp_entry.read(1024 * 1024)
-            if d:
-                f.write(d)
-            else:
-                break
-        f.close()
-        temp_entry.close()
-        if newfile is not None:
             try:
-                os.rename(newfile, full_path)
-            except:
                 os.rename(full_path, "%s.old" % full_path)
-                os.rename(newfile, full_path)
+                os.rename(temp_path, full_path)
+            except:
+                log.error("Could not rename %s to %s" % (temp_path, full_path))
+                RemoveFile(temp_path)
+                raise
         SetPosix(full_path, meta)
     elif entry.isdir():
         # If the directory already exists, we don't care.
@@ -612,6 +648,117 @@ def ExtractEntry(tf, entry, root, prefix=None, mFileHash=None):
         return None
 
 
+# How much decompressed data a DecompressedStream may buffer ahead
+# of the reader.
+kDecompressChunk = 1024 * 1024
+kDecompressAhead = 16
+
+
+class DecompressedStream(object):
+    # A read-only, sequential file object giving the decompressed
+    # contents of a gzipped package file.  A thread decompresses
+    # ahead of the reader, holding at most kDecompressAhead chunks,
+    # so nothing is written to disk.  The tar file must be opened
+    # in stream mode ("r|") to read it.
+    def __init__(self, pkgfile):
+        import gzip
+        import threading
+        from six.moves import queue
+        self.name = getattr(pkgfile, "name", None)
+        self._gz = gzip.GzipFile(fileobj=pkgfile, mode="rb")
+        self._queue = queue.Queue(maxsize=kDecompressAhead)
+        self._chunk = b""
+        self._offset = 0
+        self._done = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._Decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _Put(self, item):
+        from six.moves import queue
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _Decompress(self):
+        # Queues chunks of data, followed by None at the end,
+        # or the exception if decompression failed.
+        try:
+            while True:
+                data = self._gz.read(kDecompressChunk)
+                if not data:
+                    break
+                if not self._Put(data):
+                    return
+            self._Put(None)
+        except BaseException as e:
+            self._Put(e)
+
+    def read(self, size=-1):
+        # tarfile reads in small blocks, so the current chunk is
+        # consumed from an offset, rather than being copied each time.
+        parts = []
+        while size is None or size < 0 or size > 0:
+            if self._offset >= len(self._chunk):
+                if self._done:
+                    break
+                item = self._queue.get()
+                if item is None:
+                    self._done = True
+                    break
+                if isinstance(item, BaseException):
+                    self._done = True
+                    raise item
+                self._chunk = item
+                self._offset = 0
+            end = len(self._chunk)
+            if size is not None and size >= 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            parts.append(self._chunk[self._offset:end])
+            self._offset = end
+        return b"".join(parts)
+
+    def close(self):
+        from six.moves import queue
+        if self._closed:
+            return
+        self._closed = True
+        # Unblock the thread if it is waiting on a full queue.
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+        self._gz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def DecompressPackage(pkgfile):
+    # Start decompressing a (gzipped) package file in the background,
+    # so install_file() doesn't have to decompress it.  Returns a
+    # DecompressedStream, or None if the package file isn't gzipped
+    # (in which case it should be installed as-is).
+    pkgfile.seek(0)
+    magic = pkgfile.read(2)
+    pkgfile.seek(0)
+    if magic != b"\x1f\x8b":
+        log.debug("%s is not gzipped" % getattr(pkgfile, "name", pkgfile))
+        return None
+    return DecompressedStream(pkgfile)
+
+
 def install_path(pkgfile, dest):
     try:
         f = open(pkgfile, "r")
@@ -624,10 +771,22 @@ def install_path(pkgfile, dest):
 
 def install_file(pkgfile, dest, **kwargs):
     from . import Configuration
+    # We explicitly want to use the pkgdb from the destination.
+    # The whole installation is done in one database session, so
+    # the database is only changed if the install succeeds.
+    pkgdb = Configuration.PackageDB(dest)
+    rv = False
+    pkgdb.StartSession()
+    try:
+        rv = _install_file(pkgfile, dest, pkgdb, **kwargs)
+    finally:
+        pkgdb.EndSession(commit=(rv is True))
+    return rv
+
+
+def _install_file(pkgfile, dest, pkgdb, **kwargs):
     global debug, verbose, dryrun
     prefix = None
-    # We explicitly want to use the pkgdb from the destination
-    pkgdb = Configuration.PackageDB(dest)
     pkgScripts = None
     upgrade_aware = False
     progress = kwargs.pop("progress", None)
@@ -635,7 +794,8 @@ def install_file(pkgfile, dest, **kwargs):
         progress = lambda **kwargs: True
     
     try:
-        t = tarfile.open(fileobj=pkgfile)
+        # The package is read once, in order, so it can be streamed.
+        t = tarfile.open(fileobj=pkgfile, mode="r|*")
     except Exception as err:
         log.error("Could not open package file %s: %s" % (pkgfile.name, str(err)))
         return False
@@ -651,6 +811,10 @@ def install_file(pkgfile, dest, **kwargs):
             manifest = t.extractfile(member)
             mjson = json.loads(manifest.read().decode('utf8'))
             manifest.close()
+    else:
+        # Nothing but '+' entries (such as a delta package that only
+        # removes files); the stream can't be read any further.
+        member = None
 
     # All packages must have a +MANIFEST file.
     # (We don't support +COMPACT_MANIFEST, at least not yet)
@@ -707,14 +871,14 @@ def install_file(pkgfile, dest, **kwargs):
         mdirs.update(mjson[PKG_DIRECTORIES_KEY])
     if PKG_DIRS_KEY in mjson:
         mdirs.update(mjson[PKG_DIRS_KEY])
+    mindex = ManifestPathIndex(mfiles, mdirs, prefix)
 
     log.debug("%s-%s" % (pkgName, pkgVersion))
     if debug > 1:
         log.debug("installation target = %s" % dest)
 
-    # Note that none of this is at all atomic.
-    # To fix that, I should go to a persistent sqlite connection,
-    # and use a transaction.
+    # The database changes are atomic (see install_file()), but
+    # the filesystem changes are not.
     old_pkg = pkgdb.FindPackage(pkgName)
     # Should DB be updated before or after installation?
     if old_pkg is not None:
@@ -778,17 +942,14 @@ def install_file(pkgfile, dest, **kwargs):
             # Next step for a delta package is to remove any removed files and directories.
             # This is done in both the database and the filesystem.
             # If we can't remove a directory due to ENOTEMPTY, we don't care.
-            for file in pkgDeletedFiles:
-                if dest:
-                    full_path = dest + "/" + file
-                else:
-                    full_path = "/" + file
-                if RemoveFile(full_path) == False:
-                    if debug:
-                        log.debug("Could not remove file %s" % file)
-                    # Ignor error for now
-                pkgdb.RemoveFileEntry(file)
+            full_paths = [(dest + "/" + file) if dest else ("/" + file) for file in pkgDeletedFiles]
+            for full_path in RemoveFiles(full_paths):
+                if debug:
+                    log.debug("Could not remove file %s" % full_path)
+                # Ignor error for now
+            pkgdb.RemoveFileEntriesBulk(pkgDeletedFiles)
             # Now we try to delete the directories.
+            # This has to be done in order, since they may be nested.
             for dir in pkgDeletedDirs:
                 if verbose or debug:
                     log.debug("Attempting to remove directory %s" % dir)
@@ -797,7 +958,7 @@ def install_file(pkgfile, dest, **kwargs):
                 else:
                     full_path = "/" + dir
                 RemoveDirectory(full_path)
-                pkgdb.RemoveFileEntry(dir)
+            pkgdb.RemoveFileEntriesBulk(pkgDeletedDirs)
             # Later on, when the package is upgraded, the scripts in the database are deleted.
             # So we don't have to do that now.
         else:
@@ -876,30 +1037,14 @@ def install_file(pkgfile, dest, **kwargs):
     pkgFiles = []
     progress_count = 0
     while member is not None:
-        # To figure out the hash, we need to look
-        # at <file>, <prefix + file>, and both of those
-        # with and without a leading "/".  (Why?  Because
-        # the manifest may have relative or absolute paths,
-        # and tar may remove a leading slash to make us secure.)
-        # We also have to look in the directories hash
-        # print >> sys.stderr, "member = %s, prefix = %s" % (member.name, prefix)
-        mFileHash = "-"
-        if member.name in mfiles:
-            mFileHash = mfiles[member.name]
-        elif member.name.startswith("/") == False and ("/" + member.name) in mfiles:
-            mFileHash = mfiles["/" + member.name]
-        elif prefix + member.name in mfiles:
-            mFileHash = mfiles[prefix + member.name]
-        elif (prefix + member.name).startswith("/") == False:
-            if "/" + prefix + member.name in mfiles:
-                mFileHash = mfiles["/" + prefix + member.name]
-        else:
-            # If it's not in the manifest, then ignore it
-            # It may be a directory, however, so let's check
-            if EntryInDictionary(member.name, mdirs, prefix) == False:
-                # If we don't skip it, we infinite loop.  That's bad.
-                member = t.next()
-                continue
+        # The manifest files and directories were put into
+        # mindex above, using the same path normalization.
+        mFileHash = mindex.get(PathIndexKey(member.name, prefix))
+        if mFileHash is None:
+            # If it's not in the manifest, then ignore it.
+            # If we don't skip it, we infinite loop.  That's bad.
+            member = t.next()
+            continue
         if pkgDeltaVersion is not None:
             if verbose or debug:
                 log.debug("Extracting %s from delta package" % member.name)
@@ -1009,6 +1154,7 @@ class Installer(object):
     _manifest = None
     _packages = []
     _trampoline = True
+    _workers = 1
     
     def __init__(self, config=None, manifest=None, root=None):
         self._conf = config
@@ -1040,6 +1186,17 @@ class Installer(object):
     @trampoline.setter
     def trampoline(self, v):
         self._trampoline = v
+
+    @property
+    def workers(self):
+        return self._workers
+    @workers.setter
+    def workers(self, v):
+        # If more than 1, up to workers - 1 of the following
+        # packages are decompressed while a package is installed.
+        # Each is buffered in memory only a little ahead of the
+        # installer, not decompressed to disk.
+        self._workers = max(int(v), 1)
         
     def SetRoot(self, root):
         self._root = root
@@ -1057,10 +1214,13 @@ class Installer(object):
         verbose = b
         return
 
-    def GetPackages(self, pkgList=None, handler=None):
+    def GetPackages(self, pkgList=None, handler=None, checksum_cache=False, paranoid=False):
         # Load the packages in pkgList.  If pkgList is not
         # given, it loads the packages in the manifest.
         # This should change.
+        # checksum_cache and paranoid are passed on to FindPackageFile;
+        # checksum_cache should only be set if the configuration's
+        # package directory is an update cache directory.
         self._packages = []
         if pkgList is None:
             pkgList = self._manifest.Packages()
@@ -1069,7 +1229,9 @@ class Installer(object):
                 get_file_handler = handler(index=i + 1, pkg=pkg, pkgList=pkgList)
             else:
                 get_file_handler = None
-            pkgFile = self._conf.FindPackageFile(pkg, handler=get_file_handler)
+            pkgFile = self._conf.FindPackageFile(pkg, handler=get_file_handler,
+                                                 checksum_cache=checksum_cache,
+                                                 paranoid=paranoid)
             if pkgFile is None:
                 raise InstallerPackageNotFoundException("%s-%s" % (pkg.Name(), pkg.Version()))
             self._packages.append({pkg.Name(): pkgFile})
@@ -1078,14 +1240,56 @@ class Installer(object):
         return True
 
     def InstallPackages(self, progressFunc=None, handler=None):
+        # Packages are always installed one at a time, in order.
+        # If workers is more than 1, the next packages are decompressed
+        # in the background while the current one is being installed.
+        pkgList = []
         for i, pkg in enumerate(self._packages):
             for pkgname in pkg:
-                log.debug("Installing package %s" % pkg)
+                pkgList.append((i, pkgname, pkg[pkgname]))
+
+        decompressed = {}
+        try:
+            for indx, (i, pkgname, pkgfile) in enumerate(pkgList):
+                if self.workers > 1:
+                    for next_indx in range(indx, min(indx + self.workers, len(pkgList))):
+                        if next_indx not in decompressed:
+                            decompressed[next_indx] = DecompressPackage(pkgList[next_indx][2])
+                    stream = decompressed.pop(indx)
+                    if stream:
+                        pkgfile = stream
+                log.debug("Installing package %s" % pkgname)
                 if handler is not None:
                     handler(index=i + 1, name=pkgname, packages=self._packages)
-                if install_file(pkg[pkgname], self._root,
-                                progress=progressFunc,
-                                trampoline=self.trampoline) is False:
+                try:
+                    rv = install_file(pkgfile, self._root,
+                                      progress=progressFunc,
+                                      trampoline=self.trampoline)
+                finally:
+                    if pkgfile is not pkgList[indx][2]:
+                        pkgfile.close()
+                if rv is False:
                     log.error("Unable to install package %s" % pkgname)
                     return False
+        finally:
+            for stream in decompressed.values():
+                if stream:
+                    stream.close()
+        # Removing packages leaves unused space in the database;
+        # compact it once, now that all of the packages are installed.
+        stats = self.VacuumDatabase()
+        if stats["runs"]:
+            log.info("Vacuumed package database, reclaimed %d pages" % stats["pages_reclaimed"])
+        else:
+            log.debug("Package database did not need vacuuming")
         return True
+
+    def VacuumDatabase(self):
+        # Returns the statistics from PackageDB.VacuumStats()
+        from . import Configuration
+        pkgdb = Configuration.PackageDB(self._root)
+        try:
+            pkgdb.Vacuum()
+        except Exception as e:
+            log.debug("Could not vacuum package database: %s" % str(e))
+        return pkgdb.VacuumStats()
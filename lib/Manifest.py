@@ -3,6 +3,8 @@ import os
 import json
 import logging
 import re
+import threading
+import time
 
 from . import Exceptions, Package
 
@@ -59,6 +61,9 @@ VALIDATE_INSTALL_KEY = "InstallCheckProrgam"
 
 SCHEME_V1 = "version1"
 
+# How long, in seconds, a fetched CRL is used for signature verification.
+CRL_CACHE_TTL = 15 * 60
+
 
 def VerificationCertificateFile(manifest):
     from . import UPDATE_CERT_PRODUCTION, UPDATE_CERT_NIGHTLIES, UPDATE_CERT_DIR
@@ -79,6 +84,120 @@ def VerificationCertificateFile(manifest):
 
     return UPDATE_CERT_NIGHTLIES
 
+class SignatureVerifier(object):
+    """
+    What VerifySignature needs, loaded once per process:  the X509Store
+    with the iX root CA and CRL, and the certificates in each
+    certificate file.  The CRL is fetched again after CRL_CACHE_TTL
+    seconds, and a file is loaded again if its mtime changes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._store = None
+        self._root_mtime = None
+        self._crl_time = None
+        self._certs = {}
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def Store(self, config):
+        # Returns the X509Store, or None if the root CA can't be loaded.
+        from . import IX_ROOT_CA_FILE, IX_CRL
+        import tempfile
+        import OpenSSL.crypto as Crypto
+
+        with self._lock:
+            root_mtime = self._mtime(IX_ROOT_CA_FILE)
+            if root_mtime is None:
+                log.debug("VerifySignature:  Cannot find a required file")
+                self._store = None
+                return None
+            if self._store and root_mtime == self._root_mtime and \
+               self._crl_time is not None and \
+               time.time() - self._crl_time < CRL_CACHE_TTL:
+                return self._store
+
+            # First we create a store
+            store = Crypto.X509Store()
+            store.set_flags(Crypto.X509StoreFlags.CRL_CHECK)
+            # Load our root CA
+            try:
+                with open(IX_ROOT_CA_FILE, "r") as f:
+                    root_ca = Crypto.load_certificate(Crypto.FILETYPE_PEM, f.read())
+                    store.add_cert(root_ca)
+            except:
+                log.debug("VerifySignature:  Could not load iX root CA", exc_info=True)
+                self._store = None
+                return None
+
+            # Now need to get the CRL
+            crl_time = None
+            crl_file = tempfile.NamedTemporaryFile(suffix=".pem")
+            if crl_file is None:
+                log.debug("Could not create CRL, ignoring for now")
+            else:
+                try:
+                    if not config.TryGetNetworkFile(
+                            url=IX_CRL,
+                            pathname=crl_file.name,
+                            reason="FetchCRL",
+                            cached=True,
+                    ):
+                        # TGNF will raise an exception in most cases.
+                        raise Exception("Could not get CRL file")
+                except:
+                    log.error("Could not get CRL file %s" % IX_CRL)
+                    crl_file.close()
+                    crl_file = None
+
+            if crl_file:
+                try:
+                    crl = Crypto.load_crl(Crypto.FILETYPE_PEM, crl_file.read())
+                    store.add_crl(crl)
+                    crl_time = time.time()
+                except:
+                    log.debug("Could not load CRL, ignoring for now", exc_info=True)
+                crl_file.close()
+
+            # If we couldn't get the CRL, we'll try again next time.
+            self._store = store
+            self._root_mtime = root_mtime
+            self._crl_time = crl_time
+            return store
+
+    def Certificates(self, cert_file):
+        # Returns the list of certificates in cert_file, or None on error.
+        import OpenSSL.crypto as Crypto
+
+        with self._lock:
+            mtime = self._mtime(cert_file)
+            cached = self._certs.get(cert_file)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            try:
+                with open(cert_file, "r") as f:
+                    regexp = r'-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----'
+                    pems = re.findall(regexp, f.read(), re.DOTALL)
+            except:
+                log.error("Could not load certificates", exc_info=True)
+                return None
+            certs = []
+            for pem in pems:
+                try:
+                    certs.append(Crypto.load_certificate(Crypto.FILETYPE_PEM, pem))
+                except:
+                    # For now, just ignore
+                    pass
+            self._certs[cert_file] = (mtime, certs)
+            return certs
+
+_verifier = SignatureVerifier()
+
+
 class ChecksumFailException(Exception):
     pass
 
@@ -104,29 +223,32 @@ def DiffManifests(m1, m2):
     """
     return_diffs = {}
 
-    def DiffPackages(old_packages, new_packages):
+    def DiffPackages(old_manifest, new_packages):
+        # The old packages are looked up by name in the old manifest's
+        # index.  If the old manifest lists a name more than once, the
+        # last one is compared; each one is only matched once.
         retval = []
-        old_list = {}
-        for P in old_packages:
-            old_list[P.Name()] = P
-
+        old_index = old_manifest._PackageIndex()
+        matched = set()
         for P in new_packages:
-            if P.Name() in old_list:
+            if P.Name() in old_index and P.Name() not in matched:
                 # Either it's the same version, or a new version
-                if old_list[P.Name()].Version() != P.Version():
-                    retval.append((P, "upgrade", old_list[P.Name()]))
-                old_list.pop(P.Name())
+                old = old_index[P.Name()][-1]
+                if old.Version() != P.Version():
+                    retval.append((P, "upgrade", old.Copy()))
+                matched.add(P.Name())
             else:
                 retval.append((P, "install", None))
 
-        for P in old_list.values():
-            retval.insert(0, (P, "delete", None))
+        for name in old_index:
+            if name not in matched:
+                retval.insert(0, (old_index[name][-1].Copy(), "delete", None))
 
         return retval
 
     # First thing, let's compare the packages
     # This will go into the Packages key, if it's non-empty.
-    package_diffs = DiffPackages(m1.Packages(), m2.Packages())
+    package_diffs = DiffPackages(m1, m2.Packages())
     if len(package_diffs) > 0:
         return_diffs["Packages"] = package_diffs
         # Now let's see if we need to do a reboot
@@ -205,6 +327,12 @@ class Manifest(object):
     _switch = None
     _timestamp = None
     _requireSignature = False
+    # Cached serializations of _dict, and the Package objects and
+    # their name index; see _Changed()
+    _canonical = None
+    _string = None
+    _package_list = None
+    _package_index = None
 
     def __init__(self, configuration=None, require_signature=False):
         if configuration is None:
@@ -217,11 +345,39 @@ class Manifest(object):
         return
 
     def dict(self):
+        # The caller may change the dictionary, so the
+        # cached serializations can't be trusted afterwards.
+        self._Changed()
         return self._dict
 
+    def _Changed(self, signature_only=False):
+        # Called whenever _dict is modified.  Changing only the
+        # signature doesn't change the canonical (unsigned) form.
+        if not signature_only:
+            self._canonical = None
+            self._package_list = None
+            self._package_index = None
+        self._string = None
+
+    def Canonical(self):
+        # The string that is signed:  the manifest without its
+        # signature.  This is cached until the manifest is changed.
+        if self._canonical is None:
+            if SIGNATURE_KEY in self._dict:
+                tdata = self._dict.copy()
+                tdata.pop(SIGNATURE_KEY, None)
+            else:
+                tdata = self._dict
+            self._canonical = MakeString(tdata)
+        return self._canonical
+
     def String(self):
-        retval = MakeString(self.dict())
-        return retval
+        if self._string is None:
+            if SIGNATURE_KEY in self._dict:
+                self._string = MakeString(self._dict)
+            else:
+                self._string = self.Canonical()
+        return self._string
 
     def LoadFile(self, file):
         # Load a manifest from a file-like object.
@@ -230,6 +386,7 @@ class Manifest(object):
             self._dict = json.loads(file.read().decode('utf8'))
         else:
             self._dict = json.loads(file.read())
+        self._Changed()
 
         self.Validate()
         return
@@ -307,6 +464,7 @@ class Manifest(object):
         self._dict[NOTICE_KEY] = n
         if n is None:
             self._dict.pop(NOTICE_KEY)
+        self._Changed()
         return
 
     def Scheme(self):
@@ -317,6 +475,7 @@ class Manifest(object):
 
     def SetScheme(self, s):
         self._dict[SCHEME_KEY] = s
+        self._Changed()
         return
 
     def Sequence(self):
@@ -324,6 +483,7 @@ class Manifest(object):
 
     def SetSequence(self, seq):
         self._dict[SEQUENCE_KEY] = seq
+        self._Changed()
         return
 
     def SetNote(self, name, location):
@@ -332,6 +492,7 @@ class Manifest(object):
         if location.startswith(self._config.UpdateServerURL()):
             location = location[len(location):]
         self._dict[NOTES_KEY][name] = location
+        self._Changed()
 
     def Notes(self, raw=False):
         if NOTES_KEY in self._dict:
@@ -353,6 +514,7 @@ class Manifest(object):
                 if loc.startswith(self._config.UpdateServerURL()):
                     loc = loc[len(self._config.UpdateServerURL()):]
                 self._dict[NOTES_KEY][name] = os.path.basename(loc)
+        self._Changed()
         return
 
     def Note(self, name):
@@ -373,19 +535,46 @@ class Manifest(object):
 
     def SetTrain(self, train):
         self._dict[TRAIN_KEY] = train
+        self._Changed()
         return
 
+    def _PackageList(self):
+        # The Package objects for the manifest's packages, built once
+        # and kept until the manifest changes.  Only copies of them
+        # are handed out.
+        if self._package_list is None:
+            self._package_list = [Package.Package(p) for p in self._dict[PACKAGES_KEY]]
+        return self._package_list
+
+    def _PackageIndex(self):
+        # The cached Package objects by name.  Each name has a list,
+        # in manifest order, since a name may be listed more than once.
+        if self._package_index is None:
+            index = {}
+            if PACKAGES_KEY in self._dict:
+                for pkg in self._PackageList():
+                    index.setdefault(pkg.Name(), []).append(pkg)
+            self._package_index = index
+        return self._package_index
+
     def Packages(self):
-        pkgs = []
-        for p in self._dict[PACKAGES_KEY]:
-            pkg = Package.Package(p)
-            pkgs.append(pkg)
-        return pkgs
+        # These are copies; a caller that changes them needs
+        # to give them back with SetPackages().
+        return [pkg.Copy() for pkg in self._PackageList()]
+
+    def Package(self, name):
+        # Return (a copy of) the named package, or None.  If the
+        # name is listed more than once, this is the first one, as a
+        # scan of Packages() would find.
+        pkgs = self._PackageIndex().get(name)
+        return pkgs[0].Copy() if pkgs else None
 
     def AddPackage(self, pkg):
         if PACKAGES_KEY not in self._dict:
             self._dict[PACKAGES_KEY] = []
-        self._dict[PACKAGES_KEY].append(pkg.dict())
+        # Keep our own copy, so changes to pkg don't bypass _Changed()
+        self._dict[PACKAGES_KEY].append(Package.Package(pkg.dict()).dict())
+        self._Changed()
         return
 
     def AddPackages(self, list):
@@ -397,19 +586,17 @@ class Manifest(object):
 
     def SetPackages(self, list):
         self._dict[PACKAGES_KEY] = []
+        self._Changed()
         self.AddPackages(list)
         return
 
     def VerifySignature(self):
-        from . import IX_ROOT_CA_FILE, VERIFIER_HELPER, IX_CRL
         from . import SIGNATURE_FAILURE
 
         if self.Signature() is None:
             return not SIGNATURE_FAILURE
         # Probably need a way to ignore the signature
         else:
-            import subprocess
-            import tempfile
             from base64 import b64decode
             import OpenSSL.crypto as Crypto
             try:
@@ -417,57 +604,17 @@ class Manifest(object):
             except ValueError:
                 cert_file = None
                 
-            if not os.path.isfile(IX_ROOT_CA_FILE) \
-               or cert_file is None \
-               or not os.path.isfile(cert_file):
+            if cert_file is None or not os.path.isfile(cert_file):
                 log.debug("VerifySignature:  Cannot find a required file")
                 return False
 
-            # First we create a store
-            store = Crypto.X509Store()
-            store.set_flags(Crypto.X509StoreFlags.CRL_CHECK)
-            # Load our root CA
-            try:
-                with open(IX_ROOT_CA_FILE, "r") as f:
-                    root_ca = Crypto.load_certificate(Crypto.FILETYPE_PEM, f.read())
-                    store.add_cert(root_ca)
-            except:
-                log.debug("VerifySignature:  Could not load iX root CA", exc_info=True)
+            # The store (root CA and CRL) and the certificates are
+            # only loaded once, and reused for each manifest.
+            if _verifier.Store(self._config) is None:
+                return False
+            certs = _verifier.Certificates(cert_file)
+            if certs is None:
                 return False
-                
-            # Now need to get the CRL
-            crl_file = tempfile.NamedTemporaryFile(suffix=".pem")
-            if crl_file is None:
-                log.debug("Could not create CRL, ignoring for now")
-            else:
-                try:
-                    if not self._config.TryGetNetworkFile(
-                            url=IX_CRL,
-                            pathname=crl_file.name,
-                            reason="FetchCRL"
-                    ):
-                        # TGNF will raise an exception in most cases.
-                        raise Exception("Could not get CRL file")
-                except:
-                    log.error("Could not get CRL file %s" % IX_CRL)
-                    crl_file.close()
-                    crl_file = None
-
-            if crl_file:
-                try:
-                    crl = Crypto.load_crl(Crypto.FILETYPE_PEM, crl_file.read())
-                    store.add_crl(crl)
-                except:
-                    log.debug("Could not load CRL, ignoring for now", exc_info=True)
-                
-            # Now load the certificate files
-            try:
-                with open(cert_file, "r") as f:
-                    regexp = r'-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----'
-                    certs = re.findall(regexp, f.read(), re.DOTALL)
-            except:
-                log.error("Could not load certificates", exc_info=True)
-                return false
                     
             # Almost done:  we need the signature as binary data
             try:
@@ -477,13 +624,10 @@ class Manifest(object):
                 return False
             
             verified = False
-            tdata = self.dict().copy()
-            tdata.pop(SIGNATURE_KEY, None)
-            canonical = MakeString(tdata)
+            canonical = self.Canonical()
             
-            for cert in certs:
+            for test_cert in certs:
                 try:
-                    test_cert = Crypto.load_certificate(Crypto.FILETYPE_PEM, cert)
                     Crypto.verify(test_cert, signature, canonical, "sha256")
                     verified = True
                     break
@@ -500,6 +644,7 @@ class Manifest(object):
 
     def SetSignature(self, signed_hash):
         self._dict[SIGNATURE_KEY] = signed_hash
+        self._Changed(signature_only=True)
         return
 
     def SignWithKey(self, key_data):
@@ -507,6 +652,7 @@ class Manifest(object):
             # We'll cheat, and say this means "get rid of the signature"
             if SIGNATURE_KEY in self._dict:
                 self._dict.pop(SIGNATURE_KEY)
+                self._Changed(signature_only=True)
         else:
             import OpenSSL.crypto as Crypto
             from base64 import b64encode as base64
@@ -519,15 +665,13 @@ class Manifest(object):
                 key = Crypto.load_privatekey(Crypto.FILETYPE_PEM, key_data)
 
             # Generate a canonical representation of the manifest
-            temp = self.dict()
-            temp.pop(SIGNATURE_KEY, None)
-            tstr = MakeString(temp)
+            tstr = self.Canonical()
 
             # Sign it.
             signed_value = base64(Crypto.sign(key, tstr, "sha256"))
 
             # And now set the signature
-            self._dict[SIGNATURE_KEY] = signed_value
+            self.SetSignature(signed_value)
         return
 
     def Version(self):
@@ -538,10 +682,12 @@ class Manifest(object):
 
     def SetVersion(self, version):
         self._dict[VERSION_KEY] = version
+        self._Changed()
         return
 
     def SetTimeStamp(self, ts):
         self._dict[TIMESTAMP_KEY] = ts
+        self._Changed()
 
     def TimeStamp(self):
         if TIMESTAMP_KEY in self._dict:
@@ -558,6 +704,7 @@ class Manifest(object):
         self._dict[REBOOT_KEY] = reboot
         if reboot is None:
             self._dict.pop(REBOOT_KEY)
+        self._Changed()
 
     def Reboot(self):
         if REBOOT_KEY in self._dict:
@@ -603,6 +750,7 @@ class Manifest(object):
             raise ValueError("Unknown validation kind %s" % str(kind))
         vdict = {}
         self._dict[key] = vdict
+        self._Changed()
         if name is None:
             # Similar to methods above, None means to remove the element
             self._dict.pop(key)
@@ -8,15 +8,15 @@ SERVICES_KEY = "RestartServices"
 
 
 class Package(object):
-    _name = None
-    _version = None
-    _checksum = None
-    _size = None
-    _updates = None
-    _dirty = False
-    _services = None
+    # Release tools create a great many of these, so there is no
+    # per-instance __dict__; everything about the package is in _dict.
+    # _updates and _update_index are caches for Updates() and Update().
+    # _shared is set when the Upgrades list may be shared with a copy
+    # (see Copy()).
+    __slots__ = ("_dict", "_updates", "_update_index", "_shared")
 
     class PackageUpdate(object):
+        __slots__ = ("_dict", "_base")
 
         def __init__(self, pkg, dict):
             self._dict = dict
@@ -39,6 +39,7 @@ class Package(object):
             return None
 
         def SetSize(self, size):
+            self._base._OwnUpdates()
             self._dict[SIZE_KEY] = size
 
         def RequiresReboot(self):
@@ -49,9 +50,11 @@ class Package(object):
             return None
 
         def SetRequiresReboot(self, rr):
+            self._base._OwnUpdates()
             self._dict[REBOOT_KEY] = bool(rr)
 
         def SetRestartServices(self, rs):
+            self._base._OwnUpdates()
             self._dict[SERVICES_KEY] = rs
             if not rs:
                 self._dict.pop(SERVICES_KEY)
@@ -83,6 +86,9 @@ class Package(object):
 
     def __init__(self, *args):
         self._dict = {}
+        self._updates = None
+        self._update_index = None
+        self._shared = False
         # We can be called with a dictionary, or with (name, version, checksum)
         if len(args) == 1 and isinstance(args[0], dict):
             tdict = args[0]
@@ -107,8 +113,35 @@ class Package(object):
         return
 
     def dict(self):
+        # The caller may change the Upgrades list.
+        self._OwnUpdates()
+        self._UpdatesChanged()
         return self._dict
 
+    def Copy(self):
+        # A cheap copy:  the Upgrades list (and its dictionaries) is
+        # shared until either package changes it; see _OwnUpdates().
+        pkg = Package()
+        pkg._dict = self._dict.copy()
+        if UPGRADES_KEY in self._dict:
+            self._shared = pkg._shared = True
+        return pkg
+
+    def _OwnUpdates(self):
+        # Called before the Upgrades list, or one of its entries, is
+        # changed.  If it may be shared, this package gets its own copy,
+        # and the PackageUpdate wrappers are moved over to it.
+        if not self._shared:
+            return
+        self._shared = False
+        if UPGRADES_KEY not in self._dict:
+            return
+        updates = [upd.copy() for upd in self._dict[UPGRADES_KEY]]
+        self._dict[UPGRADES_KEY] = updates
+        if self._updates is not None:
+            for (wrapper, upd) in zip(self._updates, updates):
+                wrapper._dict = upd
+
     def Size(self):
         if SIZE_KEY in self._dict:
             return self._dict[SIZE_KEY]
@@ -140,8 +173,17 @@ class Package(object):
         self._dict[CHECKSUM_KEY] = checksum
         return
 
+    def _UpdatesChanged(self):
+        # Called when the Upgrades list changes, so the
+        # PackageUpdate wrappers and the index are rebuilt.
+        self._updates = None
+        self._update_index = None
+
     def SetUpdates(self, updates):
+        # This replaces the list, so it is no longer shared.
         self._dict[UPGRADES_KEY] = []
+        self._shared = False
+        self._UpdatesChanged()
         if updates is None:
             self._dict.pop(UPGRADES_KEY)
         else:
@@ -153,6 +195,7 @@ class Package(object):
         return
 
     def AddUpdate(self, old, checksum, size=None, RequiresReboot=None):
+        self._OwnUpdates()
         if UPGRADES_KEY not in self._dict:
             self._dict[UPGRADES_KEY] = []
         t = {VERSION_KEY: old, CHECKSUM_KEY: checksum}
@@ -162,24 +205,31 @@ class Package(object):
             if self.RequiresReboot() != RequiresReboot:
                 t[REBOOT_KEY] = RequiresReboot
         self._dict[UPGRADES_KEY].append(t)
-
-        return Package.PackageUpdate(self, t)
+        # The wrapper returned is kept in _updates, so _OwnUpdates()
+        # can move it along with the others.
+        self._update_index = None
+        if self._updates is None:
+            self.Updates()
+        else:
+            self._updates.append(Package.PackageUpdate(self, t))
+        return self._updates[-1]
 
     def Updates(self):
-        if UPGRADES_KEY in self._dict:
-            rv = []
-            for upd in self._dict[UPGRADES_KEY]:
-                rv.append(Package.PackageUpdate(self, upd))
-            return rv
-        return []
+        # The PackageUpdate wrappers are built once, and
+        # reused until the updates are changed.
+        if self._updates is None:
+            self._updates = [Package.PackageUpdate(self, upd) for upd in self._dict.get(UPGRADES_KEY, [])]
+        return list(self._updates)
 
     def Update(self, old_version):
-        updates = self.Updates()
-        if updates:
-            for upd in updates:
-                if upd.Version() == old_version:
-                    return upd
-        return None
+        # Look up the update from old_version, using an index
+        # of the updates by version.
+        if self._update_index is None:
+            index = {}
+            for upd in self.Updates():
+                index.setdefault(upd.Version(), upd)
+            self._update_index = index
+        return self._update_index.get(old_version)
 
     def FileName(self, old=None):
         # Very simple function, simply concatenate name, version.
@@ -21,6 +21,16 @@ kPkgRebootKey = "requires-reboot"
 kPkgAddedServicesKey = "ix-added-services"
 kPkgRemovedServicesKey = "ix-removed-services"
 
+# The most worker processes a DeltaEngine uses by default.
+kDeltaWorkers = 4
+
+# The index for a package file is kept next to it, with this
+# appended to the name.  kPkgIndexVersion changes whenever the
+# contents of the index do; an index with a different version
+# is ignored.
+kPkgIndexSuffix = ".index"
+kPkgIndexVersion = 1
+
 
 class PkgFileDiffException(Exception):
     pass
@@ -56,15 +66,22 @@ def FindManifest(tf):
     return (retval, entry)
 
 
-def GetPackageServices(path=None, file=None):
+def GetPackageServices(path=None, file=None, checksum=None):
     """
     Return the services dictionary (if any) for the packge file.
+    If path has an index (see WritePackageIndex), that is used;
+    checksum is as for ReadPackageIndex.
     """
     if path and file:
         raise ValueError("Cannot have both path and file parameters set")
     if not path and not file:
         raise ValueError("Neither path nor file parameters are set")
 
+    if path:
+        index = ReadPackageIndex(path, checksum=checksum)
+        if index:
+            return index["services"]
+
     m = GetManifest(path=path, file=file)
     if file:
         file.seek(0)
@@ -72,15 +89,20 @@ def GetPackageServices(path=None, file=None):
     return m[kPkgServicesKey] if kPkgServicesKey in m else None
 
 
-def GetManifest(path=None, file=None):
+def GetManifest(path=None, file=None, checksum=None):
     """
     Get the +MANIFEST entry from the named file.
+    If path has an index (see WritePackageIndex), the manifest
+    comes from that; checksum is as for ReadPackageIndex.
     """
     if path and file:
         raise ValueError("Cannot have both path and file")
     if not path and not file:
         raise ValueError("Neither path nor file are set")
     if path:
+        index = ReadPackageIndex(path, checksum=checksum)
+        if index:
+            return index["manifest"]
         try:
             file = open(path, "rb")
         except:
@@ -186,102 +208,256 @@ def usage():
     sys.exit(1)
 
 
-def DiffPackageFiles(pkg1, pkg2, output_file=None, scripts=None, force_output=False, verbose=False):
+def TarPath(name):
+    # Manifest paths are absolute, tar member names may not be.
+    return name if name.startswith("/") else "/" + name
+
+
+def TarMembers(tf, first):
+    # Iterate over the members of tf, starting with first (as
+    # returned by FindManifest).  This works on streamed tarfiles.
+    member = first
+    while member is not None:
+        yield member
+        member = tf.next()
+
+
+def IndexPackageFile(pkg, offsets=None):
+    """
+    Read the package file pkg once, and return (manifest, metadata),
+    where metadata maps the path of each entry to its GetTarMeta()
+    dictionary.  If offsets is a dictionary, the offset of each
+    entry's header in the (uncompressed) tar stream is added to it,
+    by path.
+    """
     from .Installer import GetTarMeta
-    
-    pkg1_tarfile = tarfile.open(pkg1, "r")
-    (pkg1_manifest, dc) = FindManifest(pkg1_tarfile)
-
-    pkg2_tarfile = tarfile.open(pkg2, "r")
-    (pkg2_manifest, member) = FindManifest(pkg2_tarfile)
-
-    if PackageName(pkg1_manifest) != PackageName(pkg2_manifest):
-        print("Cannot diff different packages:  %s is not %s" % (
-            PackageName(pkg1_manifest), PackageName(pkg2_manifest)), file=sys.stderr)
-        raise PkgFileDiffException("Cannot diff different packages" % (
-            PackageName(pkg1_manifest), PackageName(pkg2_manifest)))
-
-    if PackageVersion(pkg1_manifest) == PackageVersion(pkg2_manifest):
-        print("Both %s packages are version %s" % (
-            PackageName(pkg1_manifest), PackageVersion(pkg1_manifest)), file=sys.stderr)
-        return None
 
-    # Everything in the p2 goes into new.
-    # Except for the files and directories keys.
-    new_manifest = pkg2_manifest.copy()
+    metadata = {}
+    with tarfile.open(pkg, "r|*") as tf:
+        (manifest, member) = FindManifest(tf)
+        for entry in TarMembers(tf, member):
+            if entry.name.startswith("+"):
+                continue
+            path = TarPath(entry.name)
+            metadata[path] = GetTarMeta(entry)
+            if offsets is not None:
+                offsets[path] = entry.offset
+    return (manifest, metadata)
 
-    for key in [kPkgFlatSizeKey, kPkgFilesKey, kPkgDirsKey, kPkgDeltaKey]:
-        new_manifest.pop(key, None)
 
-    new_manifest[kPkgDeltaKey] = {
-        kPkgVersionKey: PackageVersion(pkg1_manifest),
-        kPkgDeltaStyleKey: "file"
+def PackageIndexFile(pkg):
+    return pkg + kPkgIndexSuffix
+
+
+def WritePackageIndex(pkg, checksum=None, source=None):
+    """
+    Write the index for the package file pkg.  This has the package's
+    manifest, services, and flat size; the metadata for each entry, as
+    IndexPackageFile() returns; and the offset of each entry in the
+    uncompressed tar stream.  It is bound to pkg by its checksum (which
+    is computed if not given) and size, so that readers don't need to
+    open pkg.
+    If source is given, the entries are read from it instead of pkg;
+    it is an already-decompressed copy of pkg (see DeltaEngine).
+    Returns the name of the index file.
+    """
+    import os
+    import tempfile
+
+    if checksum is None:
+        checksum = _ChecksumFile(pkg)
+    offsets = {}
+    (manifest, metadata) = IndexPackageFile(source or pkg, offsets=offsets)
+    index = {
+        "version": kPkgIndexVersion,
+        "checksum": checksum,
+        "size": os.stat(pkg).st_size,
+        "manifest": manifest,
+        "services": PackageServices(manifest),
+        "flatsize": manifest.get(kPkgFlatSizeKey),
+        "metadata": metadata,
+        "offsets": offsets,
     }
-    if scripts:
-        if kPkgScriptsKey not in new_manifest:
-            new_manifest[kPkgScriptsKey] = {}
-        s_dict = new_manifest[kPkgScriptsKey]
-        for script_name in list(scripts.keys()):
-            if script_name not in s_dict:
-                s_dict[script_name] = ""
-            s_dict[script_name] = scripts[script_name] + s_dict[script_name]
-
-    diffs = CompareManifests(pkg1_manifest, pkg2_manifest)
-
-    if len(diffs[kPkgRemovedFilesKey]) != 0:
-        new_manifest[kPkgRemovedFilesKey] = list(diffs[kPkgRemovedFilesKey])
-    if len(diffs[kPkgRemovedDirsKey]) != 0:
-        new_manifest[kPkgRemovedDirsKey] = list(diffs[kPkgRemovedDirsKey])
-    new_manifest[kPkgFilesKey] = diffs[kPkgFilesKey].copy()
-    new_manifest[kPkgDirsKey] = diffs[kPkgDirsKey].copy()
-
-    # Next thing to do is to collect the metadata from each tarfile.
-    # We do this in case the metadata of a file has changed, in which case
-    # we need to include it in the delta package.
-    # This adds some significant time to the processing.
-    old_files = {}
-    file_keys = []
-    if kPkgRemovedFilesKey in new_manifest:
-        file_keys.extend(new_manifest[kPkgRemovedFilesKey])
-    if kPkgRemovedDirsKey in new_manifest:
-        file_keys.extend(new_manifest[kPkgRemovedDirsKey])
-    if kPkgFilesKey in new_manifest:
-        file_keys.extend(new_manifest[kPkgFilesKey].keys())
-    if kPkgDirsKey in new_manifest:
-        file_keys.extend(new_manifest[kPkgDirsKey].keys())
-
-    for entry in pkg1_tarfile.getmembers():
-        if entry.name.startswith("+"):
-            continue
-        if entry.name in file_keys:
-            continue
-        if "/" + entry.name in file_keys:
-            continue
-        old_files[entry.name if entry.name.startswith("/") else "/" + entry.name] = GetTarMeta(entry)
-    new_files = {}
-    for entry in pkg2_tarfile.getmembers():
-        if entry.name.startswith("+"):
-            continue
-        if entry.name in file_keys:
-            continue
-        new_files[entry.name if entry.name.startswith("/") else "/" + entry.name] = GetTarMeta(entry)
-        
-    for entry in old_files.keys():
-        if old_files[entry] != new_files[entry]:
-            # The metadata is different.
-            # What happens if it's a directory in one, and a file in the other?
-            print("#### adding %s simply because metadata changed" % entry, file=sys.stderr)
-            if entry in pkg2_manifest[kPkgDirsKey]:
-                # It's a directory.
-                new_manifest[kPkgDirsKey][entry] = pkg2_manifest[kPkgDirsKey][entry]
-                diffs[kPkgDirsKey][entry] = pkg2_manifest[kPkgDirsKey][entry]
-            elif entry in pkg2_manifest[kPkgFilesKey]:
-                # It's something else, which went into a file
-                new_manifest[kPkgFilesKey][entry] = pkg2_manifest[kPkgFilesKey][entry]
-                diffs[kPkgFilesKey][entry] = pkg2_manifest[kPkgFilesKey][entry]
+    index_file = PackageIndexFile(pkg)
+    # Write it to a temporary file first, so a reader never
+    # sees a partial index.
+    (fd, tmp_file) = tempfile.mkstemp(prefix=".index-", dir=os.path.dirname(os.path.abspath(index_file)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, sort_keys=True, separators=(',', ':'))
+        os.chmod(tmp_file, 0o644)
+        os.rename(tmp_file, index_file)
+    except:
+        os.remove(tmp_file)
+        raise
+    return index_file
+
+
+def ReadPackageIndex(pkg, checksum=None):
+    """
+    Return the index (see WritePackageIndex) for the package file pkg,
+    as a dictionary, or None if there isn't a usable one.  If checksum
+    is given, the index must have been written for a file with that
+    checksum; in any case, the size must match.
+    """
+    import os
+
+    try:
+        with open(PackageIndexFile(pkg), "r") as f:
+            index = json.load(f)
+        if index["version"] != kPkgIndexVersion:
+            return None
+        if checksum is not None and index["checksum"] != checksum:
+            return None
+        if index["size"] != os.stat(pkg).st_size:
+            return None
+        return index
+    except (OSError, IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def DiffPackageFiles(pkg1, pkg2, output_file=None, scripts=None, force_output=False, verbose=False, use_index=False,
+                     pkg1_checksum=None):
+    """
+    Create a delta package, to go from pkg1 to pkg2.  Each package is
+    only read (and decompressed) once:  pkg1 is indexed first, and then
+    pkg2 is streamed, copying the members that go into the delta into
+    an uncompressed spool file.  The delta package is written from that,
+    once its +MANIFEST is known.  pkg2 may also be an uncompressed tar file.
+    If use_index is True, pkg1's index (see WritePackageIndex)
+    is used if there is one, and pkg1 is not read at all.  The index
+    has to match pkg1_checksum, if that's given; callers that know
+    pkg1's checksum should always pass it.
+    Returns the name of the delta package, or None if no delta is needed.
+    """
+    import os
+    import tempfile
+    from .Installer import GetTarMeta
+
+    pkg2_tarfile = tarfile.open(pkg2, "r|*")
+    try:
+        (pkg2_manifest, member) = FindManifest(pkg2_tarfile)
+        pkg1_index = ReadPackageIndex(pkg1, checksum=pkg1_checksum) if use_index else None
+        if pkg1_index is None:
+            (pkg1_manifest, pkg1_metadata) = IndexPackageFile(pkg1)
+        else:
+            (pkg1_manifest, pkg1_metadata) = (pkg1_index["manifest"], pkg1_index["metadata"])
+
+        if PackageName(pkg1_manifest) != PackageName(pkg2_manifest):
+            print("Cannot diff different packages:  %s is not %s" % (
+                PackageName(pkg1_manifest), PackageName(pkg2_manifest)), file=sys.stderr)
+            raise PkgFileDiffException("Cannot diff different packages" % (
+                PackageName(pkg1_manifest), PackageName(pkg2_manifest)))
+
+        if PackageVersion(pkg1_manifest) == PackageVersion(pkg2_manifest):
+            print("Both %s packages are version %s" % (
+                PackageName(pkg1_manifest), PackageVersion(pkg1_manifest)), file=sys.stderr)
+            return None
+
+        # Everything in the p2 goes into new.
+        # Except for the files and directories keys.
+        new_manifest = pkg2_manifest.copy()
+
+        for key in [kPkgFlatSizeKey, kPkgFilesKey, kPkgDirsKey, kPkgDeltaKey]:
+            new_manifest.pop(key, None)
+
+        new_manifest[kPkgDeltaKey] = {
+            kPkgVersionKey: PackageVersion(pkg1_manifest),
+            kPkgDeltaStyleKey: "file"
+        }
+        if scripts:
+            if kPkgScriptsKey not in new_manifest:
+                new_manifest[kPkgScriptsKey] = {}
+            s_dict = new_manifest[kPkgScriptsKey]
+            for script_name in list(scripts.keys()):
+                if script_name not in s_dict:
+                    s_dict[script_name] = ""
+                s_dict[script_name] = scripts[script_name] + s_dict[script_name]
+
+        diffs = CompareManifests(pkg1_manifest, pkg2_manifest)
+
+        if len(diffs[kPkgRemovedFilesKey]) != 0:
+            new_manifest[kPkgRemovedFilesKey] = list(diffs[kPkgRemovedFilesKey])
+        if len(diffs[kPkgRemovedDirsKey]) != 0:
+            new_manifest[kPkgRemovedDirsKey] = list(diffs[kPkgRemovedDirsKey])
+        new_manifest[kPkgFilesKey] = diffs[kPkgFilesKey].copy()
+        new_manifest[kPkgDirsKey] = diffs[kPkgDirsKey].copy()
+
+        if output_file is None:
+            output_file = "{0}-{1}-{2}.tgz".format(
+                PackageName(pkg1_manifest),
+                PackageVersion(pkg1_manifest),
+                PackageVersion(pkg2_manifest)
+            )
+
+        # We also collect the metadata from each tarfile, in case the
+        # metadata of a file has changed, in which case we need to include
+        # it in the delta package.
+        # file_keys is the set of paths already in the delta, or removed;
+        # old_files has the metadata for the rest of pkg1's entries.
+        file_keys = set()
+        for key in (kPkgRemovedFilesKey, kPkgRemovedDirsKey):
+            if key in new_manifest:
+                file_keys.update(new_manifest[key])
+        for key in (kPkgFilesKey, kPkgDirsKey):
+            if key in new_manifest:
+                file_keys.update(new_manifest[key].keys())
+        old_files = {}
+        for path, meta in pkg1_metadata.items():
+            if path in file_keys or path[1:] in file_keys:
+                continue
+            old_files[path] = meta
+
+        search_dict = dict(diffs[kPkgFilesKey], ** diffs[kPkgDirsKey])
+
+        # Now go through pkg2, copying the members for the delta into spool.
+        spool = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_file)))
+        spool_tf = tarfile.open(fileobj=spool, mode="w", format=tarfile.PAX_FORMAT)
+        for member in TarMembers(pkg2_tarfile, member):
+            if member.name.startswith("+"):
+                continue
+            if verbose:
+                print("Looking at member {0}".format(member.name), file=sys.stderr)
+            fname = member.name if member.name in search_dict else TarPath(member.name)
+            if fname not in search_dict:
+                if fname not in old_files or old_files.pop(fname) == GetTarMeta(member):
+                    continue
+                # The metadata is different.
+                # What happens if it's a directory in one, and a file in the other?
+                print("#### adding %s simply because metadata changed" % fname, file=sys.stderr)
+                if fname in pkg2_manifest[kPkgDirsKey]:
+                    # It's a directory.
+                    new_manifest[kPkgDirsKey][fname] = pkg2_manifest[kPkgDirsKey][fname]
+                    diffs[kPkgDirsKey][fname] = pkg2_manifest[kPkgDirsKey][fname]
+                elif fname in pkg2_manifest[kPkgFilesKey]:
+                    # It's something else, which went into a file
+                    new_manifest[kPkgFilesKey][fname] = pkg2_manifest[kPkgFilesKey][fname]
+                    diffs[kPkgFilesKey][fname] = pkg2_manifest[kPkgFilesKey][fname]
+                else:
+                    print("%s is not in pkg2_manifest? %s" % (fname, pkg2_manifest), file=sys.stderr)
+                    sys.exit(1)
+            if verbose:
+                print("\tAdding to new tar file", file=sys.stderr)
+            if member.issym() or member.islnk():
+                # A link
+                spool_tf.addfile(member)
+            elif member.isreg():
+                # A regular file.  Copy
+                data = pkg2_tarfile.extractfile(member)
+                spool_tf.addfile(member, data)
+            elif member.isdir():
+                # A directory.  Just enter it
+                spool_tf.addfile(member)
             else:
-                print("%s is not in pkg2_manifest? %s" % (entry, pkg2_manifest), file=sys.stderr)
-                sys.exit(1)
+                print("Unknown file type for member %s" % member.name, file=sys.stderr)
+                return 1
+        spool_tf.close()
+    finally:
+        pkg2_tarfile.close()
+
+    if old_files:
+        raise PkgFileDiffException("Unchanged entries missing from %s: %s" % (pkg2, list(old_files.keys())))
+
     # If there are no diffs, print a message, and exit without
     # creating a file.
     empty = True
@@ -299,6 +475,7 @@ def DiffPackageFiles(pkg1, pkg2, output_file=None, scripts=None, force_output=Fa
             ),
             file=sys.stderr
         )
+        spool.close()
         return None
 
     new_manifest_string = json.dumps(
@@ -308,13 +485,6 @@ def DiffPackageFiles(pkg1, pkg2, output_file=None, scripts=None, force_output=Fa
         separators=(',', ': ')
     )
 
-    if output_file is None:
-        output_file = "{0}-{1}-{2}.tgz".format(
-            PackageName(pkg1_manifest),
-            PackageVersion(pkg1_manifest),
-            PackageVersion(pkg2_manifest)
-        )
-
     if verbose:
         print("New manifest = {0}".format(new_manifest_string), file=sys.stderr)
         
@@ -327,38 +497,149 @@ def DiffPackageFiles(pkg1, pkg2, output_file=None, scripts=None, force_output=Fa
     new_tf.addfile(mani_file_info, mani_file)
     mani_file.close()
 
-    pkg2_tarfile.close()
-    pkg2_tarfile = tarfile.open(pkg2, "r")
-    (nm, member) = FindManifest(pkg2_tarfile)
-    
-    # Now copy files from pkg2 to new_tf
-    # We want to do this by going through pkg2_tarfile.
-    search_dict = dict(diffs[kPkgFilesKey], ** diffs[kPkgDirsKey])
-    while member is not None:
-        if verbose:
-            print("Member {0}".format(member.name), file=sys.stderr)
-        fname = member.name if member.name in search_dict else "/" + member.name
-        if verbose:
-            print("Looking at member {0}".format(member.name), file=sys.stderr)
-        if fname in search_dict:
-            if verbose:
-                print("\tAdding to new tar file", file=sys.stderr)
-            if member.issym() or member.islnk():
-                # A link
-                new_tf.addfile(member)
-            elif member.isreg():
-                # A regular file.  Copy
-                data = pkg2_tarfile.extractfile(member)
-                new_tf.addfile(member, data)
-            elif member.isdir():
-                # A directory.  Just enter it
-                new_tf.addfile(member)
+    # Now copy the spooled members to new_tf
+    spool.seek(0)
+    with tarfile.open(fileobj=spool, mode="r") as spool_tf:
+        for member in spool_tf:
+            if member.isreg():
+                new_tf.addfile(member, spool_tf.extractfile(member))
             else:
-                print("Unknown file type for member %s" % member.name, file=sys.stderr)
-                return 1
-            search_dict.pop(fname)
-            if len(search_dict) == 0:
-                break
-        member = next(pkg2_tarfile)
+                new_tf.addfile(member)
+    spool.close()
     new_tf.close()
     return output_file
+
+
+def _OpenDecompressed(path):
+    # Open path for reading, decompressing it if it's compressed.
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    if magic.startswith(b"\x1f\x8b"):
+        import gzip
+        return gzip.open(path, "rb")
+    if magic.startswith(b"BZh"):
+        import bz2
+        return bz2.BZ2File(path, "rb")
+    if magic.startswith(b"\xfd7zXZ"):
+        import lzma
+        return lzma.open(path, "rb")
+    return open(path, "rb")
+
+
+def _ChecksumFile(path):
+    # The sha256 checksum of path, as the release tools compute it.
+    import hashlib
+
+    sum = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            sum.update(data)
+    return sum.hexdigest()
+
+
+def _DiffPackageFilesJob(pkg1, pkg2, output_file, kwargs):
+    # Run in a DeltaEngine worker process:  create the delta package,
+    # and checksum it while it's still in the page cache.
+    import os
+
+    output_file = DiffPackageFiles(pkg1, pkg2, output_file, **kwargs)
+    if output_file is None:
+        return (None, None, None)
+    return (output_file, _ChecksumFile(output_file), os.lstat(output_file).st_size)
+
+
+class DeltaEngine(object):
+    """
+    Create a set of jobs delta packages, all going to the same package
+    file pkg2.  pkg2 is decompressed once, into an uncompressed tar
+    file in tempdir (the system's temporary directory by default), and
+    each delta package is created from that by a pool of at most
+    workers (by default, kDeltaWorkers) worker processes.
+    With only one job, a pool isn't worth it, so the delta package is
+    created when it's submitted; and unless the index is wanted as well,
+    it is simply created from pkg2.
+    If write_index is True, pkg2's index (see WritePackageIndex) is
+    written from the decompressed copy, so pkg2 is still only
+    decompressed once; checksum is pkg2's checksum, if known.
+    Use it as a context manager, or call close() when done.
+    """
+    def __init__(self, pkg2, jobs=None, workers=None, tempdir=None, write_index=False, checksum=None):
+        import os
+        import shutil
+        import tempfile
+        import multiprocessing
+
+        self._pkg2 = pkg2
+        self._executor = None
+        self._tarfile = None
+        if jobs is not None and jobs <= 1:
+            self._workers = 0
+            if not write_index:
+                return
+        else:
+            self._workers = min(workers or kDeltaWorkers, multiprocessing.cpu_count())
+            if jobs is not None:
+                self._workers = min(self._workers, jobs)
+        (fd, self._tarfile) = tempfile.mkstemp(prefix="delta-", suffix=".tar", dir=tempdir)
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                src = _OpenDecompressed(pkg2)
+                try:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                finally:
+                    src.close()
+            if write_index:
+                WritePackageIndex(pkg2, checksum=checksum, source=self._tarfile)
+        except:
+            os.remove(self._tarfile)
+            self._tarfile = None
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def Submit(self, pkg1, output_file, **kwargs):
+        """
+        Start creating the delta package output_file, from pkg1; the
+        keyword arguments are as for DiffPackageFiles (including
+        pkg1_checksum, to check pkg1's index with).  Returns a
+        Future, whose result is (output_file, checksum, size), or
+        (None, None, None) if no delta package was needed.
+        """
+        from concurrent.futures import Future, ProcessPoolExecutor
+
+        if self._workers == 0:
+            future = Future()
+            try:
+                future.set_result(_DiffPackageFilesJob(pkg1, self._tarfile or self._pkg2, output_file, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        # The arguments may not be sent to a worker until later,
+        # and the caller may change scripts before then.
+        if kwargs.get("scripts"):
+            kwargs["scripts"] = kwargs["scripts"].copy()
+        return self._executor.submit(_DiffPackageFilesJob, pkg1, self._tarfile, output_file, kwargs)
+
+    def close(self):
+        import os
+
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._tarfile:
+            try:
+                os.remove(self._tarfile)
+            except OSError:
+                pass
+            self._tarfile = None
+
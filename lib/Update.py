@@ -47,6 +47,9 @@ PkgFileAny = None
 PkgFileDeltaOnly = "delta-only"
 PkgFileFullOnly = "full-only"
 
+# How many package files DownloadUpdate fetches at once.
+DOWNLOAD_WORKERS = 4
+
 
 SERVICES = {
     "SMB": {
@@ -830,7 +833,7 @@ def GetUpdateChanges(old_manifest, new_manifest, cache_dir=None):
     return diffs
 
 
-def CheckForUpdates(handler=None, train=None, cache_dir=None, diff_handler=None):
+def CheckForUpdates(handler=None, train=None, cache_dir=None, diff_handler=None, paranoid=False):
     """
     Check for an updated manifest.  If cache_dir is none, then we try
     to download just the latest manifest for the given train, and
@@ -843,7 +846,7 @@ def CheckForUpdates(handler=None, train=None, cache_dir=None, diff_handler=None)
     mfile = None
     if cache_dir:
         try:
-            mfile = VerifyUpdate(cache_dir)
+            mfile = VerifyUpdate(cache_dir, paranoid=paranoid)
             if mfile is None:
                 return None
         except UpdateBusyCacheException:
@@ -902,9 +905,83 @@ def CheckForUpdates(handler=None, train=None, cache_dir=None, diff_handler=None)
     return new_manifest
 
 
+def DownloadPackages(conf, packages, directory, get_handler=None,
+                     check_handler=None, pkg_type=None,
+                     ignore_space=False, workers=DOWNLOAD_WORKERS):
+    """
+    Download the package files for packages into directory, fetching
+    up to workers files at once.  check_handler is called as each
+    package is started; get_handler is called with the progress of
+    the whole set of downloads, rather than of a single file:  filename
+    is directory, size is the total size of the package files being
+    downloaded (as far as it is known yet), and download_rate is the
+    combined rate of the downloads in progress.
+    Returns True if every package file was downloaded (and its checksum
+    verified by FindPackageFile), False if one couldn't be found.
+    Raises any exception FindPackageFile raised.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Handlers are only called with lock held, so they
+    # don't need to be thread-safe.
+    lock = threading.Lock()
+    started = [0]
+    percent = {}
+    sizes = {}
+    rates = {}
+
+    def download(pkg):
+        with lock:
+            started[0] += 1
+            percent[pkg.Name()] = 0
+            if check_handler:
+                check_handler(started[0], pkg=pkg, pkgList=packages)
+
+        def handler(method, filename, size=None, progress=None, download_rate=None):
+            with lock:
+                if size is not None:
+                    sizes[pkg.Name()] = size
+                if download_rate is not None:
+                    rates[pkg.Name()] = download_rate
+                if progress is not None:
+                    percent[pkg.Name()] = progress
+                    progress = int(sum(percent.values()) / len(packages))
+                if get_handler:
+                    get_handler(method, directory,
+                                size=sum(sizes.values()) or None,
+                                progress=progress,
+                                download_rate=sum(rates.values()) or None)
+
+        pkg_file = conf.FindPackageFile(
+            pkg, save_dir=directory, handler=handler, pkg_type=pkg_type,
+            ignore_space=ignore_space
+        )
+        if pkg_file is None:
+            log.error("Could not download package file for %s" % pkg.Name())
+            return False
+        pkg_file.close()
+        with lock:
+            percent[pkg.Name()] = 100
+            rates.pop(pkg.Name(), None)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        futures = [executor.submit(download, pkg) for pkg in packages]
+        try:
+            results = [f.result() for f in futures]
+        except BaseException:
+            # Don't start any more downloads
+            for f in futures:
+                f.cancel()
+            raise
+    return all(results)
+
+
 def DownloadUpdate(train, directory, get_handler=None,
                    check_handler=None, pkg_type=None,
-                   ignore_space=False):
+                   ignore_space=False, download_workers=DOWNLOAD_WORKERS,
+                   paranoid=False):
     """
     Download, if necessary, the LATEST update for train; download
     delta packages if possible.  Checks to see if the existing content
@@ -913,6 +990,10 @@ def DownloadUpdate(train, directory, get_handler=None,
     allow it to determine if a reboot into a different boot environment
     has happened.  This will remove the existing content if it decides
     it has to redownload for any reason.
+    check_handler and get_handler are passed to DownloadPackages():
+    check_handler is called as each package download starts (several
+    may be in progress at once), and get_handler with the progress,
+    size, and rate of all of the package downloads together.
     Returns True if an update is available, False if no update is avialbale.
     Raises exceptions on errors.
     """
@@ -931,7 +1012,7 @@ def DownloadUpdate(train, directory, get_handler=None,
         # to trust what we've already downloaded, if anything.
         log.error("Unable to find latest manifest for train %s" % train)
         try:
-            VerifyUpdate(directory)
+            VerifyUpdate(directory, paranoid=paranoid)
             log.debug("Possibly with no network, cached update looks good")
             return True
         except UpdateIncompleteCacheException:
@@ -945,7 +1026,7 @@ def DownloadUpdate(train, directory, get_handler=None,
     mani_file = None
     try:
         try:
-            mani_file = VerifyUpdate(directory)
+            mani_file = VerifyUpdate(directory, paranoid=paranoid)
             if mani_file:
                 cache_mani.LoadFile(mani_file)
                 if cache_mani.Sequence() == latest_mani.Sequence():
@@ -1053,26 +1134,18 @@ def DownloadUpdate(train, directory, get_handler=None,
         log.debug("Update does%s seem to require a reboot" % "" if reboot_required else " not")
 
         # Next steps:  download the package files.
-        for indx, pkg in enumerate(download_packages):
-            # This is where we find out for real if a reboot is required.
-            # To do that, we may need to know which update was downloaded.
-            if check_handler:
-                check_handler(indx + 1, pkg=pkg, pkgList=download_packages)
-            pkg_file = conf.FindPackageFile(
-                pkg, save_dir=directory, handler=get_handler, pkg_type=pkg_type,
-                ignore_space=ignore_space
-            )
-            if pkg_file is None:
-                log.error("Could not download package file for %s" % pkg.Name())
-                RemoveUpdate(directory)
-                return False
-            else:
-                pkg_file.close()
+        # The MANIFEST file stays locked while this happens.
+        if not DownloadPackages(conf, download_packages, directory,
+                                get_handler=get_handler, check_handler=check_handler,
+                                pkg_type=pkg_type, ignore_space=ignore_space,
+                                workers=download_workers):
+            RemoveUpdate(directory)
+            return False
 
         # Almost done:  get a changelog if one exists for the train
         # If we can't get it, we don't care.
         try:
-            with conf.GetChangeLog(train, save_dir=directory, handler=get_handler):
+            with conf.GetChangeLog(train, save_dir=directory):
                 pass
         except AttributeError:
             # GetChangeLog can return None, which throws things, no pun intended
@@ -1107,7 +1180,7 @@ def PendingUpdates(directory):
         return False
 
 
-def PendingUpdatesChanges(directory):
+def PendingUpdatesChanges(directory, paranoid=False):
     """
     Return a list (a la CheckForUpdates handler right now) of
     changes between the currently installed system and the
@@ -1122,7 +1195,7 @@ def PendingUpdatesChanges(directory):
     mani_file = None
     conf = Configuration.SystemConfiguration()
     try:
-        mani_file = VerifyUpdate(directory)
+        mani_file = VerifyUpdate(directory, paranoid=paranoid)
     except UpdateBusyCacheException:
         log.debug("Cache directory %s is busy, so no update available" % directory)
         raise
@@ -1208,7 +1281,9 @@ def ApplyUpdate(directory,
                 force_reboot=False,
                 ignore_space=False,
                 progressFunc=None,
-                force_trampoline=None
+                force_trampoline=None,
+                install_workers=None,
+                paranoid=False,
                 ):
     """
     Apply the update in <directory>.  As with PendingUpdates(), it will
@@ -1218,7 +1293,7 @@ def ApplyUpdate(directory,
     rv = False
     conf = Configuration.SystemConfiguration()
     # Note that PendingUpdates may raise an exception
-    changes = PendingUpdatesChanges(directory)
+    changes = PendingUpdatesChanges(directory, paranoid=paranoid)
 
     if changes is None:
         # This means no updates to apply, and so nothing to do.
@@ -1284,8 +1359,11 @@ def ApplyUpdate(directory,
     if force_trampoline is not None:
         log.debug("ApplyUpdate: force_trampoline = {} (bool {})".format(force_trampoline, bool(force_trampoline)))
         installer.trampoline = bool(force_trampoline)
+    if install_workers is not None:
+        installer.workers = install_workers
 
-    installer.GetPackages(pkgList=updated_packages)
+    # directory is the update cache, so its checksum cache can be used.
+    installer.GetPackages(pkgList=updated_packages, checksum_cache=True, paranoid=paranoid)
     log.debug("Installer got packages %s" % installer.Packages())
     
     """
@@ -1555,7 +1633,7 @@ def ApplyUpdate(directory,
     return reboot
 
 
-def VerifyUpdate(directory):
+def VerifyUpdate(directory, paranoid=False):
     """
     Verify the update in the directory is valid -- the manifest
     is sane, any signature is valid, the package files necessary to
@@ -1564,6 +1642,9 @@ def VerifyUpdate(directory):
     if it doesn't exist, or it raises an exception -- one of
     UpdateIncompleteCacheException or UpdateInvalidCacheException --
     if necessary.
+    Package checksums are remembered in a Configuration.ChecksumCache
+    in the directory, so unchanged files aren't hashed again, unless
+    paranoid is set.
     """
 
     # First thing we do is get the systen configuration and
@@ -1641,6 +1722,7 @@ def VerifyUpdate(directory):
             raise UpdateIncompleteCacheException("Cache directory %s missing validation program %s" % (directory, validation_program["Kind"]))
 
     # Next thing to do is go through the manifest, and decide which package files we need.
+    checksums = Configuration.ChecksumCache(directory, paranoid=paranoid)
     diffs = Manifest.DiffManifests(mani, cached_mani)
     # This gives us an array to examine.
     # All we care about for verification is the packages
@@ -1670,13 +1752,12 @@ def VerifyUpdate(directory):
             # Okay, at least one of them exists.
             # Let's try the full file first
             try:
-                with open(directory + "/" + pkg.FileName(), 'rb') as f:
-                    if pkg.Checksum():
-                        cksum = Configuration.ChecksumFile(f)
-                        if cksum == pkg.Checksum():
-                            continue
-                    else:
+                if pkg.Checksum():
+                    cksum = checksums.Checksum(pkg.FileName())
+                    if cksum == pkg.Checksum():
                         continue
+                elif os.path.exists(directory + "/" + pkg.FileName()):
+                    continue
             except:
                 pass
 
@@ -1692,10 +1773,9 @@ def VerifyUpdate(directory):
             if update and update.Checksum():
                 upd_cksum = update.Checksum()
                 try:
-                    with open(directory + "/" + pkg.FileName(cur_vers), 'rb') as f:
-                        cksum = Configuration.ChecksumFile(f)
-                        if upd_cksum != cksum:
-                            update = None
+                    cksum = checksums.Checksum(pkg.FileName(cur_vers))
+                    if upd_cksum != cksum:
+                        update = None
                 except:
                     update = None
             if update is None:
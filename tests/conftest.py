@@ -0,0 +1,31 @@
+"""
+Test support.  Importing testlib registers lib/ as the freenasOS
+package; the fixtures make its helpers available to the tests.
+"""
+import os
+
+import pytest
+
+from testlib import LoadTool, MakePackage
+
+
+@pytest.fixture
+def make_package():
+    return MakePackage
+
+
+@pytest.fixture
+def freenas_release():
+    return LoadTool("freenas-release/freenas-release.py", "freenas_release")
+
+
+@pytest.fixture
+def no_file_flags(monkeypatch):
+    # os.lchflags() and os.lchmod() only exist on BSD; elsewhere,
+    # file flags are ignored, and symlinks keep their mode.
+    if not hasattr(os, "lchflags"):
+        monkeypatch.setattr(os, "lchflags", lambda path, flags: None, raising=False)
+    if not hasattr(os, "lchmod"):
+        monkeypatch.setattr(os, "lchmod",
+                            lambda path, mode: None if os.path.islink(path) else os.chmod(path, mode),
+                            raising=False)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+import freenasOS.Configuration as Configuration
+import freenasOS.Exceptions as Exceptions
+import freenasOS.Package as Package
+import freenasOS.Update as Update
+
+
+def MakePackageDir(tmpdir):
+    # A package directory holding one package file; returns the
+    # configuration, which can't reach the network, and the package.
+    data = b"package contents"
+    tmpdir.join("base-os-1.tgz").write_binary(data)
+    conf = Configuration.Configuration(file=str(tmpdir.join("update.conf")))
+    conf.SetPackageDir(str(tmpdir))
+    conf.TryGetNetworkFile = lambda **kwargs: None
+    return (conf, Package.Package("base-os", "1", hashlib.sha256(data).hexdigest()))
+
+
+def test_find_package_file_leaves_package_dir_alone(tmpdir):
+    (conf, pkg) = MakePackageDir(tmpdir)
+    with conf.FindPackageFile(pkg, pkg_type=Update.PkgFileFullOnly) as f:
+        assert f.name == str(tmpdir.join("base-os-1.tgz"))
+    assert not tmpdir.join(Configuration.ChecksumCache.CACHE_NAME).exists()
+
+
+def test_find_package_file_checksum_cache(tmpdir):
+    (conf, pkg) = MakePackageDir(tmpdir)
+    conf.FindPackageFile(pkg, pkg_type=Update.PkgFileFullOnly, checksum_cache=True).close()
+    cache_path = tmpdir.join(Configuration.ChecksumCache.CACHE_NAME)
+    entries = json.loads(cache_path.read())
+    assert entries[pkg.FileName()][-1] == pkg.Checksum()
+
+    # A remembered checksum is trusted, unless paranoid is set.
+    entries[pkg.FileName()][-1] = "0" * 64
+    cache_path.write(json.dumps(entries))
+    with pytest.raises(Exceptions.ChecksumFailException):
+        conf.FindPackageFile(pkg, pkg_type=Update.PkgFileFullOnly, checksum_cache=True)
+    conf.FindPackageFile(pkg, pkg_type=Update.PkgFileFullOnly,
+                         checksum_cache=True, paranoid=True).close()
+    assert json.loads(cache_path.read())[pkg.FileName()][-1] == pkg.Checksum()
+
+
+def MakeTree(monkeypatch, root, nfiles):
+    # Writes nfiles files under root, adds them to the pkgdb in root,
+    # and points do_verify() at that pkgdb (and its verify cache).
+    # The paths in the pkgdb are absolute, so they point into root.
+    rows = []
+    for i in range(nfiles):
+        path = root.join("usr", "local", "f%03d" % i)
+        data = ("file %d" % i).encode("utf8")
+        path.write_binary(data, ensure=True)
+        path.chmod(0o644)
+        rows.append(("test", str(path), "file", hashlib.sha256(data).hexdigest(),
+                     os.getuid(), os.getgid(), 0, 0o644))
+    Configuration.PackageDB(str(root)).AddFilesBulk(rows)
+
+    BasePackageDB = Configuration.PackageDB
+    BaseVerifyCache = Configuration.VerifyCache
+
+    class PackageDB(BasePackageDB):
+        def __init__(self, root_ignored="", **kwargs):
+            BasePackageDB.__init__(self, str(root), **kwargs)
+
+    class VerifyCache(BaseVerifyCache):
+        def __init__(self, root_ignored=""):
+            BaseVerifyCache.__init__(self, str(root))
+
+    monkeypatch.setattr(Configuration, "PackageDB", PackageDB)
+    monkeypatch.setattr(Configuration, "VerifyCache", VerifyCache)
+    return [row[1] for row in rows]
+
+
+def test_verify_stops_workers_on_error(tmpdir, monkeypatch):
+    MakeTree(monkeypatch, tmpdir, 100)
+    verified = []
+    base_verify_entry = Configuration.verify_entry
+
+    def verify_entry(objs, cache=None):
+        verified.append(objs["path"])
+        return base_verify_entry(objs, cache)
+
+    class Stop(Exception):
+        pass
+
+    def verify_handler(i, total, path):
+        if i == 3:
+            raise Stop()
+
+    monkeypatch.setattr(Configuration, "verify_entry", verify_entry)
+    with pytest.raises(Stop):
+        Configuration.do_verify(verify_handler=verify_handler, full=True, workers=2)
+    # Only a bounded number of files were queued, and nothing is
+    # still being verified once do_verify() has returned.
+    count = len(verified)
+    assert count <= 3 + 2 * Configuration.VERIFY_QUEUE_DEPTH
+    assert not any(t.name.startswith("ThreadPoolExecutor") for t in threading.enumerate())
+    assert len(verified) == count
+
+
+def Verify(full=False):
+    stats = {}
+    (error_flag, errors, warn_flag, warnings) = Configuration.do_verify(full=full, stats=stats)
+    return (stats["hashed"], stats["skipped"], [e["path"] for e in errors["checksum"]])
+
+
+def test_verify_cache(tmpdir, monkeypatch):
+    paths = MakeTree(monkeypatch, tmpdir, 10)
+    assert Verify() == (10, 0, [])
+    # Unchanged files aren't hashed again.
+    assert Verify() == (0, 10, [])
+
+    # A new mtime, or a new size (even with the old mtime), means
+    # the file is hashed again.
+    st = os.stat(paths[0])
+    os.utime(paths[0], (st.st_atime, st.st_mtime + 10))
+    st = os.stat(paths[1])
+    with open(paths[1], "ab") as f:
+        f.write(b"changed")
+    os.utime(paths[1], (st.st_atime, st.st_mtime))
+    assert Verify() == (2, 8, [paths[1]])
+    # A file that failed isn't remembered, so it is hashed every time.
+    assert Verify() == (1, 9, [paths[1]])
+
+
+def test_verify_full_ignores_cache(tmpdir, monkeypatch):
+    paths = MakeTree(monkeypatch, tmpdir, 10)
+    assert Verify() == (10, 0, [])
+    assert Verify(full=True) == (10, 0, [])
+
+    # Even if the cache claims a changed file is still good.
+    cache = Configuration.VerifyCache()
+    with open(paths[0], "ab") as f:
+        f.write(b"changed")
+    for (i, path) in enumerate(paths):
+        cache.Add(path, os.lstat(path), hashlib.sha256(("file %d" % i).encode("utf8")).hexdigest())
+    cache.Save()
+    assert Verify() == (0, 10, [])
+    assert Verify(full=True) == (10, 0, [paths[0]])
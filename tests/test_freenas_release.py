@@ -0,0 +1,74 @@
+import os
+
+import freenasOS.Manifest as Manifest
+import freenasOS.Package as Package
+import freenasOS.PackageFile as PackageFile
+
+TRAIN = "TestTrain"
+
+
+class ArchiveDB(object):
+    # Just enough of SQLiteReleaseDB for Check():  one train,
+    # with one sequence.
+    def Trains(self):
+        return [TRAIN]
+
+    def RecentSequencesForTrain(self, train, count=5, oldest_first=False):
+        return ["1"]
+
+    def FindValidatorsForSequence(self, sequence, kind=None):
+        return {}
+
+
+def make_archive(archive, make_package):
+    pkg_dir = os.path.join(archive, "Packages")
+    train_dir = os.path.join(archive, TRAIN)
+    os.makedirs(pkg_dir)
+    os.makedirs(train_dir)
+    pkg_file = os.path.join(pkg_dir, "base-os-1.tgz")
+    checksum = make_package(pkg_file, "base-os", "1", {"/usr/bin/a": b"a", "/usr/bin/b": b"b"})
+    PackageFile.WritePackageIndex(pkg_file, checksum=checksum)
+
+    mani = Manifest.Manifest()
+    mani.SetTrain(TRAIN)
+    mani.SetSequence("1")
+    mani.AddPackage(Package.Package("base-os", "1", checksum))
+    mani.StorePath(os.path.join(train_dir, "FreeNAS-1"))
+    mani.StorePath(os.path.join(train_dir, "LATEST"))
+    return pkg_file
+
+
+def test_check_archive_with_indices(tmpdir, capsys, make_package, freenas_release):
+    archive = str(tmpdir)
+    make_archive(archive, make_package)
+
+    freenas_release.Check(archive, ArchiveDB())
+    err = capsys.readouterr().err
+    assert "Unexpected package file" not in err
+    assert "Package index" not in err
+
+
+def test_check_archive_with_stray_file(tmpdir, capsys, make_package, freenas_release):
+    # A stray file makes Check() go through the packages one by one.
+    archive = str(tmpdir)
+    make_archive(archive, make_package)
+    with open(os.path.join(archive, "Packages", "stray.tgz"), "w") as f:
+        f.write("stray")
+
+    freenas_release.Check(archive, ArchiveDB())
+    err = capsys.readouterr().err
+    assert "Unexpected package file stray.tgz" in err
+    assert "Package index" not in err
+
+
+def test_check_reports_bad_indices(tmpdir, capsys, make_package, freenas_release):
+    archive = str(tmpdir)
+    pkg_file = make_archive(archive, make_package)
+    PackageFile.WritePackageIndex(pkg_file, checksum="0" * 64)
+    with open(os.path.join(archive, "Packages", "gone-1.tgz.index"), "w") as f:
+        f.write("{}")
+
+    freenas_release.Check(archive, ArchiveDB())
+    err = capsys.readouterr().err
+    assert "Package index base-os-1.tgz.index does not match its package file" in err
+    assert "Package index gone-1.tgz.index has no package file" in err
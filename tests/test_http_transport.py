@@ -0,0 +1,150 @@
+"""
+Tests for HTTPTransport and TryGetNetworkFile, against a local
+stand-in for the update server.
+"""
+import hashlib
+import os
+import threading
+
+import pytest
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.error import HTTPError
+
+import freenasOS.Configuration as Configuration
+
+DATA = os.urandom(300 * 1024)
+ETAG = '"v1"'
+
+
+class UpdateServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def reply(self, code, body=b"", headers={}):
+        # Recorded first, since the client may be done as soon as it's sent.
+        self.server.replies.append((self.path, code, self.headers))
+        self.send_response(code)
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/old":
+            return self.reply(302, headers={"Location": "/Packages/base-os.tgz"})
+        if self.path == "/trains.txt":
+            if self.headers.get("If-None-Match") == ETAG:
+                return self.reply(304, headers={"ETag": ETAG})
+            return self.reply(200, b"TestTrain\n", headers={"ETag": ETAG})
+        if self.path != "/Packages/base-os.tgz":
+            return self.reply(404, b"not found")
+        rng = self.headers.get("Range")
+        if rng is None:
+            return self.reply(200, DATA)
+        start = int(rng[len("bytes="):].rstrip("-"))
+        if start >= len(DATA):
+            return self.reply(416)
+        return self.reply(206, DATA[start:])
+
+
+class UpdateServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), UpdateServerHandler)
+        self.replies = []
+
+    def URL(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+
+@pytest.fixture
+def server():
+    srv = UpdateServer()
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.daemon = True
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def conf(tmpdir):
+    conf = Configuration.Configuration(root=str(tmpdir), file=str(tmpdir.join("update.conf")))
+    conf.SetTemporaryDirectory(str(tmpdir))
+    yield conf
+    conf.Transport().close()
+
+
+def test_keep_alive(server, conf):
+    for i in range(5):
+        f = conf.TryGetNetworkFile(url=server.URL("/Packages/base-os.tgz"))
+        assert f.read() == DATA
+    assert server.connections == 1
+    assert conf.Transport().connects == 1
+    assert conf.Transport().requests == 5
+
+
+def test_redirect(server, conf):
+    (f, checksum) = conf.TryGetNetworkFile(url=server.URL("/old"), digest=True)
+    assert f.read() == DATA
+    assert checksum == hashlib.sha256(DATA).hexdigest()
+    assert [(path, code) for (path, code, headers) in server.replies] == [
+        ("/old", 302), ("/Packages/base-os.tgz", 200)]
+    # The redirect is followed on the same connection.
+    assert server.connections == 1
+
+
+def test_not_found(server, conf):
+    with pytest.raises(HTTPError) as e:
+        conf.TryGetNetworkFile(url=server.URL("/Packages/missing.tgz"))
+    assert e.value.code == 404
+
+
+def test_range_resume(server, conf, tmpdir):
+    path = str(tmpdir.join("base-os.tgz"))
+    with open(path, "wb") as f:
+        f.write(DATA[:1000])
+    (f, checksum) = conf.TryGetNetworkFile(url=server.URL("/Packages/base-os.tgz"), pathname=path,
+                                           intr_ok=True, ignore_space=True, digest=True)
+    f.close()
+    assert server.replies[-1][1] == 206
+    assert server.replies[-1][2]["Range"] == "bytes=1000-"
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    # The part we already had counts towards the checksum.
+    assert checksum == hashlib.sha256(DATA).hexdigest()
+
+    # Resuming a complete file gets a 416, and the file as it is.
+    (f, checksum) = conf.TryGetNetworkFile(url=server.URL("/Packages/base-os.tgz"), pathname=path,
+                                           intr_ok=True, ignore_space=True, digest=True)
+    f.close()
+    assert server.replies[-1][1] == 416
+    assert checksum == hashlib.sha256(DATA).hexdigest()
+    assert os.path.getsize(path) == len(DATA)
+
+
+def test_etag_not_modified(server, conf):
+    conf.SetCacheMaxAge(0)
+    assert conf.TryGetNetworkFile(url=server.URL("/trains.txt"), cached=True).read() == b"TestTrain\n"
+    assert conf.TryGetNetworkFile(url=server.URL("/trains.txt"), cached=True).read() == b"TestTrain\n"
+    assert [code for (path, code, headers) in server.replies] == [200, 304]
+    assert server.replies[-1][2]["If-None-Match"] == ETAG
+
+
+def test_cache_max_age(server, conf):
+    conf.SetCacheMaxAge(60)
+    for i in range(3):
+        assert conf.TryGetNetworkFile(url=server.URL("/trains.txt"), cached=True).read() == b"TestTrain\n"
+    # Fresh cached copies don't go to the server at all.
+    assert len(server.replies) == 1
@@ -0,0 +1,209 @@
+import errno
+import gzip
+import hashlib
+import io
+import os
+import stat
+import tarfile
+
+import pytest
+
+import freenasOS.Configuration as Configuration
+import freenasOS.Installer as Installer
+import freenasOS.PackageFile as PackageFile
+
+FILES = {"/usr/bin/a": b"a" * 3000000, "/usr/bin/b": os.urandom(200000)}
+
+
+def test_decompress_package(tmpdir, make_package):
+    path = os.path.join(str(tmpdir), "base-os-1.tgz")
+    make_package(path, "base-os", "1", FILES)
+    with open(path, "rb") as pkgfile:
+        stream = Installer.DecompressPackage(pkgfile)
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as tf:
+                contents = {}
+                for member in tf:
+                    if member.isfile():
+                        contents[member.name] = tf.extractfile(member).read()
+        finally:
+            stream.close()
+    assert contents["usr/bin/a"] == FILES["/usr/bin/a"]
+    assert contents["usr/bin/b"] == FILES["/usr/bin/b"]
+    with open(path, "rb") as pkgfile:
+        with gzip.GzipFile(fileobj=pkgfile) as gz:
+            data = gz.read()
+        with Installer.DecompressPackage(pkgfile) as stream:
+            assert stream.read() == data
+
+
+def test_decompress_package_not_gzipped(tmpdir):
+    path = os.path.join(str(tmpdir), "base-os-1.tar")
+    with tarfile.open(path, "w"):
+        pass
+    with open(path, "rb") as pkgfile:
+        assert Installer.DecompressPackage(pkgfile) is None
+        assert pkgfile.tell() == 0
+
+
+def test_decompress_package_close_early(tmpdir, make_package, monkeypatch):
+    # Closing before reading everything stops the thread, even while
+    # it is waiting for room in the queue.
+    monkeypatch.setattr(Installer, "kDecompressChunk", 1024)
+    monkeypatch.setattr(Installer, "kDecompressAhead", 2)
+    path = os.path.join(str(tmpdir), "base-os-1.tgz")
+    make_package(path, "base-os", "1", FILES)
+    with open(path, "rb") as pkgfile:
+        stream = Installer.DecompressPackage(pkgfile)
+        assert len(stream.read(100)) == 100
+        stream.close()
+        assert not stream._thread.is_alive()
+
+
+def test_decompress_package_corrupt(tmpdir, make_package):
+    path = os.path.join(str(tmpdir), "base-os-1.tgz")
+    make_package(path, "base-os", "1", FILES)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    with open(path, "rb") as pkgfile:
+        with Installer.DecompressPackage(pkgfile) as stream:
+            with pytest.raises(EOFError):
+                stream.read()
+
+
+def InstallPackage(path, root):
+    with open(path, "rb") as pkgfile:
+        return Installer.install_file(pkgfile, root)
+
+
+def test_install_delta_that_only_removes(tmpdir, make_package, no_file_flags):
+    # The delta package has no files, only +MANIFEST.
+    root = str(tmpdir.join("root"))
+    pkg1 = str(tmpdir.join("base-os-1.tgz"))
+    pkg2 = str(tmpdir.join("base-os-2.tgz"))
+    delta = str(tmpdir.join("base-os-1-2.tgz"))
+    make_package(pkg1, "base-os", "1", {"/usr/bin/a": b"a", "/usr/bin/b": b"b"}, prefix="/")
+    make_package(pkg2, "base-os", "2", {"/usr/bin/a": b"a"}, prefix="/")
+    PackageFile.DiffPackageFiles(pkg1, pkg2, delta)
+
+    assert InstallPackage(pkg1, root) is True
+    assert InstallPackage(delta, root) is True
+    assert os.path.exists(root + "/usr/bin/a")
+    assert not os.path.exists(root + "/usr/bin/b")
+    pkgdb = Configuration.PackageDB(root)
+    assert pkgdb.FindPackage("base-os") == {"base-os": "2"}
+    assert [f["path"] for f in pkgdb.FindFilesForPackage("base-os") if f["kind"] == "file"] == ["/usr/bin/a"]
+
+
+def OpenTar(name, data, pax_headers=None):
+    # A tarfile holding one file, opened for reading, and its entry.
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.PAX_FORMAT) as tf:
+        ti = tarfile.TarInfo(name)
+        ti.size = len(data)
+        ti.mode = 0o444
+        ti.uid = os.getuid()
+        ti.gid = os.getgid()
+        if pax_headers:
+            ti.pax_headers = pax_headers
+        tf.addfile(ti, io.BytesIO(data))
+    buf.seek(0)
+    tf = tarfile.open(fileobj=buf, mode="r")
+    return (tf, tf.getmember(name))
+
+
+def TempFiles(path):
+    return [f for f in os.listdir(path) if f.startswith(".pkgtmp.")]
+
+
+def test_extract_replaces_file(tmpdir, no_file_flags):
+    root = str(tmpdir)
+    tmpdir.join("usr", "bin", "a").write_binary(b"old", ensure=True)
+    old_inode = os.lstat(root + "/usr/bin/a").st_ino
+    (tf, entry) = OpenTar("usr/bin/a", b"new")
+    rv = Installer.ExtractEntry(tf, entry, root, "/", hashlib.sha256(b"new").hexdigest())
+    assert rv[0] == "/usr/bin/a"
+    assert rv[2] == hashlib.sha256(b"new").hexdigest()
+    assert tmpdir.join("usr", "bin", "a").read_binary() == b"new"
+    # It was written to a new file, which was renamed into place.
+    assert os.lstat(root + "/usr/bin/a").st_ino != old_inode
+    assert os.stat(root + "/usr/bin/a").st_mode & 0o777 == 0o444
+    assert TempFiles(root + "/usr/bin") == []
+
+
+def test_extract_replaces_symlink(tmpdir, no_file_flags):
+    # The symlink itself is replaced; what it pointed to is left alone.
+    root = str(tmpdir.join("root"))
+    target = tmpdir.join("target")
+    target.write_binary(b"target")
+    tmpdir.join("root", "usr", "bin").ensure(dir=True)
+    os.symlink(str(target), root + "/usr/bin/a")
+    (tf, entry) = OpenTar("usr/bin/a", b"new")
+    Installer.ExtractEntry(tf, entry, root, "/", hashlib.sha256(b"new").hexdigest())
+    assert not os.path.islink(root + "/usr/bin/a")
+    assert tmpdir.join("root", "usr", "bin", "a").read_binary() == b"new"
+    assert target.read_binary() == b"target"
+    assert TempFiles(root + "/usr/bin") == []
+
+
+def test_extract_flags(tmpdir, monkeypatch, no_file_flags):
+    # The old file's flags (e.g., schg) are cleared before it is
+    # replaced, and the new file gets the flags from the package.
+    root = str(tmpdir)
+    tmpdir.join("sbin", "init").write_binary(b"old", ensure=True)
+    calls = []
+    base_rename = os.rename
+
+    def rename(src, dst):
+        calls.append(("rename", dst))
+        return base_rename(src, dst)
+
+    monkeypatch.setattr(os, "lchflags", lambda path, flags: calls.append(("lchflags", path, flags)),
+                        raising=False)
+    monkeypatch.setattr(os, "rename", rename)
+    (tf, entry) = OpenTar("sbin/init", b"new", {"SCHILY.fflags": "schg"})
+    Installer.ExtractEntry(tf, entry, root, "/", hashlib.sha256(b"new").hexdigest())
+    full_path = root + "/sbin/init"
+    assert calls == [("lchflags", full_path, 0),
+                     ("rename", full_path),
+                     ("lchflags", full_path, stat.SF_IMMUTABLE)]
+
+
+def test_extract_write_fails(tmpdir, monkeypatch, no_file_flags):
+    # If the new file can't be written, the temporary file is removed,
+    # and the old file is left alone.
+    root = str(tmpdir)
+    tmpdir.join("usr", "bin", "a").write_binary(b"old", ensure=True)
+    (tf, entry) = OpenTar("usr/bin/a", b"new")
+    base_extractfile = tf.extractfile
+
+    class Failing(object):
+        def __init__(self, f):
+            self._f = f
+
+        def read(self, size=-1):
+            self._f.read(1)
+            raise IOError("No space left on device")
+
+    monkeypatch.setattr(tf, "extractfile", lambda member: Failing(base_extractfile(member)))
+    with pytest.raises(IOError):
+        Installer.ExtractEntry(tf, entry, root, "/", hashlib.sha256(b"new").hexdigest())
+    assert tmpdir.join("usr", "bin", "a").read_binary() == b"old"
+    assert TempFiles(root + "/usr/bin") == []
+
+
+def test_extract_rename_fails(tmpdir, monkeypatch, no_file_flags):
+    root = str(tmpdir)
+    tmpdir.join("usr", "bin", "a").write_binary(b"old", ensure=True)
+    (tf, entry) = OpenTar("usr/bin/a", b"new")
+
+    def rename(src, dst):
+        raise OSError(errno.EPERM, "Operation not permitted")
+
+    monkeypatch.setattr(os, "rename", rename)
+    with pytest.raises(OSError):
+        Installer.ExtractEntry(tf, entry, root, "/", hashlib.sha256(b"new").hexdigest())
+    assert tmpdir.join("usr", "bin", "a").read_binary() == b"old"
+    assert TempFiles(root + "/usr/bin") == []
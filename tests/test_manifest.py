@@ -0,0 +1,87 @@
+import freenasOS.Manifest as Manifest
+import freenasOS.Package as Package
+
+
+def make_manifest(packages):
+    mani = Manifest.Manifest()
+    mani.SetTrain("TestTrain")
+    mani.SetSequence("1")
+    mani.SetPackages([Package.Package(*p) for p in packages])
+    return mani
+
+
+def test_packages_are_copies():
+    mani = make_manifest([("base-os", "1", "aaaa"), ("freenas", "1", "bbbb")])
+    string = mani.String()
+    pkg = mani.Packages()[0]
+    pkg.SetChecksum("cccc")
+    pkg.AddUpdate("0", "dddd")
+    mani.Package("freenas").SetVersion("2")
+
+    assert mani.Packages()[0].Checksum() == "aaaa"
+    assert mani.Packages()[0].Updates() == []
+    assert mani.Package("base-os").Checksum() == "aaaa"
+    assert mani.Package("freenas").Version() == "1"
+    assert mani.String() == string
+
+    # Giving them back is how a caller changes the manifest.
+    mani.SetPackages([pkg])
+    assert mani.Package("base-os").Checksum() == "cccc"
+    assert mani.Package("freenas") is None
+
+
+def test_package_lookup_with_duplicate_names():
+    mani = make_manifest([("base-os", "1", "aaaa"), ("base-os", "2", "bbbb")])
+    assert mani.Package("base-os").Version() == "1"
+    assert mani.Package("nothere") is None
+
+
+def test_diff_manifests():
+    old = make_manifest([("base-os", "1", "a"), ("freenas", "1", "b"), ("gone", "1", "c")])
+    new = make_manifest([("base-os", "2", "d"), ("freenas", "1", "b"), ("added", "1", "e")])
+    diffs = Manifest.DiffManifests(old, new)["Packages"]
+    assert [(p.Name(), op, o.Version() if o else None) for (p, op, o) in diffs] == [
+        ("gone", "delete", None),
+        ("base-os", "upgrade", "1"),
+        ("added", "install", None),
+    ]
+
+
+def test_diff_manifests_with_duplicate_names():
+    # A name the new manifest repeats is an upgrade and then an install;
+    # the old manifest's last entry for a name is the one compared.
+    old = make_manifest([("base-os", "0", "a"), ("base-os", "1", "b")])
+    new = make_manifest([("base-os", "1", "b"), ("base-os", "2", "c")])
+    diffs = Manifest.DiffManifests(old, new)["Packages"]
+    assert [(p.Version(), op) for (p, op, o) in diffs] == [("2", "install")]
+
+
+def test_packages_are_cached_until_changed():
+    mani = make_manifest([("base-os", "1", "aaaa")])
+    cached = mani._PackageList()
+    mani.Packages()
+    mani.Package("base-os")
+    assert mani._PackageList() is cached
+    mani.SetSequence("2")
+    assert mani._PackageList() is not cached
+
+
+def test_package_copies_share_updates_until_changed():
+    pkg = Package.Package("base-os", "2", "aaaa")
+    pkg.AddUpdate("1", "bbbb", size=10)
+    mani = make_manifest([])
+    mani.SetPackages([pkg])
+
+    copy = mani.Packages()[0]
+    upd = copy.Update("1")
+    upd.SetSize(20)
+    copy.AddUpdate("0", "cccc")
+    assert upd.Size() == 20
+    assert [u.Version() for u in copy.Updates()] == ["1", "0"]
+
+    other = mani.Package("base-os")
+    assert other.Update("1").Size() == 10
+    assert [u.Version() for u in other.Updates()] == ["1"]
+    assert mani.dict()[Manifest.PACKAGES_KEY][0]["Upgrades"] == [
+        {"Version": "1", "Checksum": "bbbb", "FileSize": 10}
+    ]
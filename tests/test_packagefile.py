@@ -0,0 +1,141 @@
+import gzip
+import json
+import os
+import tarfile
+
+import freenasOS.PackageFile as PackageFile
+
+OLD_FILES = {"/usr/bin/a": b"a", "/usr/bin/b": b"b", "/usr/bin/c": b"c"}
+NEW_FILES = {"/usr/bin/a": b"a", "/usr/bin/b": b"b2", "/usr/bin/d": b"d"}
+
+
+def delta_contents(path):
+    with tarfile.open(path) as tf:
+        manifest = json.loads(tf.extractfile("+MANIFEST").read().decode("utf8"))
+        return (sorted(tf.getnames()), manifest)
+
+
+def make_pair(tmpdir, make_package):
+    pkg1 = os.path.join(str(tmpdir), "base-os-1.tgz")
+    pkg2 = os.path.join(str(tmpdir), "base-os-2.tgz")
+    checksum = make_package(pkg1, "base-os", "1", OLD_FILES)
+    make_package(pkg2, "base-os", "2", NEW_FILES)
+    return (pkg1, pkg2, checksum)
+
+
+def test_diff_package_files(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    delta = PackageFile.DiffPackageFiles(pkg1, pkg2, os.path.join(str(tmpdir), "delta.tgz"))
+    (names, manifest) = delta_contents(delta)
+    assert names == ["+MANIFEST", "usr/bin/b", "usr/bin/d"]
+    assert manifest["removed-files"] == ["/usr/bin/c"]
+    assert manifest["delta-version"]["version"] == "1"
+
+
+def test_diff_uses_matching_index(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    PackageFile.WritePackageIndex(pkg1, checksum=checksum)
+    # Change the metadata in the index, so we can tell it was used.
+    with open(PackageFile.PackageIndexFile(pkg1)) as f:
+        index = json.load(f)
+    index["metadata"]["/usr/bin/a"]["mode"] = 0o600
+    with open(PackageFile.PackageIndexFile(pkg1), "w") as f:
+        json.dump(index, f)
+
+    delta = PackageFile.DiffPackageFiles(pkg1, pkg2, os.path.join(str(tmpdir), "delta.tgz"),
+                                         use_index=True, pkg1_checksum=checksum)
+    (names, manifest) = delta_contents(delta)
+    assert "usr/bin/a" in names
+
+
+def test_diff_ignores_stale_index(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    PackageFile.WritePackageIndex(pkg1, checksum="0" * 64)
+    with open(PackageFile.PackageIndexFile(pkg1)) as f:
+        index = json.load(f)
+    index["manifest"]["files"] = {}
+    with open(PackageFile.PackageIndexFile(pkg1), "w") as f:
+        json.dump(index, f)
+
+    expected = delta_contents(PackageFile.DiffPackageFiles(pkg1, pkg2, os.path.join(str(tmpdir), "d1.tgz")))
+    delta = PackageFile.DiffPackageFiles(pkg1, pkg2, os.path.join(str(tmpdir), "d2.tgz"),
+                                         use_index=True, pkg1_checksum=checksum)
+    assert delta_contents(delta) == expected
+
+
+def test_package_index(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    PackageFile.WritePackageIndex(pkg1, checksum=checksum)
+    index = PackageFile.ReadPackageIndex(pkg1, checksum=checksum)
+    assert index["manifest"] == PackageFile.GetManifest(file=open(pkg1, "rb"))
+    assert sorted(index["metadata"]) == ["/usr/bin", "/usr/bin/a", "/usr/bin/b", "/usr/bin/c"]
+    assert PackageFile.ReadPackageIndex(pkg1, checksum="0" * 64) is None
+    # The offsets are of the member headers in the uncompressed stream.
+    with gzip.open(pkg1) as f:
+        f.seek(index["offsets"]["/usr/bin/b"])
+        ti = tarfile.TarInfo.frombuf(f.read(tarfile.BLOCKSIZE), "utf-8", "surrogateescape")
+    assert ti.name == "usr/bin/b"
+
+
+def test_delta_engine(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    pkg0 = os.path.join(str(tmpdir), "base-os-0.tgz")
+    make_package(pkg0, "base-os", "0", {"/usr/bin/a": b"a0"})
+    staging = tmpdir.mkdir("staging")
+    before = sorted(os.listdir(str(tmpdir)))
+
+    with PackageFile.DeltaEngine(pkg2, jobs=2, tempdir=str(staging)) as engine:
+        # The new package is staged outside of its directory.
+        assert len(os.listdir(str(staging))) == 1
+        futures = [engine.Submit(pkg, os.path.join(str(tmpdir), "delta-%d.tgz" % i), scripts={"post-install": "true"})
+                   for (i, pkg) in enumerate((pkg1, pkg0))]
+        results = [f.result() for f in futures]
+    assert os.listdir(str(staging)) == []
+
+    for (i, pkg) in enumerate((pkg1, pkg0)):
+        (delta, checksum, size) = results[i]
+        assert delta == os.path.join(str(tmpdir), "delta-%d.tgz" % i)
+        assert size == os.lstat(delta).st_size
+        assert checksum == PackageFile._ChecksumFile(delta)
+        expected = PackageFile.DiffPackageFiles(pkg, pkg2, os.path.join(str(tmpdir), "serial.tgz"),
+                                                scripts={"post-install": "true"})
+        assert delta_contents(delta) == delta_contents(expected)
+    assert sorted(os.listdir(str(tmpdir))) == sorted(before + ["delta-0.tgz", "delta-1.tgz", "serial.tgz"])
+
+
+def test_delta_engine_single_job(tmpdir, make_package):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    staging = tmpdir.mkdir("staging")
+    with PackageFile.DeltaEngine(pkg2, jobs=1, tempdir=str(staging)) as engine:
+        assert os.listdir(str(staging)) == []
+        (delta, checksum, size) = engine.Submit(pkg1, os.path.join(str(tmpdir), "delta.tgz")).result()
+    assert delta_contents(delta)[0] == ["+MANIFEST", "usr/bin/b", "usr/bin/d"]
+    assert checksum == PackageFile._ChecksumFile(delta)
+
+
+def test_delta_engine_writes_index(tmpdir, make_package, monkeypatch):
+    (pkg1, pkg2, checksum) = make_pair(tmpdir, make_package)
+    PackageFile.WritePackageIndex(pkg2)
+    with open(PackageFile.PackageIndexFile(pkg2)) as f:
+        expected = json.load(f)
+    os.remove(PackageFile.PackageIndexFile(pkg2))
+
+    # pkg2 is decompressed once, and indexed from that copy.
+    decompressed = []
+    indexed = []
+    open_decompressed = PackageFile._OpenDecompressed
+    index_package_file = PackageFile.IndexPackageFile
+    monkeypatch.setattr(PackageFile, "_OpenDecompressed",
+                        lambda path: decompressed.append(path) or open_decompressed(path))
+    monkeypatch.setattr(PackageFile, "IndexPackageFile",
+                        lambda pkg, **kwargs: indexed.append(pkg) or index_package_file(pkg, **kwargs))
+    for jobs in (1, 2):
+        del decompressed[:], indexed[:]
+        with PackageFile.DeltaEngine(pkg2, jobs=jobs, write_index=True) as engine:
+            (delta, delta_checksum, size) = engine.Submit(pkg1, os.path.join(str(tmpdir), "delta.tgz")).result()
+        assert decompressed == [pkg2]
+        # (pkg1 is indexed too, when the delta is made in this process.)
+        assert indexed[0].endswith(".tar") and pkg2 not in indexed
+        with open(PackageFile.PackageIndexFile(pkg2)) as f:
+            assert json.load(f) == expected
+        assert delta_contents(delta)[0] == ["+MANIFEST", "usr/bin/b", "usr/bin/d"]
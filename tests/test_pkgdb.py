@@ -0,0 +1,268 @@
+import os
+import sqlite3
+
+import pytest
+
+import freenasOS.Configuration as Configuration
+import freenasOS.Installer as Installer
+
+FILES = {"/usr/bin/a": b"a", "/usr/bin/b": b"b", "/usr/bin/c": b"c"}
+
+
+def Rows(root):
+    # The packages and files in the pkgdb in root, read with a new
+    # connection, so only committed changes are seen.
+    pkgdb = Configuration.PackageDB(root)
+    return (pkgdb.FindPackage("base-os"),
+            sorted(f["path"] for f in pkgdb.FindFilesForPackage()))
+
+
+def InstallPackage(path, root):
+    with open(path, "rb") as pkgfile:
+        return Installer.install_file(pkgfile, root)
+
+
+def FailAfter(monkeypatch, count):
+    # Make ExtractEntry() fail after extracting count entries.
+    base_extract = Installer.ExtractEntry
+    extracted = []
+
+    def ExtractEntry(*args, **kwargs):
+        if len(extracted) == count:
+            raise IOError("No space left on device")
+        extracted.append(args[1].name)
+        return base_extract(*args, **kwargs)
+
+    monkeypatch.setattr(Installer, "ExtractEntry", ExtractEntry)
+
+
+def test_failed_install_leaves_no_rows(tmpdir, make_package, monkeypatch, no_file_flags):
+    root = str(tmpdir.join("root"))
+    pkg = str(tmpdir.join("base-os-1.tgz"))
+    make_package(pkg, "base-os", "1", FILES, prefix="/")
+    FailAfter(monkeypatch, 2)
+    with pytest.raises(IOError):
+        InstallPackage(pkg, root)
+    assert Rows(root) == (None, [])
+
+
+def test_failed_upgrade_keeps_old_rows(tmpdir, make_package, monkeypatch, no_file_flags):
+    # A full package upgrade removes the old package's rows first;
+    # if the install then fails, they are all still there.
+    root = str(tmpdir.join("root"))
+    pkg1 = str(tmpdir.join("base-os-1.tgz"))
+    pkg2 = str(tmpdir.join("base-os-2.tgz"))
+    make_package(pkg1, "base-os", "1", FILES, prefix="/")
+    make_package(pkg2, "base-os", "2", {"/usr/bin/d": b"d"}, prefix="/")
+    assert InstallPackage(pkg1, root) is True
+    installed = Rows(root)
+    assert installed[0] == {"base-os": "1"}
+    FailAfter(monkeypatch, 1)
+    with pytest.raises(IOError):
+        InstallPackage(pkg2, root)
+    assert Rows(root) == installed
+
+
+def test_failed_install_returning_false_leaves_no_rows(tmpdir, make_package, monkeypatch,
+                                                       no_file_flags):
+    root = str(tmpdir.join("root"))
+    pkg = str(tmpdir.join("base-os-1.tgz"))
+    make_package(pkg, "base-os", "1", FILES, prefix="/")
+    base_install = Installer._install_file
+
+    def _install_file(*args, **kwargs):
+        base_install(*args, **kwargs)
+        return False
+
+    monkeypatch.setattr(Installer, "_install_file", _install_file)
+    assert InstallPackage(pkg, root) is False
+    assert Rows(root) == (None, [])
+
+
+def test_nested_sessions(tmpdir):
+    root = str(tmpdir)
+    pkgdb = Configuration.PackageDB(root)
+    with pkgdb:
+        pkgdb.AddPackage("base-os", "1", None)
+        with pkgdb:
+            pkgdb.AddFile("base-os", "/usr/bin/a", "file")
+        # Only the outermost session commits.
+        assert Rows(root) == (None, [])
+        assert pkgdb.FindFile("/usr/bin/a") is not None
+    assert Rows(root) == ({"base-os": "1"}, ["/usr/bin/a"])
+
+
+def test_nested_session_rollback(tmpdir):
+    # Rolling back a nested session discards everything done in the
+    # outer one, even though it is ended with commit=True.
+    root = str(tmpdir)
+    pkgdb = Configuration.PackageDB(root)
+    pkgdb.StartSession()
+    pkgdb.AddPackage("base-os", "1", None)
+    pkgdb.StartSession()
+    pkgdb.AddFile("base-os", "/usr/bin/a", "file")
+    pkgdb.EndSession(commit=False)
+    pkgdb.AddFile("base-os", "/usr/bin/b", "file")
+    pkgdb.EndSession(commit=True)
+    assert Rows(root) == (None, [])
+
+    # The next session starts afresh.
+    with pkgdb:
+        pkgdb.AddPackage("base-os", "2", None)
+    assert Rows(root) == ({"base-os": "2"}, [])
+    with pytest.raises(Exception):
+        pkgdb.EndSession()
+
+
+def test_session_context_rolls_back_on_exception(tmpdir):
+    root = str(tmpdir)
+    pkgdb = Configuration.PackageDB(root)
+    with pytest.raises(KeyError):
+        with pkgdb:
+            pkgdb.AddPackage("base-os", "1", None)
+            with pkgdb:
+                pkgdb.AddFile("base-os", "/usr/bin/a", "file")
+                raise KeyError("base-os")
+    assert Rows(root) == (None, [])
+    assert os.path.exists(os.path.join(root, Configuration.PackageDB.DB_NAME))
+
+
+def MakeFreePages(root, count=5000):
+    # Add, then remove, count file entries, leaving free pages behind.
+    pkgdb = Configuration.PackageDB(root)
+    paths = ["/usr/local/share/f%06d" % i for i in range(count)]
+    pkgdb.AddFilesBulk([("base-os", path, "file", "0" * 64, 0, 0, 0, 0o644) for path in paths])
+    pkgdb.RemoveFileEntriesBulk(paths)
+    return pkgdb
+
+
+def test_vacuum_below_threshold(tmpdir):
+    root = str(tmpdir)
+    pkgdb = MakeFreePages(root)
+    db_path = os.path.join(root, Configuration.PackageDB.DB_NAME)
+    free_pages = pkgdb.FreePages()
+    size = os.path.getsize(db_path)
+    assert free_pages > 0
+    assert pkgdb.Vacuum(threshold=free_pages + 1) == 0
+    assert pkgdb.FreePages() == free_pages
+    assert os.path.getsize(db_path) == size
+    assert pkgdb.VacuumStats() == {"runs": 0, "pages_reclaimed": 0}
+
+
+def test_vacuum_above_threshold(tmpdir):
+    root = str(tmpdir)
+    pkgdb = MakeFreePages(root)
+    db_path = os.path.join(root, Configuration.PackageDB.DB_NAME)
+    free_pages = pkgdb.FreePages()
+    size = os.path.getsize(db_path)
+    reclaimed = pkgdb.Vacuum(threshold=free_pages)
+    assert reclaimed >= free_pages
+    assert pkgdb.FreePages() == 0
+    assert os.path.getsize(db_path) < size
+    assert pkgdb.VacuumStats() == {"runs": 1, "pages_reclaimed": reclaimed}
+    # Nothing is left to reclaim, so the default threshold skips it.
+    assert pkgdb.Vacuum() == 0
+    assert pkgdb.VacuumStats() == {"runs": 1, "pages_reclaimed": reclaimed}
+
+
+def test_vacuum_during_session(tmpdir):
+    pkgdb = MakeFreePages(str(tmpdir))
+    with pkgdb:
+        with pytest.raises(Exception):
+            pkgdb.Vacuum(threshold=0)
+
+
+def Schema(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        indexes = sorted(row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+    finally:
+        conn.close()
+    return (version, indexes)
+
+
+def test_schema_upgrade(tmpdir):
+    # A pkgdb as it was before schema versions:  just the tables.
+    root = str(tmpdir)
+    db_path = os.path.join(root, Configuration.PackageDB.DB_NAME)
+    os.makedirs(os.path.dirname(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE packages(name text primary key, version text not null)")
+    conn.execute("CREATE TABLE scripts(package text not null, type text not null, script text not null)")
+    conn.execute("""CREATE TABLE files(package text not null, path text primary key,
+        kind text not null, checksum text, uid integer, gid integer, flags integer, mode integer)""")
+    conn.execute("INSERT INTO packages VALUES('base-os', '1')")
+    conn.execute("INSERT INTO files VALUES('base-os', '/usr/bin/a', 'file', '', 0, 0, 0, 420)")
+    conn.commit()
+    conn.close()
+    assert Schema(db_path) == (0, [])
+
+    pkgdb = Configuration.PackageDB(root)
+    assert Schema(db_path) == (Configuration.PKGDB_SCHEMA_VERSION,
+                               ["files_package_kind", "scripts_package_type"])
+    assert pkgdb.FindPackage("base-os") == {"base-os": "1"}
+    assert [f["path"] for f in pkgdb.FindFilesForPackage("base-os")] == ["/usr/bin/a"]
+
+    # Once upgraded, opening it again doesn't run the upgrades:  an
+    # index that has gone away isn't put back.
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP INDEX scripts_package_type")
+    conn.commit()
+    conn.close()
+    Configuration.PackageDB(root)
+    assert Schema(db_path) == (Configuration.PKGDB_SCHEMA_VERSION, ["files_package_kind"])
+
+
+def test_schema_new_database(tmpdir):
+    root = str(tmpdir)
+    Configuration.PackageDB(root)
+    assert Schema(os.path.join(root, Configuration.PackageDB.DB_NAME)) == (
+        Configuration.PKGDB_SCHEMA_VERSION, ["files_package_kind", "scripts_package_type"])
+
+
+def test_remove_file_entries_bulk(tmpdir):
+    # RemoveFileEntriesBulk() leaves the pkgdb just as calling
+    # RemoveFileEntry() for each path does, including for a path that
+    # another package has since taken over (the files table only has
+    # one row per path), paths that aren't there, and duplicates.
+    rows = [
+        ("base-os", "/usr/bin/a", "file", "1" * 64, 0, 0, 0, 0o755),
+        ("base-os", "/usr/bin/b", "file", "2" * 64, 0, 0, 0, 0o755),
+        ("base-os", "/usr/share/base", "dir", "", 0, 0, 0, 0o755),
+        ("freenas", "/usr/bin/c", "file", "3" * 64, 0, 0, 0, 0o755),
+        ("freenas", "/usr/share/base/shared", "file", "4" * 64, 0, 0, 0, 0o644),
+    ]
+    # base-os's delta removes these; freenas now owns the shared file.
+    removed = ["/usr/bin/b", "/usr/share/base/shared", "/usr/share/base",
+               "/usr/bin/missing", "/usr/bin/b"]
+    results = []
+    for bulk in (False, True):
+        root = str(tmpdir.join("bulk" if bulk else "rows"))
+        pkgdb = Configuration.PackageDB(root)
+        pkgdb.AddPackage("base-os", "1", None)
+        pkgdb.AddPackage("freenas", "1", None)
+        pkgdb.AddFilesBulk(rows)
+        if bulk:
+            pkgdb.RemoveFileEntriesBulk(removed)
+        else:
+            for path in removed:
+                pkgdb.RemoveFileEntry(path)
+        results.append((sorted(sorted(f.items()) for f in pkgdb.FindFilesForPackage()),
+                        pkgdb.FindPackage("base-os"), pkgdb.FindPackage("freenas")))
+    assert results[0] == results[1]
+    assert sorted(dict(f)["path"] for f in results[1][0]) == ["/usr/bin/a", "/usr/bin/c"]
+
+
+def test_remove_file_entries_bulk_in_session(tmpdir):
+    root = str(tmpdir)
+    pkgdb = Configuration.PackageDB(root)
+    pkgdb.AddFilesBulk([("base-os", path, "file", "", 0, 0, 0, 0o644)
+                        for path in ("/usr/bin/a", "/usr/bin/b")])
+    with pytest.raises(KeyError):
+        with pkgdb:
+            pkgdb.RemoveFileEntriesBulk(["/usr/bin/a", "/usr/bin/b"])
+            assert pkgdb.FindFilesForPackage() == []
+            raise KeyError("base-os")
+    assert Rows(root)[1] == ["/usr/bin/a", "/usr/bin/b"]
@@ -0,0 +1,52 @@
+import io
+
+from testlib import LoadTool
+
+import freenasOS.Package as Package
+import freenasOS.Update as Update
+
+
+class DownloadConfiguration(object):
+    # Stands in for Configuration.FindPackageFile:  each package file
+    # is "downloaded" in two steps of the given size.
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def FindPackageFile(self, pkg, save_dir=None, handler=None, **kwargs):
+        size = self.sizes[pkg.Name()]
+        for progress in (50, 100):
+            handler("network", "http://example.com/%s" % pkg.FileName(),
+                    size=size, progress=progress, download_rate=1000)
+        return io.BytesIO()
+
+
+def test_download_packages_progress(tmpdir):
+    sizes = {"base-os": 300, "freebsd-world": 100}
+    packages = [Package.Package(name, "1", "0") for name in sorted(sizes)]
+    calls = []
+
+    def get_handler(method, filename, size=None, progress=None, download_rate=None):
+        calls.append((filename, size, progress, download_rate))
+
+    assert Update.DownloadPackages(DownloadConfiguration(sizes), packages, str(tmpdir),
+                                   get_handler=get_handler, workers=1)
+    # Everything reported is for the whole set of downloads.
+    assert all(c[0] == str(tmpdir) for c in calls)
+    assert [c[2] for c in calls] == [25, 50, 75, 100]
+    assert [c[1] for c in calls] == [300, 300, 400, 400]
+    assert calls[-1][3] == 1000
+
+
+def test_update_handler_shows_overall_progress():
+    # Two of the three downloads start before either reports progress,
+    # as they do when they run at once; the progress shown is the
+    # overall progress.
+    shown = []
+    tool = LoadTool("freenas-update/freenas-update.py", "freenas_update")
+    handler = tool.UpdateHandler(lambda progress, details: shown.append(progress))
+    packages = [Package.Package(name, "1", "0") for name in ("base-os", "freebsd-world", "freenas")]
+    handler.check_handler(1, pkg=packages[0], pkgList=packages)
+    handler.check_handler(2, pkg=packages[1], pkgList=packages)
+    for progress in (25, 50, 75, 100):
+        handler.get_handler("network", "/tmp", size=400, progress=progress, download_rate=1000)
+    assert shown == [25, 50, 75, 100]
@@ -0,0 +1,81 @@
+"""
+Support shared by the tests and the benchmarks (bench/), which are
+both run from the source tree.  The library is installed as the
+freenasOS package, but lives in lib/, so importing this registers it
+under that name.  The command-line tools aren't importable by name,
+so LoadTool() loads them as modules.  MakePackage() writes synthetic
+package files.
+"""
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tarfile
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _register_freenasOS():
+    if "freenasOS" in sys.modules:
+        return
+    lib = os.path.join(TOP, "lib")
+    spec = importlib.util.spec_from_file_location("freenasOS",
+                                                  os.path.join(lib, "__init__.py"),
+                                                  submodule_search_locations=[lib])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["freenasOS"] = module
+    spec.loader.exec_module(module)
+
+
+_register_freenasOS()
+
+
+def LoadTool(path, name):
+    # path is relative to the top of the source tree.
+    spec = importlib.util.spec_from_file_location(name, os.path.join(TOP, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def MakePackage(path, name, version, files, mode=0o644, prefix=None):
+    """
+    Write a package file:  +MANIFEST, then the given files (a
+    dictionary of path -> bytes), with their directories.  If prefix
+    is given, it is put in +MANIFEST; the names in the archive are
+    relative, so they are installed (and put in the pkgdb) under it.
+    Returns the sha256 checksum of the package file.
+    """
+    manifest = {
+        "name": name,
+        "version": version,
+        "arch": "freebsd:10:x86:64",
+        "files": {},
+        "directories": {},
+    }
+    if prefix is not None:
+        manifest["prefix"] = prefix
+    dirs = sorted(set(os.path.dirname(f) for f in files))
+    for d in dirs:
+        manifest["directories"][d] = "y"
+    for f, data in files.items():
+        manifest["files"][f] = hashlib.sha256(data).hexdigest()
+    mdata = json.dumps(manifest).encode("utf8")
+    with tarfile.open(path, "w:gz", format=tarfile.PAX_FORMAT) as tf:
+        ti = tarfile.TarInfo("+MANIFEST")
+        ti.size = len(mdata)
+        tf.addfile(ti, io.BytesIO(mdata))
+        for d in dirs:
+            ti = tarfile.TarInfo(d.lstrip("/"))
+            ti.type = tarfile.DIRTYPE
+            ti.mode = 0o755
+            tf.addfile(ti)
+        for f in sorted(files):
+            ti = tarfile.TarInfo(f.lstrip("/"))
+            ti.size = len(files[f])
+            ti.mode = mode
+            tf.addfile(ti, io.BytesIO(files[f]))
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()